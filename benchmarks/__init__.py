@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+"""
+
+Benchmarks of the wiremock driver operations, run against a stand-in
+admin server:
+
+    python -m benchmarks --output bench.json
+    python -m benchmarks --compare bench.json
+
+"""
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+
+Runs the driver benchmarks and writes the results as JSON.
+
+Every operation is run once per mappings count against a fresh stand-in
+server (in a child process), recording its wall time and the admin calls
+it made. The scenario is then run a second time under tracemalloc for
+the peak memory, so that tracing does not skew the timings.
+
+"""
+
+import argparse
+import json
+import logging
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+import logzero
+
+from chaoswm.driver import Wiremock
+from chaoswm.stats import admin_stats
+
+from .admin_server import run_in_process
+
+DEFAULT_SIZES = [100, 1000, 10000, 50000]
+
+# mappings touched by the targeted operations (update_fault, up)
+TARGETED = 10
+
+
+def make_mappings(count: int) -> List[Dict[str, Any]]:
+    return [
+        {
+            "request": {"method": "GET", "url": f"/bench/{i}"},
+            "response": {"status": 200, "body": f"mapping {i}"},
+        }
+        for i in range(count)
+    ]
+
+
+def _targets(count: int) -> List[Dict[str, Any]]:
+    step = max(count // TARGETED, 1)
+    return [
+        {"method": "GET", "url": f"/bench/{i}"}
+        for i in range(0, count, step)[:TARGETED]
+    ]
+
+
+def scenario(w: Wiremock, count: int, single_limit: int) -> List[tuple]:
+    """the operations to measure, in order, as (name, callable) pairs.
+    Each one runs on the server state left by the previous ones"""
+    targets = _targets(count)
+
+    def update_fault():
+        mappings = w.filter_mappings_multi(targets)
+        return w.update_fault(
+            [m for found in mappings for m in found], "EMPTY_RESPONSE"
+        )
+
+    operations = [
+        ("populate_bulk", lambda: w.populate(make_mappings(count), True)),
+        ("filter_mappings", lambda: w.filter_mappings(targets[-1])),
+        ("update_fault", update_fault),
+        ("up", lambda: w.up(targets)),
+        ("delete_all_mappings", w.delete_all_mappings),
+    ]
+    if count <= single_limit:
+        operations.append(
+            ("populate", lambda: w.populate(make_mappings(count)))
+        )
+    return operations
+
+
+def _measure(operation: Callable, trace_memory: bool) -> Dict[str, Any]:
+    admin_stats.reset()
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    operation()
+    wall = time.perf_counter() - start
+    result = {"wall_seconds": wall}
+    if trace_memory:
+        result["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    totals = admin_stats.get()["totals"]
+    result["admin_calls"] = totals["calls"]
+    result["admin_errors"] = totals["errors"]
+    result["bytes_sent"] = totals["bytes_sent"]
+    result["bytes_received"] = totals["bytes_received"]
+    return result
+
+
+def run_size(
+    count: int, latency: float, single_limit: int, trace_memory: bool
+) -> Dict[str, Dict[str, Any]]:
+    url, server = run_in_process(latency)
+    try:
+        with Wiremock(url=url, timeout=60) as w:
+            return {
+                name: _measure(operation, trace_memory)
+                for name, operation in scenario(w, count, single_limit)
+            }
+    finally:
+        server.terminate()
+        server.join()
+
+
+def run(sizes: List[int], latency: float, single_limit: int) -> Dict[str, Any]:
+    results = []
+    for count in sizes:
+        timings = run_size(count, latency, single_limit, False)
+        memory = run_size(count, latency, single_limit, True)
+        for name, result in timings.items():
+            result["peak_memory_bytes"] = memory[name]["peak_memory_bytes"]
+            results.append({"size": count, "operation": name, **result})
+            print(
+                f"{count:>6} {name:<20} {result['wall_seconds']:9.4f}s "
+                f"{result['admin_calls']:>6} calls "
+                f"{result['peak_memory_bytes'] / 1024:10.0f} KiB",
+                file=sys.stderr,
+            )
+
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "latency_seconds": latency,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        },
+        "results": results,
+    }
+
+
+def compare(
+    baseline: Dict[str, Any], current: Dict[str, Any], threshold: float
+) -> bool:
+    """prints the ratio current/baseline of the wall time, admin calls and
+    peak memory of every operation.
+    Returns False if any of them grew by more than threshold"""
+    previous = {(r["size"], r["operation"]): r for r in baseline["results"]}
+    ok = True
+    for result in current["results"]:
+        before = previous.get((result["size"], result["operation"]))
+        if before is None:
+            continue
+        ratios = []
+        for key in ("wall_seconds", "admin_calls", "peak_memory_bytes"):
+            ratio = result[key] / before[key] if before[key] else 1.0
+            ratios.append(f"{key}={ratio:.2f}x")
+            if ratio > 1 + threshold:
+                ok = False
+        print(
+            f"{result['size']:>6} {result['operation']:<20} "
+            + " ".join(ratios)
+        )
+    return ok
+
+
+def main(args: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks", description=__doc__
+    )
+    parser.add_argument(
+        "--sizes",
+        default=",".join(str(size) for size in DEFAULT_SIZES),
+        help="comma separated mappings counts",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="milliseconds added by the stand-in server to each request",
+    )
+    parser.add_argument(
+        "--single-limit",
+        type=int,
+        default=1000,
+        help="largest count populated one mapping per request",
+    )
+    parser.add_argument("--output", help="file the JSON results go to")
+    parser.add_argument(
+        "--compare", help="previous results to compare against"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="relative growth reported as a regression by --compare",
+    )
+    options = parser.parse_args(args)
+    logzero.loglevel(logging.WARNING)
+
+    sizes = [int(size) for size in options.sizes.split(",")]
+    results = run(sizes, options.latency / 1000, options.single_limit)
+
+    if options.output:
+        with open(options.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if options.compare:
+        with open(options.compare, encoding="utf-8") as file:
+            baseline = json.load(file)
+        if not compare(baseline, results, options.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+
+In-process stand-in for the wiremock `/__admin` API, good enough to drive
+the benchmarks without a real wiremock server. It keeps the mappings in
+memory and can add a fixed latency to every admin request.
+
+Only the endpoints used by the drivers are implemented: mappings CRUD,
+bulk import, mappings reset, global settings and server reset.
+
+"""
+
+import json
+import multiprocessing
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+__all__ = ["AdminState", "StandInAdminServer", "run_in_process"]
+
+_MAPPING_PATH = re.compile(r"^/__admin/mappings/([^/]+)$")
+
+
+class AdminState:
+    """mappings and settings of the stand-in server"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.mappings: Dict[str, Dict[str, Any]] = {}
+        self.settings: Dict[str, Any] = {}
+
+    def page(self, limit: int = None, offset: int = 0) -> Dict[str, Any]:
+        with self.lock:
+            mappings = list(self.mappings.values())
+        total = len(mappings)
+        end = total if limit is None else offset + limit
+        return {"mappings": mappings[offset:end], "meta": {"total": total}}
+
+    def add(self, mapping: Dict[str, Any]) -> Dict[str, Any]:
+        mapping = dict(mapping)
+        mapping.setdefault("id", str(uuid.uuid4()))
+        mapping.setdefault("uuid", mapping["id"])
+        with self.lock:
+            self.mappings[mapping["id"]] = mapping
+        return mapping
+
+    def import_mappings(self, body: Dict[str, Any]):
+        options = body.get("importOptions", {})
+        overwrite = options.get("duplicatePolicy", "OVERWRITE") == "OVERWRITE"
+        with self.lock:
+            if options.get("deleteAllNotInImport", False):
+                ids = {m.get("id") for m in body["mappings"]}
+                self.mappings = {
+                    k: v for k, v in self.mappings.items() if k in ids
+                }
+            for mapping in body["mappings"]:
+                mapping = dict(mapping)
+                mapping.setdefault("id", str(uuid.uuid4()))
+                if overwrite or mapping["id"] not in self.mappings:
+                    self.mappings[mapping["id"]] = mapping
+
+    def clear(self):
+        with self.lock:
+            self.mappings = {}
+            self.settings = {}
+
+
+class _AdminHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately: without this every
+    # keep-alive exchange waits for the client's delayed ack
+    disable_nagle_algorithm = True
+
+    # set on the subclass built by StandInAdminServer
+    state: AdminState = None
+    latency: float = 0.0
+
+    def log_message(self, *args):
+        pass
+
+    def _body(self) -> Optional[Any]:
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return None
+        return json.loads(self.rfile.read(length))
+
+    def _reply(self, status: int, payload: Any = None):
+        data = b"" if payload is None else json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self, method: str):
+        if self.latency:
+            time.sleep(self.latency)
+        url = urlsplit(self.path)
+        path = url.path
+        body = self._body()
+        state = self.state
+
+        if path == "/__admin/mappings":
+            if method == "GET":
+                query = parse_qs(url.query)
+                limit = query.get("limit")
+                offset = int(query.get("offset", ["0"])[0])
+                return self._reply(
+                    200,
+                    state.page(int(limit[0]) if limit else None, offset),
+                )
+            if method == "POST":
+                return self._reply(201, state.add(body))
+            if method == "DELETE":
+                with state.lock:
+                    state.mappings = {}
+                return self._reply(200)
+        elif path == "/__admin/mappings/import" and method == "POST":
+            state.import_mappings(body)
+            return self._reply(200)
+        elif path in ("/__admin/mappings/reset", "/__admin/reset"):
+            state.clear()
+            return self._reply(200)
+        elif path == "/__admin/settings":
+            if method == "GET":
+                return self._reply(200, {"settings": state.settings})
+            if method == "POST":
+                state.settings = body
+                return self._reply(200)
+        else:
+            match = _MAPPING_PATH.match(path)
+            if match:
+                return self._handle_mapping(method, match.group(1), body)
+        return self._reply(404, {"errors": [{"title": "Not found"}]})
+
+    def _handle_mapping(self, method: str, stub_id: str, body: Any):
+        state = self.state
+        status, payload = 405, None
+        with state.lock:
+            mapping = state.mappings.get(stub_id)
+            if mapping is None:
+                status = 404
+            elif method == "GET":
+                status, payload = 200, mapping
+            elif method == "PUT":
+                payload = state.mappings[stub_id] = dict(body, id=stub_id)
+                status = 200
+            elif method == "DELETE":
+                del state.mappings[stub_id]
+                status = 200
+        self._reply(status, payload)
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PUT(self):
+        self._handle("PUT")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+
+class StandInAdminServer:
+    """threaded http server answering the wiremock admin API,
+    adding `latency` seconds to every request"""
+
+    def __init__(self, latency: float = 0.0, host: str = "127.0.0.1"):
+        self.state = AdminState()
+        handler = type(
+            "AdminHandler",
+            (_AdminHandler,),
+            {"state": self.state, "latency": latency},
+        )
+        self.httpd = ThreadingHTTPServer((host, 0), handler)
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StandInAdminServer":
+        self._thread = threading.Thread(
+            target=self.httpd.serve_forever, daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> "StandInAdminServer":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def _serve(conn, latency: float):
+    server = StandInAdminServer(latency)
+    conn.send(server.url)
+    conn.close()
+    server.httpd.serve_forever()
+
+
+def run_in_process(
+    latency: float = 0.0,
+) -> Tuple[str, multiprocessing.Process]:
+    """starts the stand-in server in a child process, so that its memory
+    and CPU usage are not mixed with the driver's.
+    Returns the server url and the process to terminate"""
+    parent, child = multiprocessing.Pipe()
+    process = multiprocessing.Process(
+        target=_serve, args=(child, latency), daemon=True
+    )
+    process.start()
+    url = parent.recv()
+    parent.close()
+    return url, process
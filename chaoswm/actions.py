@@ -1,11 +1,18 @@
 # -*- coding: utf-8 -*-
-from typing import Any, Dict, List, Mapping
+import os
+import threading
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+from urllib.parse import urlsplit
 
 from chaoslib.types import Configuration
 from logzero import logger
 
+from .cluster import is_cluster, no_errors, on_nodes, succeeded
+from .codec import dumps, loads
 from .driver import Wiremock
-from .utils import check_configuration, get_wm_params
+from .journal import DEFAULT_MAX_DELETES, start_maintenance, stop_maintenance
+from .mappings import with_id
+from .utils import check_configuration
 
 __all__ = [
     "add_mappings",
@@ -23,35 +30,63 @@ __all__ = [
     "up",
     "reset",
     "reset_mappings",
+    "snapshot_mappings",
+    "restore_mappings",
+    "remove_overlays",
+    "delete_tagged_mappings",
+    "clear_journal",
+    "remove_journal_requests",
+    "trim_journal",
+    "start_journal_maintenance",
+    "stop_journal_maintenance",
 ]
 
+# mappings saved by snapshot_mappings in memory, encoded, by server and name
+_saved_mappings: Dict[Tuple[str, str], bytes] = {}
+_saved_mappings_lock = threading.Lock()
+
 
 def add_mappings(
-    mappings: List[Any], configuration: Configuration = None
+    mappings: List[Any], bulk: bool = True, configuration: Configuration = None
 ) -> List[Any]:
     """adds more mappings to wiremock
+    :param bulk: import the mappings in chunks through the admin import
+    endpoint instead of adding them one by one. Default is True
     returns the list of ids of the mappings added
     """
     if not check_configuration(configuration):
         return []
 
-    params = get_wm_params(configuration)
-    w = Wiremock(url=params["url"], timeout=params["timeout"])
-    return w.populate(mappings)
+    if is_cluster(configuration):
+        # the same ids on all the nodes
+        mappings = [with_id(mapping) for mapping in mappings]
+
+    return on_nodes(configuration, lambda w: w.populate(mappings, bulk=bulk))
 
 
 def populate_from_dir(
-    dir: str = ".", configuration: Configuration = None
+    dir: str = ".",
+    bulk: bool = True,
+    recursive: bool = False,
+    configuration: Configuration = None,
 ) -> List[Any]:
-    """adds all mappings found in the passed folder
+    """adds all mappings found in the json files of the passed folder.
+    A file may hold a single mapping or a list of them, plain or as a
+    wiremock `{"mappings": [...]}` bundle
+    :param bulk: import the mappings in chunks through the admin import
+    endpoint instead of adding them one by one. Default is True
+    :param recursive: look into the subfolders too, except `__files`.
+    Default is False
     returns the list of ids of the mappings added
     """
     if not check_configuration(configuration):
         return []
 
-    params = get_wm_params(configuration)
-    w = Wiremock(url=params["url"], timeout=params["timeout"])
-    return w.populate_from_dir(dir)
+    return on_nodes(
+        configuration,
+        lambda w: w.populate_from_dir(dir, bulk=bulk, recursive=recursive),
+        no_errors,
+    )
 
 
 def delete_mappings(
@@ -67,19 +102,15 @@ def delete_mappings(
 
     filter_opts = filter_opts or {}
 
-    params = get_wm_params(configuration)
-    w = Wiremock(url=params["url"], timeout=params["timeout"])
+    def activity(w: Wiremock) -> Optional[List[Any]]:
+        with w.snapshot():
+            ids = [m["id"] for m in _select_mappings(w, filter, filter_opts)]
+            return w.delete_mappings(ids, w.mappings())
 
-    ids = []
-    for f in filter:
-        mappings = w.filter_mappings(f, **filter_opts)
-        if not mappings:
-            logger.error("No mapping match found for filter %s", f)
-            continue
-
-        for mapping in mappings:
-            ids.append(w.delete_mapping(mapping["id"]))
-    return ids
+    result = on_nodes(configuration, activity)
+    if is_cluster(configuration):
+        return result
+    return result or []
 
 
 def delete_all_mappings(configuration: Configuration = None) -> bool:
@@ -89,9 +120,7 @@ def delete_all_mappings(configuration: Configuration = None) -> bool:
     if not check_configuration(configuration):
         return False
 
-    params = get_wm_params(configuration)
-    w = Wiremock(url=params["url"], timeout=params["timeout"])
-    return w.delete_all_mappings()
+    return on_nodes(configuration, lambda w: w.clear_mappings() == 1)
 
 
 def update_mappings_status_code_and_body(
@@ -117,22 +146,23 @@ def update_mappings_status_code_and_body(
 
     filter_opts = filter_opts or {}
 
-    params = get_wm_params(configuration)
-    w = Wiremock(url=params["url"], timeout=params["timeout"])
+    def activity(w: Wiremock) -> List[Any]:
+        mappings_to_update = _select_mappings(w, filter, filter_opts)
 
-    mappings_to_update: List[Mapping] = []
-    for f in filter:
-        mappings_to_update.extend(w.filter_mappings(f, **filter_opts))
+        if len(mappings_to_update) > 0:
+            return _report_writes(
+                "update_mappings_status_code_and_body",
+                w.update_status_code_and_body(
+                    mappings_to_update,
+                    status_code=status_code,
+                    body=body,
+                    body_file_name=body_file_name,
+                ),
+            )
 
-    if len(mappings_to_update) > 0:
-        return w.update_status_code_and_body(
-            mappings_to_update,
-            status_code=status_code,
-            body=body,
-            body_file_name=body_file_name,
-        )
+        return []
 
-    return []
+    return on_nodes(configuration, activity, no_errors)
 
 
 def update_mappings_fault(
@@ -150,23 +180,20 @@ Default is True
     :param fault: the Wiremock fault to apply to selected mappings
     :return: a list of updated mappings
     """
-    params = get_wm_params(configuration)
-    w = Wiremock(url=params["url"], timeout=params["timeout"])
-
     filter_opts = filter_opts or {}
 
-    mappings_to_update: List[Any] = []
-    for f in filter:
-        mappings = w.filter_mappings(f, **filter_opts)
-        if mappings:
-            mappings_to_update.extend(mappings)
-        else:
-            logger.error("No mappings found")
+    def activity(w: Wiremock) -> List[Any]:
+        mappings_to_update = _select_mappings(w, filter, filter_opts)
+
+        if len(mappings_to_update) > 0:
+            return _report_writes(
+                "update_mappings_fault",
+                w.update_fault(mappings_to_update, fault),
+            )
 
-    if len(mappings_to_update) > 0:
-        return w.update_fault(mappings_to_update, fault)
+        return []
 
-    return []
+    return on_nodes(configuration, activity, no_errors)
 
 
 def down(
@@ -177,9 +204,6 @@ def down(
     as defined in the configuration section (or action attributes)
     Returns the list of delayed mappings
     """
-    params = get_wm_params(configuration)
-    w = Wiremock(url=params["url"], timeout=params["timeout"])
-
     conf = configuration.get("wiremock", {})
     if "defaults" not in conf:
         logger.error("Down defaults not specified in config")
@@ -190,29 +214,31 @@ def down(
         logger.error("Down defaults not specified in config")
         return []
 
-    delayed = []
-    for f in filter:
-        delayed.append(w.chunked_dribble_delay(f, defaults["down"]))
+    def activity(w: Wiremock) -> List[Any]:
+        with w.snapshot():
+            delayed = []
+            for f in filter:
+                delayed.append(w.chunked_dribble_delay(f, defaults["down"]))
+
+            return delayed
 
-    return delayed
+    return on_nodes(configuration, activity, _all_updated)
 
 
 def global_fixed_delay(
     fixedDelay: int = 0, configuration: Configuration = None
 ) -> int:
     """add a fixed delay to all mappings"""
-    params = get_wm_params(configuration)
-    w = Wiremock(url=params["url"], timeout=params["timeout"])
-    return w.global_fixed_delay(fixedDelay)
+    return on_nodes(configuration, lambda w: w.global_fixed_delay(fixedDelay))
 
 
 def global_random_delay(
     delayDistribution: Mapping[str, Any], configuration: Configuration = None
 ) -> int:
     """adds a random delay to all mappings"""
-    params = get_wm_params(configuration)
-    w = Wiremock(url=params["url"], timeout=params["timeout"])
-    return w.global_random_delay(delayDistribution)
+    return on_nodes(
+        configuration, lambda w: w.global_random_delay(delayDistribution)
+    )
 
 
 def fixed_delay(
@@ -222,23 +248,20 @@ def fixed_delay(
     configuration: Configuration = None,
 ) -> List[Any]:
     """adds a fixed delay to a list of mappings"""
-    params = get_wm_params(configuration)
-    w = Wiremock(url=params["url"], timeout=params["timeout"])
-
     filter_opts = filter_opts or {}
 
-    mappings_to_update: List[Any] = []
-    for f in filter:
-        mappings = w.filter_mappings(f, **filter_opts)
-        if mappings:
-            mappings_to_update.extend(mappings)
-        else:
-            logger.error("No mappings found")
+    def activity(w: Wiremock) -> List[Any]:
+        mappings_to_update = _select_mappings(w, filter, filter_opts)
+
+        if len(mappings_to_update) > 0:
+            return _report_writes(
+                "fixed_delay",
+                w.fixed_delay(mappings_to_update, fixedDelayMilliseconds),
+            )
 
-    if len(mappings_to_update) > 0:
-        return w.fixed_delay(mappings_to_update, fixedDelayMilliseconds)
+        return []
 
-    return []
+    return on_nodes(configuration, activity, no_errors)
 
 
 def random_delay(
@@ -247,14 +270,16 @@ def random_delay(
     configuration: Configuration = None,
 ) -> List[Any]:
     """adds a random delay to a list of mapppings"""
-    params = get_wm_params(configuration)
-    w = Wiremock(url=params["url"], timeout=params["timeout"])
 
-    updated = []
-    for f in filter:
-        updated.append(w.random_delay(f, delayDistribution))
+    def activity(w: Wiremock) -> List[Any]:
+        with w.snapshot():
+            updated = []
+            for f in filter:
+                updated.append(w.random_delay(f, delayDistribution))
 
-    return updated
+            return updated
+
+    return on_nodes(configuration, activity, _all_updated)
 
 
 def chunked_dribble_delay(
@@ -263,35 +288,283 @@ def chunked_dribble_delay(
     configuration: Configuration = None,
 ) -> List[Any]:
     """adds a chunked dribble delay to a list of mappings"""
-    params = get_wm_params(configuration)
-    w = Wiremock(url=params["url"], timeout=params["timeout"])
 
-    updated = []
-    for f in filter:
-        updated.append(w.chunked_dribble_delay(f, chunkedDribbleDelay))
+    def activity(w: Wiremock) -> List[Any]:
+        with w.snapshot():
+            updated = []
+            for f in filter:
+                updated.append(w.chunked_dribble_delay(f, chunkedDribbleDelay))
+
+            return updated
 
-    return updated
+    return on_nodes(configuration, activity, _all_updated)
 
 
 def up(filter: List[Any], configuration: Configuration = None) -> List[Any]:
     """deletes all delays connected with a list of mappings"""
-    params = get_wm_params(configuration)
-    w = Wiremock(url=params["url"], timeout=params["timeout"])
-
-    return w.up(filter)
+    return on_nodes(
+        configuration, lambda w: _report_writes("up", w.up(filter)), no_errors
+    )
 
 
 def reset(configuration: Configuration = None) -> int:
     """resets the wiremock server: deletes all mappings!"""
-    params = get_wm_params(configuration)
-    w = Wiremock(url=params["url"], timeout=params["timeout"])
-
-    return w.reset()
+    return on_nodes(configuration, lambda w: w.reset())
 
 
 def reset_mappings(configuration: Configuration = None) -> int:
     """resets the wiremock server: deletes all in-memory mappings!"""
-    params = get_wm_params(configuration)
-    w = Wiremock(url=params["url"], timeout=params["timeout"])
+    return on_nodes(configuration, lambda w: w.reset_mappings())
+
+
+def snapshot_mappings(
+    filter: List[Mapping] = None,
+    filter_opts: Dict[str, Any] = None,
+    name: str = "default",
+    path: str = None,
+    configuration: Configuration = None,
+) -> List[Any]:
+    """saves the current state of the mappings matching the filters (all
+    the mappings when there is no filter), so that `restore_mappings`
+    can roll them back after the experiment.
+    :param name: name of the snapshot kept in memory
+    :param path: file the mappings are saved to, as a wiremock
+    `{"mappings": [...]}` bundle, instead of memory. With several nodes,
+    each one gets its own file, named after the node host and port
+    returns the list of ids of the mappings saved
+    """
+    if not check_configuration(configuration):
+        return []
+
+    filter_opts = filter_opts or {}
+    cluster = is_cluster(configuration)
+
+    def activity(w: Wiremock) -> List[Any]:
+        with w.snapshot():
+            if filter:
+                mappings = _select_mappings(w, filter, filter_opts)
+            else:
+                mappings = w.mappings()
+            # encoded right away: the actions change the mappings in place
+            data = dumps({"mappings": mappings})
+
+        if path:
+            node_path = _node_path(path, w) if cluster else path
+            tmp_path = f"{node_path}.tmp"
+            with open(tmp_path, "wb") as file:
+                file.write(data)
+            os.replace(tmp_path, node_path)
+        else:
+            with _saved_mappings_lock:
+                _saved_mappings[(w.base_url, name)] = data
+
+        logger.info("Saved %d mappings", len(mappings))
+        return [mapping["id"] for mapping in mappings]
+
+    return on_nodes(configuration, activity, mutating=False)
+
+
+def restore_mappings(
+    name: str = "default",
+    path: str = None,
+    configuration: Configuration = None,
+) -> Optional[List[Any]]:
+    """rolls back the mappings saved by `snapshot_mappings`, with a single
+    bulk import. Mappings deleted since the snapshot are created again,
+    mappings added since are left untouched
+    :param name: name of the snapshot kept in memory
+    :param path: file the mappings were saved to
+    returns the list of ids of the mappings restored or None in case of
+    errors
+    """
+    if not check_configuration(configuration):
+        return None
+
+    cluster = is_cluster(configuration)
+
+    def activity(w: Wiremock) -> Optional[List[Any]]:
+        if path:
+            try:
+                node_path = _node_path(path, w) if cluster else path
+                with open(node_path, "rb") as file:
+                    data = file.read()
+            except OSError as e:
+                logger.error("Error reading the mappings snapshot: %s", e)
+                return None
+        else:
+            with _saved_mappings_lock:
+                data = _saved_mappings.get((w.base_url, name))
+            if data is None:
+                logger.error("No mappings snapshot named %s", name)
+                return None
+
+        return w.restore_mappings(loads(data)["mappings"])
+
+    return on_nodes(configuration, activity)
+
+
+def remove_overlays(configuration: Configuration = None) -> List[Any]:
+    """deletes all the overlays written in the `overlay` injection mode,
+    with a single request, putting the original mappings back in service
+    returns the list of ids of the mappings no longer shadowed
+    """
+    if not check_configuration(configuration):
+        return []
+
+    return on_nodes(configuration, lambda w: w.remove_overlays())
+
+
+def delete_tagged_mappings(
+    tag: str = None, action: str = None, configuration: Configuration = None
+) -> bool:
+    """deletes, with a single request, the mappings chaoswm created with a
+    tag (by default the `tag` key of the configuration, one of the two is
+    required) and, if set, by an action such as `populate`. The mappings
+    chaoswm only modified are left in place, `restore_mappings` or `up`
+    put them back
+    returns true if delete was successful and false if not
+    """
+    if not check_configuration(configuration):
+        return False
+
+    return on_nodes(
+        configuration, lambda w: w.remove_tagged_mappings(tag, action) == 1
+    )
+
+
+def clear_journal(configuration: Configuration = None) -> int:
+    """deletes all the requests of the wiremock journal"""
+    return on_nodes(configuration, lambda w: w.clear_journal(), mutating=False)
+
+
+def remove_journal_requests(
+    pattern: Mapping[str, Any], configuration: Configuration = None
+) -> int:
+    """deletes the requests of the journal matching a request pattern,
+    such as `{"method": "GET", "urlPath": "/epg"}`
+    returns the number of requests removed
+    """
+    if not check_configuration(configuration):
+        return -1
+
+    return on_nodes(
+        configuration, lambda w: w.remove_requests(pattern), mutating=False
+    )
+
+
+def trim_journal(
+    max_age: float = None,
+    max_size: int = None,
+    max_deletes: int = None,
+    configuration: Configuration = None,
+) -> int:
+    """deletes the requests of the journal older than max_age seconds and
+    the oldest ones beyond max_size requests. Removing some requests and
+    keeping others downloads them and removes them one request each: with
+    max_deletes, at most that many are removed, the rest by the next calls
+    returns the number of requests removed, -1 in case of errors
+    """
+    if not check_configuration(configuration):
+        return -1
+
+    if max_age is None and max_size is None:
+        logger.error("Neither max_age nor max_size specified")
+        return -1
+
+    return on_nodes(
+        configuration,
+        lambda w: w.trim_journal(max_age, max_size, max_deletes),
+        mutating=False,
+    )
+
+
+def start_journal_maintenance(
+    max_size: int = None,
+    max_age: float = None,
+    interval: float = 30.0,
+    max_deletes: int = DEFAULT_MAX_DELETES,
+    configuration: Configuration = None,
+) -> bool:
+    """starts a background loop trimming the journal every interval
+    seconds, so that it keeps at most max_size requests, none of them older
+    than max_age seconds. Each pass removes at most max_deletes requests.
+    The loop runs until `stop_journal_maintenance` or the end of the
+    experiment (with the `chaoswm.control` control)
+    """
+    if not check_configuration(configuration):
+        return False
+
+    if max_age is None and max_size is None:
+        logger.error("Neither max_age nor max_size specified")
+        return False
+
+    def activity(w: Wiremock) -> bool:
+        start_maintenance(w, max_size, max_age, interval, max_deletes)
+        return True
+
+    return on_nodes(configuration, activity, mutating=False)
+
+
+def stop_journal_maintenance(configuration: Configuration = None) -> int:
+    """stops the journal maintenance loop
+    returns the number of requests it removed, -1 if no loop was running
+    """
+    if not check_configuration(configuration):
+        return -1
+
+    def activity(w: Wiremock) -> int:
+        removed = stop_maintenance(w)
+        if removed is None:
+            logger.error("No journal maintenance running")
+            return -1
+        return removed
+
+    return on_nodes(configuration, activity, mutating=False)
+
+
+###############################################################################
+# Private functions
+###############################################################################
+def _select_mappings(
+    w: Wiremock, filter: List[Mapping], filter_opts: Dict[str, Any]
+) -> List[Mapping]:
+    """matches all the filters in a single pass over the mappings
+    Returns the matching mappings, without duplicates"""
+    selected = {}
+    matches = w.filter_mappings_multi(filter, **filter_opts)
+    for f, mappings in zip(filter, matches):
+        if not mappings:
+            logger.error("No mappings found for filter %s", f)
+        for mapping in mappings:
+            selected.setdefault(mapping["id"], mapping)
+    return list(selected.values())
+
+
+def _report_writes(action: str, result: Any) -> Any:
+    """logs the ids of the mappings an update wrote and the ones it skipped
+    as already up to date
+    Returns the result unchanged"""
+    written = getattr(result, "written", None)
+    if written is not None:
+        logger.info(
+            "[%s]: %d mappings written %s, %d already up to date %s",
+            action,
+            len(written),
+            written,
+            len(result.skipped),
+            result.skipped,
+        )
+    return result
+
+
+def _all_updated(w: Wiremock, result: List[Any]) -> bool:
+    """check of the activities returning one updated mapping per filter"""
+    return succeeded(w, result) and all(r is not None for r in result)
+
 
-    return w.reset_mappings()
+def _node_path(path: str, w: Wiremock) -> str:
+    """the snapshot file of a node of a cluster: its host and port are
+    added to the file name"""
+    node = urlsplit(w.base_url).netloc.replace(":", "_")
+    root, ext = os.path.splitext(path)
+    return f"{root}.{node}{ext}"
@@ -0,0 +1,1368 @@
+# -*- coding: utf-8 -*-
+"""
+
+Transport independent implementation of the wiremock admin API, shared by
+the blocking driver (`chaoswm.driver.Wiremock`) and the asyncio driver
+(`chaoswm.aio.AsyncWiremock`).
+
+Every admin operation is a generator method of `AdminAPI`, named after the
+public method with a leading underscore. It builds its requests as `Call`
+values, yields them and gets the responses back, then handles them:
+
+    @operation
+    def _mapping_by_id(self, stub_id):
+        response = yield Call("GET", f"{self.mappings_url}/{stub_id}")
+        ...
+
+Yielding a list of operations runs them concurrently and gets the list of
+their results back. Operations compose with `yield from`.
+
+The drivers only implement the transport: `_run` drives an operation,
+sending its calls through requests or httpx, and each `@operation` gets a
+public method of the same name without the underscore, blocking or
+coroutine.
+
+"""
+
+import functools
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generator,
+    Iterable,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+from logzero import logger
+
+from .codec import dumps, loads
+from .journal import events_to_trim, iso_date
+from .loader import batched, iter_dir_mappings, report_progress
+from .mappings import (
+    AVAILABLE_FAULTS,
+    CompiledFilter,
+    MappingsSnapshot,
+    MultiFilter,
+    apply_change,
+    check_chunked_dribble_delay,
+    check_status_code,
+    deletion_pattern,
+    make_overlay,
+    mark_for_deletion,
+    overlay_id,
+    overlay_target,
+    overlays_pattern,
+    remove_delays,
+    set_fixed_delay,
+    set_status_code_and_body,
+    stamp,
+    tagged_pattern,
+    unstamp_modified,
+    with_id,
+)
+from .utils import (
+    DEFAULT_IMPORT_CHUNK_SIZE,
+    DEFAULT_MAX_WORKERS,
+    DEFAULT_PAGE_SIZE,
+)
+
+__all__ = [
+    "DUPLICATE_POLICIES",
+    "INJECTION_MODES",
+    "Call",
+    "Operation",
+    "operation",
+    "WriteResult",
+    "AdminAPI",
+]
+
+DUPLICATE_POLICIES = ["OVERWRITE", "IGNORE"]
+
+INJECTION_MODES = ["rewrite", "overlay"]
+
+
+class Call(NamedTuple):
+    """an admin request: the body is already encoded"""
+
+    method: str
+    url: str
+    body: Optional[bytes] = None
+    params: Optional[Dict[str, Any]] = None
+
+
+# yields Call values or lists of operations, returns the result
+Operation = Generator[Any, Any, Any]
+
+
+def operation(func: Callable[..., Operation]) -> Callable[..., Operation]:
+    """marks a generator method of AdminAPI as an admin operation, which
+    the drivers expose as a public method"""
+    func.is_operation = True
+    return func
+
+
+class WriteResult(list):
+    """the ids returned by a write of several mappings, with the details of
+    that call: the errors of the mappings or files not written, by id or
+    path, and the ids actually written and the ones skipped as already up
+    to date"""
+
+    def __init__(
+        self,
+        ids: Iterable[str] = (),
+        errors: Dict[str, str] = None,
+        written: List[str] = None,
+        skipped: List[str] = None,
+    ):
+        super().__init__(ids)
+        self.errors = errors or {}
+        self.written = list(self) if written is None else written
+        self.skipped = skipped or []
+
+
+class AdminAPI:
+    """settings, state and operations of a wiremock driver, whatever its
+    transport"""
+
+    # errors of the transport, caught by the operations that go on after
+    # a failed call
+    transport_errors: Tuple[type, ...] = ()
+
+    def __init__(
+        self,
+        host: str = None,
+        port: str = None,
+        url: str = None,
+        timeout: int = 1,
+        import_chunk_size: int = DEFAULT_IMPORT_CHUNK_SIZE,
+        duplicate_policy: str = "OVERWRITE",
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        snapshot_ttl: float = None,
+        injection: str = "rewrite",
+        tag: str = None,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        streaming: bool = False,
+    ):
+        if host and port:
+            url = f"http://{host}:{port}"
+        self.base_url = f"{url}/__admin"
+        self.mappings_url = f"{self.base_url}/mappings"
+        self.settings_url = f"{self.base_url}/settings"
+        self.reset_url = f"{self.base_url}/reset"
+        self.reset_mappings_url = f"{self.mappings_url}/reset"
+        self.import_url = f"{self.mappings_url}/import"
+        self.find_by_metadata_url = f"{self.mappings_url}/find-by-metadata"
+        self.remove_by_metadata_url = f"{self.mappings_url}/remove-by-metadata"
+        self.requests_url = f"{self.base_url}/requests"
+        self.requests_count_url = f"{self.requests_url}/count"
+        self.requests_find_url = f"{self.requests_url}/find"
+        self.requests_remove_url = f"{self.requests_url}/remove"
+        self.timeout = timeout
+        self.import_chunk_size = import_chunk_size
+        self.duplicate_policy = duplicate_policy
+        self.max_workers = max_workers
+        self.page_size = page_size
+        self.streaming = streaming
+        if injection not in INJECTION_MODES:
+            logger.error(
+                "Injection mode %s not available, using rewrite", injection
+            )
+            injection = "rewrite"
+        self.injection = injection
+        # recorded in the metadata of the mappings written
+        self.tag = tag
+        # overlays written by this driver, by id (chaoswm.driver.MappingRef)
+        self._overlays: Dict[str, Any] = {}
+        self._snapshot = MappingsSnapshot(ttl=snapshot_ttl)
+        self.headers = {
+            "Accept": "application/json",
+            "Content-Type": "application/json",
+        }
+
+    def __init_subclass__(cls, **kwargs: Any):
+        super().__init_subclass__(**kwargs)
+        for name in dir(AdminAPI):
+            func = getattr(AdminAPI, name)
+            if not getattr(func, "is_operation", False):
+                continue
+            public = name.lstrip("_")
+            current = getattr(cls, public, None)
+            if current is None or getattr(current, "operation", None):
+                setattr(cls, public, cls._bind(func, public))
+
+    @classmethod
+    def _bind(
+        cls, func: Callable[..., Operation], name: str
+    ) -> Callable[..., Any]:
+        """the public method running the operation func on the transport"""
+        raise NotImplementedError()
+
+    @staticmethod
+    def _named(method: Callable[..., Any], func: Callable, name: str):
+        """gives the public method of an operation its name and docstring"""
+        functools.update_wrapper(method, func)
+        method.__name__ = name
+        method.__qualname__ = f"{func.__qualname__.split('.')[0]}.{name}"
+        method.operation = func
+        return method
+
+    @contextmanager
+    def snapshot(self):
+        """caches the mappings list until the end of the block, so that
+        all the filters of an action are matched against one download.
+        Writes to the mappings through this driver invalidate the cache"""
+        self._snapshot.open()
+        try:
+            yield self
+        finally:
+            self._snapshot.close()
+
+    def invalidate_snapshot(self):
+        """drops the cached mappings list"""
+        self._snapshot.invalidate()
+
+    def _paged(self, limit: int) -> bool:
+        """whether a search for limit matches should page through the
+        mappings: only when it may stop early, and when the whole list is
+        not about to be kept in the snapshot anyway"""
+        return limit > 0 and not self._snapshot.enabled
+
+    def _streamed(self) -> bool:
+        """whether searches should stream the mappings list: in streaming
+        mode, unless the whole list is cached anyway"""
+        return self.streaming and not self._snapshot.enabled
+
+    def _fail(self, message: str, response: Any) -> None:
+        """logs the error response of an admin call"""
+        logger.error("%s: %s", message, response.text)
+
+    @operation
+    def _mappings(self) -> Operation:
+        """
+        retrieves all mappings (from the snapshot, when one is cached)
+        returns the array of mappings found
+        """
+        cached = self._snapshot.get()
+        if cached is not None:
+            return cached
+
+        mappings = yield from self._fetch_mappings()
+        return [] if mappings is None else mappings
+
+    @operation
+    def _fetch_mappings(self) -> Operation:
+        """downloads all mappings, refreshing the snapshot
+        returns the array of mappings found or None in case of errors
+        """
+        response = yield Call("GET", self.mappings_url)
+        if response.status_code != 200:
+            self._fail("[mappings]:Error retrieving mappings", response)
+            return None
+
+        res = loads(response.content)
+        self._snapshot.store(res["mappings"])
+        return res["mappings"]
+
+    @operation
+    def _fetch_mappings_page(
+        self, offset: int = 0, limit: int = None
+    ) -> Operation:
+        """downloads a page of limit mappings (page_size by default),
+        starting at offset
+        returns the mappings of the page and the total number of mappings,
+        or None in case of errors
+        """
+        response = yield Call(
+            "GET",
+            self.mappings_url,
+            params={"offset": offset, "limit": limit or self.page_size},
+        )
+        if response.status_code != 200:
+            self._fail("[mappings]:Error retrieving mappings", response)
+            return None
+
+        res = loads(response.content)
+        return res["mappings"], res.get("meta", {}).get("total", 0)
+
+    def _scan(self, visit: Callable[[Mapping[str, Any]], bool]) -> Operation:
+        """passes the mappings to visit, downloading them one page of
+        page_size mappings at a time, until visit returns True. Mappings
+        written by others during the scan may be missed or seen twice"""
+        offset = 0
+        while True:
+            page = yield from self._fetch_mappings_page(offset)
+            if page is None:
+                return
+            mappings, total = page
+            for mapping in mappings:
+                if visit(mapping):
+                    return
+            offset += len(mappings)
+            if not mappings or offset >= total:
+                return
+
+    @operation
+    def _full_mappings(self, mappings: List[Mapping[str, Any]]) -> Operation:
+        """downloads concurrently the full version of projected mappings
+        Returns them in input order, without the ones that could not be
+        retrieved"""
+        full = yield [self._mapping_by_id(m["id"]) for m in mappings]
+        return [mapping for mapping in full if mapping != -1]
+
+    @operation
+    def _mapping_by_id(self, stub_id: str) -> Operation:
+        """retrieve the stub mapping configuration from wiremock with
+        with the given id"""
+        response = yield Call("GET", f"{self.mappings_url}/{stub_id}")
+        if response.status_code != 200:
+            self._fail("[mapping_by_id]:Error retrieving mapping", response)
+            return -1
+
+        return loads(response.content)
+
+    @operation
+    def _filter_mapping(self, _filter: Mapping, strict: bool = True):
+        """search for matching stub mappings in wiremock, downloading
+        only the pages of mappings needed to find the first match
+        Returns the first matching stub mapping"""
+        matching_mappings = yield from self._filter_mappings(
+            _filter, strict, limit=1
+        )
+        return matching_mappings[0] if len(matching_mappings) > 0 else None
+
+    @operation
+    def _filter_mappings(
+        self,
+        _filter: Mapping,
+        strict: bool = True,
+        limit: int = 0,
+        mappings: List[Mapping] = None,
+    ) -> Operation:
+        """search for matching stub mappings in wiremock
+        (or in the passed list of already fetched mappings)
+        With a limit, the mappings are downloaded one page at a time until
+        limit of them match. In streaming mode, the mappings are matched as
+        they are parsed, on their projected fields, and only the matches are
+        downloaded in full
+        Returns a list of matchimg mappings"""
+        match = CompiledFilter(_filter, strict).match
+        matching_mappings = []
+
+        def visit(mapping: Mapping) -> bool:
+            """Returns True once limit mappings matched"""
+            if match(mapping):
+                matching_mappings.append(mapping)
+            return 0 < limit <= len(matching_mappings)
+
+        if mappings is None and self._streamed():
+            self._visit_projected(visit)
+            return (yield from self._full_mappings(matching_mappings))
+
+        if mappings is None and self._paged(limit):
+            yield from self._scan(visit)
+            return matching_mappings
+
+        if mappings is None:
+            mappings = yield from self._mappings()
+        for mapping in mappings:
+            if visit(mapping):
+                break
+        return matching_mappings
+
+    @operation
+    def _filter_mappings_multi(
+        self,
+        filters: List[Mapping],
+        strict: bool = True,
+        limit: int = 0,
+        mappings: List[Mapping] = None,
+    ) -> Operation:
+        """search for the mappings matching each of the filters, with a
+        single pass over the mappings
+        Returns, for each filter, the list of matching mappings"""
+        selection = MultiFilter(filters, strict).selection(limit)
+        if mappings is None and self._streamed():
+            self._visit_projected(selection.add)
+            matched = {m["id"]: m for ms in selection.selected for m in ms}
+            full = yield from self._full_mappings(list(matched.values()))
+            by_id = {m["id"]: m for m in full}
+            return [
+                [by_id[m["id"]] for m in matches if m["id"] in by_id]
+                for matches in selection.selected
+            ]
+
+        if mappings is None and self._paged(limit):
+            yield from self._scan(selection.add)
+            return selection.selected
+
+        if mappings is None:
+            mappings = yield from self._mappings()
+        for mapping in mappings:
+            if selection.add(mapping):
+                break
+        return selection.selected
+
+    def _visit_projected(self, visit: Callable[[Mapping[str, Any]], bool]):
+        """passes the projected mappings of the streamed mappings list to
+        visit until it returns True. Only drivers with streaming support
+        enable streaming"""
+        stream = self.iter_mappings_projected()
+        try:
+            for mapping in stream:
+                if visit(mapping):
+                    break
+        finally:
+            stream.close()
+
+    @operation
+    def _mapping_by_request_exact_match(
+        self, request: Mapping[str, Any] = None
+    ) -> Operation:
+        """match mappings in wiremock using an exact match
+        on the request metadata (an index lookup when a snapshot is cached)"""
+        mappings = yield from self._mappings()
+        cached, mapping = self._snapshot.find_by_request(request)
+        if cached:
+            return mapping
+
+        for mapping in mappings:
+            if mapping["request"] == request:
+                return mapping
+        return None
+
+    @operation
+    def _populate(
+        self, mappings: Mapping[str, Any], bulk: bool = False
+    ) -> Operation:
+        """Populate: adds all passed mappings, concurrently
+        (through the bulk import endpoint if bulk is True)
+        Returns the list of ids of mappings created
+        """
+        if isinstance(mappings, list) is False:
+            logger.error("[populate]:ERROR: mappings should be a list")
+            return None
+
+        mappings = [
+            stamp(dict(mapping), self.tag, "populate") for mapping in mappings
+        ]
+        if bulk:
+            return (yield from self._import_mappings(mappings))
+
+        ids = yield [self._add_mapping(mapping) for mapping in mappings]
+        if None in ids:
+            logger.error("[populate]:ERROR adding a mapping")
+            return None
+
+        return ids
+
+    @operation
+    def _populate_from_dir(
+        self,
+        _dir: str,
+        bulk: bool = False,
+        recursive: bool = False,
+        progress: Callable[[Dict[str, Any]], None] = None,
+    ) -> Operation:
+        """adds all the mappings found in the json files of a directory,
+        and of its subdirectories when recursive (see `chaoswm.loader`),
+        streaming them to wiremock in batches of import_chunk_size mappings
+        (through the bulk import endpoint if bulk is True).
+        The errors of the files that could not be loaded are kept in the
+        errors of the result, by path.
+        :param progress: called after each batch with the number of
+        mappings added so far, the number of failed files and the last
+        file read
+        Returns the list of ids of mappings created
+        or None in case of errors
+        """
+        if not os.path.exists(_dir):
+            logger.error(
+                "[populate_from_dir]: directory %s does not exists", _dir
+            )
+            return None
+
+        ids = []
+        errors = {}
+        mappings = (
+            (path, stamp(mapping, self.tag, "populate_from_dir"))
+            for path, mapping in iter_dir_mappings(_dir, recursive, errors)
+        )
+        for batch in batched(mappings, self.import_chunk_size):
+            if bulk:
+                chunk = [with_id(mapping) for _, mapping in batch]
+                imported = yield from self._import_chunk(
+                    chunk, self.duplicate_policy
+                )
+                if not imported:
+                    logger.error(
+                        "[populate_from_dir]: %d mappings imported before "
+                        "the error",
+                        len(ids),
+                    )
+                    return None
+                ids.extend(mapping["id"] for mapping in chunk)
+            else:
+                added = yield [
+                    self._add_mapping(mapping) for _, mapping in batch
+                ]
+                for (path, _), stub_id in zip(batch, added):
+                    if stub_id is None:
+                        errors[path] = "wiremock rejected a mapping"
+                    else:
+                        ids.append(stub_id)
+            report_progress(progress, len(ids), errors, batch[-1][0])
+
+        if errors:
+            logger.error(
+                "[populate_from_dir]: %d files not fully loaded: %s",
+                len(errors),
+                errors,
+            )
+        return WriteResult(ids, errors)
+
+    @operation
+    def _import_mappings(
+        self,
+        mappings: List[Mapping[str, Any]],
+        chunk_size: int = None,
+        duplicate_policy: str = None,
+    ) -> Operation:
+        """imports mappings in chunks through the admin import endpoint.
+        Mappings without an id get one assigned client side, as wiremock
+        does not return the ids of imported mappings.
+        Returns the list of ids of mappings imported, in input order,
+        or None in case of errors
+        """
+        chunk_size = chunk_size or self.import_chunk_size
+        duplicate_policy = duplicate_policy or self.duplicate_policy
+
+        if isinstance(mappings, list) is False:
+            logger.error("[import_mappings]: mappings should be a list")
+            return None
+
+        if duplicate_policy not in DUPLICATE_POLICIES:
+            logger.error(
+                "[import_mappings]: duplicate policy %s not available",
+                duplicate_policy,
+            )
+            return None
+
+        ids = []
+        for start in range(0, len(mappings), chunk_size):
+            end = start + chunk_size
+            chunk = [with_id(mapping) for mapping in mappings[start:end]]
+
+            imported = yield from self._import_chunk(chunk, duplicate_policy)
+            if not imported:
+                logger.error(
+                    "[import_mappings]: %d mappings imported before the "
+                    "error",
+                    len(ids),
+                )
+                return None
+
+            ids.extend(mapping["id"] for mapping in chunk)
+        return ids
+
+    @operation
+    def _restore_mappings(
+        self, mappings: List[Mapping[str, Any]]
+    ) -> Operation:
+        """puts back mappings saved earlier exactly as they were, with a
+        single import request overwriting the mappings with the same ids
+        Returns the list of ids of mappings restored or None in case of
+        errors
+        """
+        return (
+            yield from self._import_mappings(
+                mappings,
+                chunk_size=max(len(mappings), 1),
+                duplicate_policy="OVERWRITE",
+            )
+        )
+
+    def _import_chunk(
+        self,
+        mappings: List[Mapping[str, Any]],
+        duplicate_policy: str,
+        delete_all_not_in_import: bool = False,
+        keep_snapshot: bool = False,
+    ) -> Operation:
+        """sends a single import request. With keep_snapshot, the imported
+        mappings are applied to the cached copy instead of invalidating it
+        Returns True if wiremock accepted the import"""
+        if not keep_snapshot:
+            self._snapshot.invalidate()
+        response = yield Call(
+            "POST",
+            self.import_url,
+            dumps(
+                {
+                    "mappings": mappings,
+                    "importOptions": {
+                        "duplicatePolicy": duplicate_policy,
+                        "deleteAllNotInImport": delete_all_not_in_import,
+                    },
+                }
+            ),
+        )
+        if response.status_code != 200:
+            self._fail("[import_mappings]: Error importing mappings", response)
+            self._snapshot.invalidate()
+            return False
+        if keep_snapshot:
+            for mapping in mappings:
+                self._snapshot.replace(mapping)
+        return True
+
+    @operation
+    def _update_fault(
+        self, mappings: Mapping[str, Any], fault: str
+    ) -> Operation:
+        """
+        Updates fault status of stub mappings
+        Returns the list of ids of the updated mappings
+        """
+        if isinstance(mappings, list) is False:
+            logger.error("[update_fault] mappings parameter should be a list")
+            return None
+
+        if fault not in AVAILABLE_FAULTS:
+            logger.error("[update_fault] fault %s not available.", fault)
+            return None
+
+        def change(mapping: Mapping[str, Any]):
+            mapping["response"]["fault"] = fault
+
+        return (
+            yield from self._update_changed(mappings, change, "update_fault")
+        )
+
+    @operation
+    def _update_status_code_and_body(
+        self,
+        mappings: Mapping[str, Any],
+        status_code: str,
+        body: str = None,
+        body_file_name: str = None,
+    ) -> Operation:
+        """changes the response status code and body of the mappings
+        Returns the list of ids of the updated mappings
+        """
+        if isinstance(mappings, list) is False:
+            logger.error("[populate]:ERROR: mappings should be a list")
+            return None
+
+        if not check_status_code(status_code):
+            return None
+
+        def change(mapping: Mapping[str, Any]):
+            set_status_code_and_body(
+                mapping, status_code, body=body, body_file_name=body_file_name
+            )
+
+        return (
+            yield from self._update_changed(
+                mappings, change, "update_status_code_and_body"
+            )
+        )
+
+    @operation
+    def _update_changed(
+        self,
+        mappings: List[Mapping[str, Any]],
+        change: Callable[[Mapping[str, Any]], Any],
+        action: str = None,
+    ) -> Operation:
+        """applies change to the mappings and writes only the ones it
+        actually changed, comparing their content hashes. The mappings
+        written are stamped as modified by action, when set
+        Returns the list of ids of the mappings now changed, in input order,
+        with the ids written and skipped and the errors of the mappings not
+        written
+        """
+        if self.injection == "overlay":
+            return (yield from self._put_overlays(mappings, change, action))
+
+        changed, skipped = apply_change(mappings, change)
+        if action is not None:
+            for mapping in changed:
+                stamp(mapping, self.tag, action, modified=True)
+        written = yield from self._update_mappings(changed)
+        if skipped:
+            logger.info(
+                "%d mappings already up to date, not written", len(skipped)
+            )
+
+        done = set(written).union(skipped)
+        return WriteResult(
+            [m["id"] for m in mappings if m["id"] in done],
+            written.errors,
+            list(written),
+            skipped,
+        )
+
+    @operation
+    def _update_changed_mapping(
+        self,
+        mapping: Mapping[str, Any],
+        change: Callable[[Mapping[str, Any]], Any],
+        action: str = None,
+    ) -> Operation:
+        """applies change to a single mapping and writes it only if it
+        actually changed
+        Returns the mapping as in wiremock or None in case of errors"""
+        if self.injection == "overlay":
+            shadowed = yield from self._put_overlays([mapping], change, action)
+            if not shadowed:
+                return None
+            return self._overlays[overlay_id(shadowed[0])].payload
+
+        changed, _ = apply_change([mapping], change)
+        if not changed:
+            return mapping
+
+        stamp(mapping, self.tag, action, modified=True)
+        return (yield from self._update_mapping(mapping["id"], mapping))
+
+    @operation
+    def _put_overlays(
+        self,
+        mappings: List[Mapping[str, Any]],
+        change: Callable[[Mapping[str, Any]], Any],
+        action: str = None,
+    ) -> Operation:
+        """applies change to the overlays of the mappings, created on first
+        use, and writes them with a single import. The mappings themselves
+        are left untouched
+        Returns the list of ids of the mappings shadowed, in input order,
+        with the ids of the overlays written, or None in case of errors
+        """
+        overlays = {}
+        targets = []
+        for mapping in mappings:
+            target = overlay_target(mapping) or mapping["id"]
+            stub_id = overlay_id(target)
+            if stub_id in overlays:
+                continue
+            previous = self._overlays.get(stub_id)
+            overlay = make_overlay(mapping, previous and previous.payload)
+            change(overlay)
+            overlays[stub_id] = stamp(overlay, self.tag, action)
+            targets.append(target)
+
+        if not overlays:
+            return WriteResult()
+        imported = yield from self._import_chunk(
+            list(overlays.values()), "OVERWRITE", keep_snapshot=True
+        )
+        if not imported:
+            return None
+
+        # the blocking driver defines MappingRef and imports this module
+        from .driver import MappingRef
+
+        self._overlays.update(
+            (stub_id, MappingRef.of(overlay))
+            for stub_id, overlay in overlays.items()
+        )
+        return WriteResult(targets, written=list(overlays))
+
+    @operation
+    def _remove_overlays(
+        self, mappings: List[Mapping[str, Any]] = None
+    ) -> Operation:
+        """deletes the overlays of the mappings, or all the overlays, with a
+        single remove-by-metadata request
+        Returns the list of ids of the mappings no longer shadowed or None
+        in case of errors"""
+        targets = None
+        if mappings is not None:
+            targets = [overlay_target(m) or m["id"] for m in mappings]
+            if not targets:
+                return []
+
+        removed = yield from self._remove_by_metadata(
+            overlays_pattern(targets)
+        )
+        if removed != 1:
+            return None
+
+        if targets is None:
+            targets = [
+                overlay_target(ref.payload) for ref in self._overlays.values()
+            ]
+        for target in targets:
+            self._overlays.pop(overlay_id(target), None)
+        return targets
+
+    @operation
+    def _find_by_metadata(self, pattern: Mapping[str, Any]) -> Operation:
+        """retrieves the mappings whose metadata match a pattern, such as
+        `{"matchesJsonPath": "$.owner"}`, with a single request
+        returns the mappings found or None in case of errors"""
+        response = yield Call(
+            "POST", self.find_by_metadata_url, dumps(pattern)
+        )
+        if response.status_code != 200:
+            self._fail("[find_by_metadata]: Error finding mappings", response)
+            return None
+
+        return loads(response.content)["mappings"]
+
+    @operation
+    def _remove_by_metadata(self, pattern: Mapping[str, Any]) -> Operation:
+        """deletes the mappings whose metadata match a pattern, with a
+        single request"""
+        response = yield Call(
+            "POST", self.remove_by_metadata_url, dumps(pattern)
+        )
+        self._snapshot.invalidate()
+        if response.status_code != 200:
+            self._fail(
+                "[remove_by_metadata]: Error deleting mappings", response
+            )
+            return -1
+
+        return 1
+
+    @operation
+    def _tagged_mappings(
+        self, tag: str = None, action: str = None, modified: bool = False
+    ) -> Operation:
+        """retrieves the mappings created by chaoswm, or the ones it modified,
+        with a tag (by default the tag of the driver) and by an action, if
+        set"""
+        return (
+            yield from self._find_by_metadata(
+                tagged_pattern(tag or self.tag, action, modified)
+            )
+        )
+
+    @operation
+    def _remove_tagged_mappings(
+        self, tag: str = None, action: str = None
+    ) -> Operation:
+        """deletes the mappings created by chaoswm with a tag (by default the
+        tag of the driver) and by an action, if set. The mappings it only
+        modified are left in place
+        returns 1 if delete was successful and -1 if not"""
+        tag = tag or self.tag
+        if tag is None:
+            logger.error("[remove_tagged_mappings]: A tag is required")
+            return -1
+        return (
+            yield from self._remove_by_metadata(tagged_pattern(tag, action))
+        )
+
+    @operation
+    def _update_mappings(self, mappings: List[Mapping[str, Any]]) -> Operation:
+        """updates the passed mappings concurrently, up to max_workers at a
+        time. Failures do not stop the other updates
+        Returns the list of ids of the updated mappings, in input order,
+        with the error of each mapping that could not be updated
+        """
+        errors = {}
+
+        def update(mapping: Mapping[str, Any]) -> Operation:
+            stub_id = mapping["id"]
+            try:
+                updated = yield from self._update_mapping(stub_id, mapping)
+                if updated is not None:
+                    return True
+                errors[stub_id] = "wiremock rejected the update"
+            except self.transport_errors as e:
+                errors[stub_id] = str(e)
+            return False
+
+        results = yield [update(mapping) for mapping in mappings]
+
+        if errors:
+            logger.error(
+                "[update_mappings]: %d of %d mappings not updated: %s",
+                len(errors),
+                len(mappings),
+                errors,
+            )
+
+        return WriteResult(
+            (
+                mapping["id"]
+                for mapping, updated in zip(mappings, results)
+                if updated
+            ),
+            errors,
+        )
+
+    @operation
+    def _update_mapping(
+        self, mapping_id: str = "", mapping: Mapping[str, Any] = None
+    ) -> Operation:
+        """updates the mapping pointed by id with new mapping"""
+        response = yield Call(
+            "PUT", f"{self.mappings_url}/{mapping_id}", dumps(mapping)
+        )
+        if response.status_code != 200:
+            logger.error("Error updating a mapping: %s", response.text)
+            # the caller may have changed the cached mapping in place
+            self._snapshot.invalidate()
+            return None
+
+        updated = loads(response.content)
+        self._snapshot.replace(updated)
+        return updated
+
+    @operation
+    def _add_mapping(self, mapping: Mapping[str, Any]) -> Operation:
+        """add_mapping: add a mapping passed as attribute"""
+        response = yield Call("POST", self.mappings_url, dumps(mapping))
+        if response.status_code != 201:
+            logger.error("Error creating a mapping: %s", response.text)
+            return None
+
+        response_data = loads(response.content)
+        self._snapshot.add(response_data)
+        return response_data["id"]
+
+    @operation
+    def _delete_mapping(self, stub_id: str) -> Operation:
+        """remove a mapping from wiremock with the requested id"""
+        response = yield Call("DELETE", f"{self.mappings_url}/{stub_id}")
+        if response.status_code != 200:
+            logger.error(
+                "Error deleting mapping %s: %s", stub_id, response.text
+            )
+            return -1
+
+        self._snapshot.remove(stub_id)
+        return stub_id
+
+    @operation
+    def _delete_mappings(
+        self, stub_ids: List[str], mappings: List[Mapping[str, Any]] = None
+    ) -> Operation:
+        """deletes a batch of mappings by id with a few requests whatever
+        their number: the mappings are marked in their metadata with imports
+        of import_chunk_size mappings, then removed by metadata with a
+        single request. Mappings created or changed by others meanwhile are
+        left alone.
+        :param stub_ids: the ids of the mappings to delete
+        :param mappings: all the mappings currently defined in wiremock,
+        when known, downloaded otherwise
+        Returns the list of deleted ids or None in case of errors
+        """
+        stub_ids = list(dict.fromkeys(stub_ids))
+        if not stub_ids:
+            return []
+
+        if mappings is None:
+            mappings = yield from self._mappings()
+            if mappings is None:
+                return None
+        by_id = {m["id"]: m for m in mappings}
+        found = [stub_id for stub_id in stub_ids if stub_id in by_id]
+        if len(found) < len(stub_ids):
+            logger.warning(
+                "[delete_mappings]: %d mappings not found",
+                len(stub_ids) - len(found),
+            )
+        if not found:
+            return []
+
+        token = str(uuid.uuid4())
+        marked = []
+        chunk_size = self.import_chunk_size
+        for start in range(0, len(found), chunk_size):
+            chunk = found[start : start + chunk_size]
+            imported = yield from self._import_chunk(
+                [mark_for_deletion(by_id[i], token) for i in chunk],
+                "OVERWRITE",
+            )
+            if not imported:
+                logger.error(
+                    "[delete_mappings]: %d of %d mappings not deleted",
+                    len(found) - len(marked),
+                    len(found),
+                )
+                break
+            marked.extend(chunk)
+        if not marked:
+            return None
+
+        removed = yield from self._remove_by_metadata(deletion_pattern(token))
+        if removed != 1:
+            return None
+        return marked
+
+    @operation
+    def _replace_mappings(
+        self, mappings: List[Mapping[str, Any]]
+    ) -> Operation:
+        """makes the passed list the exact set of mappings defined in
+        wiremock, with a single request
+        Returns True on success"""
+        if not mappings:
+            return (yield from self._clear_mappings()) == 1
+        return (
+            yield from self._import_chunk(
+                mappings, "OVERWRITE", delete_all_not_in_import=True
+            )
+        )
+
+    @operation
+    def _delete_all_mappings(self) -> Operation:
+        """deletes all mappings defined in wiremock with a single request,
+        without listing them first
+        returns the list of ids of the deleted mappings when they are cached
+        (snapshot block or snapshot_ttl), an empty list otherwise, or None
+        in case of errors"""
+        ids = [mapping["id"] for mapping in self._snapshot.get() or []]
+        if (yield from self._clear_mappings()) != 1:
+            return None
+
+        return ids
+
+    @operation
+    def _clear_mappings(self) -> Operation:
+        """deletes all mappings defined in wiremock with a single request"""
+        self._snapshot.invalidate()
+        response = yield Call("DELETE", self.mappings_url)
+        if response.status_code != 200:
+            logger.error(
+                "[clear_mappings]:Error deleting all mappings %s",
+                response.text,
+            )
+            return -1
+
+        return 1
+
+    @operation
+    def _fixed_delay(
+        self,
+        mappings: List[Mapping[str, Any]],
+        fixed_delay_milliseconds: int = 0,
+    ) -> Operation:
+        """
+        updates the mappings adding a fixed delay
+        returns the list of ids of the updated mappings
+        """
+        return (
+            yield from self._update_changed(
+                mappings,
+                lambda m: set_fixed_delay(m, fixed_delay_milliseconds),
+                "fixed_delay",
+            )
+        )
+
+    @operation
+    def _global_fixed_delay(self, fixed_delay: int) -> Operation:
+        """set a global fixed delay for all wiremock mappings"""
+        return (
+            yield from self._post_settings(
+                "global_fixed_delay", {"fixedDelay": fixed_delay}
+            )
+        )
+
+    @operation
+    def _random_delay(
+        self, _filter: Mapping[str, Any], delay_distribution: Mapping[str, Any]
+    ) -> Operation:
+        """
+        Updates the mapping adding a random delay
+        returns the updated mapping or none in case of errors
+        """
+        if not isinstance(delay_distribution, dict):
+            logger.error("[random_delay]: parameter has to be a dictionary")
+
+        mapping_found = yield from self._mapping_by_request_exact_match(
+            _filter
+        )
+
+        if not mapping_found:
+            logger.error("[random_delay]: Error retrieving mapping")
+            return None
+
+        def change(mapping: Mapping[str, Any]):
+            mapping["response"]["delayDistribution"] = delay_distribution
+
+        return (
+            yield from self._update_changed_mapping(
+                mapping_found, change, "random_delay"
+            )
+        )
+
+    @operation
+    def _global_random_delay(
+        self, delay_distribution: Mapping[str, Any]
+    ) -> Operation:
+        """set a global random delay for all wiremock mappings"""
+        if not isinstance(delay_distribution, dict):
+            logger.error(
+                "[global_random_delay]: parameter has to be a dictionary"
+            )
+        return (
+            yield from self._post_settings(
+                "global_random_delay",
+                {"delayDistribution": delay_distribution},
+            )
+        )
+
+    @operation
+    def _settings(self) -> Operation:
+        """retrieves the global settings of wiremock"""
+        response = yield Call("GET", self.settings_url)
+        if response.status_code != 200:
+            self._fail("[settings]:Error retrieving settings", response)
+            return None
+
+        res = loads(response.content)
+        return res.get("settings", res)
+
+    @operation
+    def _update_settings(self, settings: Mapping[str, Any]) -> Operation:
+        """replaces the global settings of wiremock"""
+        return (yield from self._post_settings("update_settings", settings))
+
+    def _post_settings(
+        self, caller: str, settings: Mapping[str, Any]
+    ) -> Operation:
+        """posts new global settings to wiremock"""
+        response = yield Call("POST", self.settings_url, dumps(settings))
+        if response.status_code != 200:
+            logger.error(
+                "[%s]: Error setting delay: %s", caller, response.text
+            )
+            return -1
+
+        return 1
+
+    @operation
+    def _chunked_dribble_delay(
+        self,
+        _filter: List[Any],
+        chunked_dribble_delay: Mapping[str, Any] = None,
+    ) -> Operation:
+        """
+        Adds a delay to the passed mapping
+        returns the updated mapping or non in case of errors
+        """
+        if not check_chunked_dribble_delay(chunked_dribble_delay):
+            return None
+
+        mapping_found = yield from self._mapping_by_request_exact_match(
+            _filter
+        )
+
+        if not mapping_found:
+            logger.error("[chunked_dribble_delay]: Error retrieving mapping")
+            return None
+
+        def change(mapping: Mapping[str, Any]):
+            mapping["response"]["chunkedDribbleDelay"] = chunked_dribble_delay
+
+        return (
+            yield from self._update_changed_mapping(
+                mapping_found, change, "chunked_dribble_delay"
+            )
+        )
+
+    @operation
+    def _up(self, _filter: List[Any] = None) -> Operation:
+        """resets a list of mappings deleting all delays attached to them.
+        In overlay mode, deletes the overlays of the mappings instead"""
+        found = {}
+        with self.snapshot():
+            for stub_filter in _filter:
+                mapping_found = (
+                    yield from self._mapping_by_request_exact_match(
+                        stub_filter
+                    )
+                )
+                if mapping_found:
+                    logger.debug(
+                        "[up]: found mapping: %s", mapping_found["id"]
+                    )
+                    found.setdefault(mapping_found["id"], mapping_found)
+            if self.injection == "overlay":
+                return (yield from self._remove_overlays(list(found.values())))
+
+            def restore(mapping: Mapping[str, Any]):
+                remove_delays(mapping)
+                unstamp_modified(mapping)
+
+            return (
+                yield from self._update_changed(list(found.values()), restore)
+            )
+
+    @operation
+    def _reset(self) -> Operation:
+        """reset global wiremock settings"""
+        self._snapshot.invalidate()
+        response = yield Call("POST", self.reset_url)
+        if response.status_code != 200:
+            logger.error(
+                "[reset]:Error resetting wiremock server %s", response.text
+            )
+            return -1
+
+        return 1
+
+    @operation
+    def _reset_mappings(self) -> Operation:
+        """reload wiremock mappings from disk"""
+        self._snapshot.invalidate()
+        response = yield Call("POST", self.reset_mappings_url)
+        if response.status_code != 200:
+            logger.error(
+                "[reset]:Error resetting wiremock mappings %s", response.text
+            )
+            return -1
+
+        return 1
+
+    @operation
+    def _count_requests(self, pattern: Mapping[str, Any]) -> Operation:
+        """counts the requests of the journal matching a request pattern,
+        on the server side
+        returns the count or -1 in case of errors"""
+        response = yield Call("POST", self.requests_count_url, dumps(pattern))
+        if response.status_code != 200:
+            self._fail("[count_requests]:Error counting requests", response)
+            return -1
+
+        return loads(response.content)["count"]
+
+    @operation
+    def _count_requests_many(
+        self, patterns: List[Mapping[str, Any]]
+    ) -> Operation:
+        """counts the requests matching each pattern, with concurrent
+        requests
+        returns the counts in patterns order, -1 for the failed ones"""
+        return (yield [self._count_requests(pattern) for pattern in patterns])
+
+    @operation
+    def _find_requests(self, pattern: Mapping[str, Any]) -> Operation:
+        """retrieves the requests of the journal matching a request pattern
+        returns the requests found or None in case of errors"""
+        response = yield Call("POST", self.requests_find_url, dumps(pattern))
+        if response.status_code != 200:
+            self._fail("[find_requests]:Error finding requests", response)
+            return None
+
+        return loads(response.content)["requests"]
+
+    @operation
+    def _journal(self, limit: int = None, since: str = None) -> Operation:
+        """retrieves the requests of the journal, the most recent first
+        :param limit: maximum number of requests returned
+        :param since: only the requests logged after this ISO 8601 date
+        returns the requests found or None in case of errors"""
+        params = {}
+        if limit is not None:
+            params["limit"] = limit
+        if since is not None:
+            params["since"] = since
+        response = yield Call("GET", self.requests_url, params=params)
+        if response.status_code != 200:
+            self._fail("[journal]:Error retrieving requests", response)
+            return None
+
+        return loads(response.content)["requests"]
+
+    @operation
+    def _journal_size(self) -> Operation:
+        """the number of requests in the journal, without downloading it
+        returns -1 in case of errors"""
+        response = yield Call("GET", self.requests_url, params={"limit": 1})
+        if response.status_code != 200:
+            self._fail("[journal_size]:Error retrieving requests", response)
+            return -1
+
+        return loads(response.content)["meta"]["total"]
+
+    @operation
+    def _clear_journal(self) -> Operation:
+        """deletes all the requests of the journal"""
+        response = yield Call("DELETE", self.requests_url)
+        if response.status_code != 200:
+            self._fail("[clear_journal]:Error deleting requests", response)
+            return -1
+
+        return 1
+
+    @operation
+    def _remove_requests(self, pattern: Mapping[str, Any]) -> Operation:
+        """deletes the requests of the journal matching a request pattern
+        returns the number of requests removed or -1 in case of errors"""
+        response = yield Call("POST", self.requests_remove_url, dumps(pattern))
+        if response.status_code != 200:
+            self._fail("[remove_requests]:Error deleting requests", response)
+            return -1
+
+        removed = loads(response.content)
+        return len(removed.get("serveEvents", removed.get("requests", [])))
+
+    @operation
+    def _remove_request(self, event_id: str) -> Operation:
+        """deletes a request of the journal by id"""
+        response = yield Call("DELETE", f"{self.requests_url}/{event_id}")
+        if response.status_code != 200:
+            logger.error(
+                "Error deleting request %s: %s", event_id, response.text
+            )
+            return -1
+
+        return event_id
+
+    @operation
+    def _trim_journal(
+        self,
+        max_age: float = None,
+        max_size: int = None,
+        max_deletes: int = None,
+    ) -> Operation:
+        """deletes the requests of the journal older than max_age seconds
+        and the oldest ones beyond max_size. Wiremock cannot remove requests
+        by date: the size of the journal and the number of requests to keep
+        are checked first, downloading at most max_size recent requests.
+        When all of them have to go, the journal is cleared with a single
+        request. Otherwise the requests to keep and the ones to remove are
+        downloaded, and removed one request each: the whole journal unless
+        max_deletes bounds the number of requests removed, and downloaded,
+        by call. The next calls remove the rest
+        returns the number of requests removed or -1 in case of errors"""
+        size = yield from self._journal_size()
+        if size == -1:
+            return -1
+        keep = size if max_size is None else min(size, max_size)
+        if max_age is not None and keep > 0:
+            recent = yield from self._journal(
+                limit=keep, since=iso_date((time.time() - max_age) * 1000)
+            )
+            if recent is None:
+                return -1
+            keep = len(recent)
+        if keep >= size:
+            return 0
+        if keep == 0:
+            return size if (yield from self._clear_journal()) == 1 else -1
+
+        excess = size - keep
+        if max_deletes is not None:
+            excess = min(excess, max_deletes)
+        events = yield from self._journal(limit=keep + excess)
+        if events is None:
+            return -1
+        ids = events_to_trim(events, max_age, max_size)[:excess]
+        removed = yield [self._remove_request(event_id) for event_id in ids]
+        return len([event_id for event_id in removed if event_id != -1])
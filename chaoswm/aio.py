@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+
+asyncio flavour of the wiremock driver. It runs the same admin operations
+as `chaoswm.driver.Wiremock` (see `chaoswm.admin`), sending the requests
+through a single pooled httpx client and capping the number of in-flight
+requests with a semaphore.
+
+httpx is an optional dependency:
+
+    pip install chaostoolkit-wiremock[async]
+
+"""
+
+import asyncio
+import threading
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict
+
+from logzero import logger
+
+from .admin import AdminAPI, Call, Operation
+from .journal import JournalTailer
+from .stats import body_size, record_call
+from .utils import (
+    DEFAULT_IMPORT_CHUNK_SIZE,
+    DEFAULT_MAX_WORKERS,
+    DEFAULT_PAGE_SIZE,
+    DEFAULT_POOL_SIZE,
+)
+
+try:
+    import httpx
+
+    HAS_HTTPX = True
+except ImportError:
+    HAS_HTTPX = False
+
+__all__ = ["AsyncWiremock", "AsyncWiremockRunner"]
+
+
+class AsyncWiremock(AdminAPI):
+    """asyncio driver class to interface with the wiremock admin API"""
+
+    transport_errors = (httpx.HTTPError,) if HAS_HTTPX else ()
+
+    def __init__(
+        self,
+        host: str = None,
+        port: str = None,
+        url: str = None,
+        timeout: int = 1,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        keep_alive: bool = True,
+        import_chunk_size: int = DEFAULT_IMPORT_CHUNK_SIZE,
+        duplicate_policy: str = "OVERWRITE",
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        snapshot_ttl: float = None,
+        injection: str = "rewrite",
+        tag: str = None,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        streaming: bool = False,
+    ):
+        if not HAS_HTTPX:
+            raise ImportError(
+                "AsyncWiremock requires httpx, install it with "
+                "`pip install chaostoolkit-wiremock[async]`"
+            )
+
+        # streamed parsing is only done by the blocking driver, this one
+        # always downloads the mappings list as a whole
+        if streaming:
+            logger.warning(
+                "streaming is not supported by the asyncio driver, ignored"
+            )
+        super().__init__(
+            host=host,
+            port=port,
+            url=url,
+            timeout=timeout,
+            import_chunk_size=import_chunk_size,
+            duplicate_policy=duplicate_policy,
+            max_workers=max_workers,
+            snapshot_ttl=snapshot_ttl,
+            injection=injection,
+            tag=tag,
+            page_size=page_size,
+            streaming=False,
+        )
+        if not keep_alive:
+            self.headers["Connection"] = "close"
+
+        self.client = httpx.AsyncClient(
+            headers=self.headers,
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=pool_size if keep_alive else 0,
+            ),
+        )
+        self._semaphore = None
+
+    async def close(self):
+        """releases all the pooled connections to wiremock"""
+        await self.client.aclose()
+
+    async def __aenter__(self) -> "AsyncWiremock":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    @classmethod
+    def _bind(
+        cls, func: Callable[..., Operation], name: str
+    ) -> Callable[..., Awaitable[Any]]:
+        async def method(self, *args, **kwargs):
+            return await self._run(func(self, *args, **kwargs))
+
+        return cls._named(method, func, name)
+
+    async def _run(self, op: Operation) -> Any:
+        """runs an admin operation, awaiting its calls one after the other
+        and gathering its concurrent operations"""
+        value, error = None, None
+        while True:
+            try:
+                step = op.send(value) if error is None else op.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            value, error = None, None
+            try:
+                if isinstance(step, list):
+                    value = list(await asyncio.gather(*map(self._run, step)))
+                else:
+                    value = await self._send(step)
+            except self.transport_errors as e:
+                error = e
+
+    async def _send(self, call: Call) -> "httpx.Response":
+        return await self._request(
+            call.method, call.url, content=call.body, params=call.params
+        )
+
+    async def _request(
+        self, method: str, url: str, **kwargs: Any
+    ) -> "httpx.Response":
+        """sends an admin request through the pooled client, waiting for
+        a free slot when max_workers requests are already in flight"""
+        # created lazily so that it belongs to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_workers)
+        async with self._semaphore:
+            start = time.perf_counter()
+            try:
+                response = await self.client.request(method, url, **kwargs)
+            except httpx.HTTPError:
+                record_call(
+                    method, url, time.perf_counter() - start, error=True
+                )
+                raise
+        record_call(
+            method,
+            url,
+            time.perf_counter() - start,
+            sent=body_size(response.request.content),
+            received=len(response.content),
+            error=response.status_code >= 400,
+        )
+        return response
+
+    async def iter_mappings(self) -> AsyncIterator[Dict[str, Any]]:
+        """yields the mappings (from the snapshot, when one is cached),
+        downloading them one page of page_size mappings at a time, only as
+        the iteration goes. Mappings written by others during the iteration
+        may be missed or seen twice"""
+        cached = self._snapshot.get()
+        if cached is not None:
+            for mapping in cached:
+                yield mapping
+            return
+
+        offset = 0
+        while True:
+            page = await self.fetch_mappings_page(offset)
+            if page is None:
+                return
+            mappings, total = page
+            for mapping in mappings:
+                yield mapping
+            offset += len(mappings)
+            if not mappings or offset >= total:
+                return
+
+
+class AsyncWiremockRunner:
+    """blocking facade running an AsyncWiremock on its own event loop,
+    so that the chaoswm actions can use the asyncio driver unchanged"""
+
+    def __init__(self, **params: Any):
+        self._loop = asyncio.new_event_loop()
+        self._loop_lock = threading.Lock()
+        self._tailers: Dict[str, JournalTailer] = {}
+        self._tailers_lock = threading.Lock()
+        self.driver = AsyncWiremock(**params)
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self.driver, name)
+        if not asyncio.iscoroutinefunction(attr):
+            return attr
+        return self._blocking(attr)
+
+    def _blocking(
+        self, func: Callable[..., Awaitable[Any]]
+    ) -> Callable[..., Any]:
+        def run(*args: Any, **kwargs: Any) -> Any:
+            # the runner may be shared by threads, the loop runs one at a time
+            with self._loop_lock:
+                return self._loop.run_until_complete(func(*args, **kwargs))
+
+        return run
+
+    def journal_tailer(
+        self, name: str = "default", from_start: bool = False
+    ) -> JournalTailer:
+        """returns the journal tailer of that name, polling the journal
+        through this blocking facade"""
+        with self._tailers_lock:
+            tailer = self._tailers.get(name)
+            if tailer is None:
+                tailer = self._tailers[name] = JournalTailer(self, from_start)
+            return tailer
+
+    def close(self):
+        """closes the async driver and its event loop"""
+        with self._loop_lock:
+            try:
+                self._loop.run_until_complete(self.driver.close())
+            finally:
+                self._loop.close()
+
+    def __enter__(self) -> "AsyncWiremockRunner":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
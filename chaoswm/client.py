@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+
+Process-wide registry of wiremock drivers. Activities of an experiment
+targeting the same server with the same settings share one warm driver
+and its connection pool, instead of building a new one each time.
+The drivers are closed by `close_clients`, called at the end of the
+experiment by the `chaoswm.control` control, or when the process exits.
+
+"""
+
+import atexit
+import threading
+from typing import Any, Dict, Tuple, Union
+
+from chaoslib.types import Configuration
+from logzero import logger
+
+from .aio import AsyncWiremockRunner
+from .driver import Wiremock
+from .utils import get_wm_nodes_params, get_wm_params
+
+__all__ = ["wiremock_client", "wiremock_clients", "close_clients"]
+
+_clients: Dict[Tuple[Any, ...], Union[Wiremock, AsyncWiremockRunner]] = {}
+_clients_lock = threading.Lock()
+
+
+def wiremock_client(
+    configuration: Configuration,
+) -> Union[Wiremock, AsyncWiremockRunner]:
+    """Returns the shared wiremock driver described by the configuration,
+    creating it on first use.
+    The asyncio driver is used when the `async` key is true"""
+    params = get_wm_params(configuration)
+    use_async = configuration.get("wiremock", {}).get("async", False)
+    return _client(params, use_async)
+
+
+def wiremock_clients(
+    configuration: Configuration,
+) -> Dict[str, Union[Wiremock, AsyncWiremockRunner]]:
+    """Returns the shared wiremock drivers of all the nodes described by
+    the configuration (see `get_wm_nodes_params`), by node url"""
+    use_async = configuration.get("wiremock", {}).get("async", False)
+    return {
+        params["url"]: _client(params, use_async)
+        for params in get_wm_nodes_params(configuration) or []
+    }
+
+
+def _client(
+    params: Dict[str, Any], use_async: bool
+) -> Union[Wiremock, AsyncWiremockRunner]:
+    """returns the shared driver for params, creating it on first use"""
+    key = (use_async,) + tuple(sorted(params.items()))
+
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            logger.debug("Creating wiremock driver for %s", params["url"])
+            if use_async:
+                client = AsyncWiremockRunner(**params)
+            else:
+                client = Wiremock(**params)
+            _clients[key] = client
+    return client
+
+
+def close_clients():
+    """closes and forgets all the shared wiremock drivers"""
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+
+    for client in clients:
+        try:
+            client.close()
+        except Exception as e:
+            logger.error("Error closing a wiremock driver: %s", e)
+
+
+atexit.register(close_clients)
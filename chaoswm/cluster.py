@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+
+Fan-out of the activities over a cluster of wiremock nodes, described by
+the `nodes` key of the `wiremock` configuration. Every node gets the
+activity concurrently and the result is a dictionary of the per-node
+results, by node url.
+
+With the `consistency` key set to `all`, the mappings and the global
+settings of every node are saved before the activity, and all the nodes
+are rolled back to them if the activity fails on any node.
+
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from chaoslib.types import Configuration
+from logzero import logger
+
+from .client import wiremock_client, wiremock_clients
+from .driver import MappingRef
+
+__all__ = [
+    "CONSISTENCY_MODES",
+    "is_cluster",
+    "on_nodes",
+    "succeeded",
+    "no_errors",
+]
+
+CONSISTENCY_MODES = ["best_effort", "all"]
+
+
+def is_cluster(configuration: Configuration) -> bool:
+    """True if the configuration describes a list of nodes"""
+    return "nodes" in (configuration or {}).get("wiremock", {})
+
+
+def succeeded(w: Any, result: Any) -> bool:
+    """default check of an activity result: the drivers return None, -1
+    or False on errors"""
+    return result is not None and result is not False and result != -1
+
+
+def no_errors(w: Any, result: Any) -> bool:
+    """check of the activities updating several mappings, which return the
+    errors of the mappings that could not be updated with their result"""
+    return succeeded(w, result) and not getattr(result, "errors", None)
+
+
+def on_nodes(
+    configuration: Configuration,
+    activity: Callable[[Any], Any],
+    check: Callable[[Any, Any], bool] = succeeded,
+    mutating: bool = True,
+) -> Any:
+    """runs activity with the driver of every node of the configuration.
+    With a single node, returns the result of the activity. Otherwise
+    returns the results by node url, None for the nodes where the activity
+    raised an error.
+    Only mutating activities save the state of the nodes and roll them back
+    on failure in the `all` consistency mode: probes and the activities
+    leaving the mappings and settings alone pass mutating=False"""
+    if not is_cluster(configuration):
+        return activity(wiremock_client(configuration))
+
+    clients = wiremock_clients(configuration)
+    if not clients:
+        logger.error("No wiremock nodes configured")
+        return {}
+
+    consistency = configuration["wiremock"].get("consistency", "best_effort")
+    if consistency not in CONSISTENCY_MODES:
+        logger.error("Consistency mode %s not available", consistency)
+        return {}
+
+    rollback = consistency == "all" and mutating
+    states = {}
+    if rollback:
+        states = _parallel(clients, _save_state)
+        missing = [url for url, state in states.items() if state is None]
+        if missing:
+            logger.error(
+                "Activity not run: could not save the state of %s", missing
+            )
+            return {url: None for url in clients}
+
+    results = _parallel(clients, activity)
+    failed = [url for url, w in clients.items() if not check(w, results[url])]
+    if failed:
+        logger.error("Activity failed on nodes %s", failed)
+        if rollback:
+            _rollback(clients, states)
+    return results
+
+
+###############################################################################
+# Private functions
+###############################################################################
+def _parallel(
+    clients: Dict[str, Any], func: Callable[[Any], Any]
+) -> Dict[str, Any]:
+    """calls func with every driver concurrently
+    Returns the results by node url, None where func raised an error"""
+
+    def call(url: str) -> Any:
+        try:
+            return func(clients[url])
+        except Exception as e:
+            logger.error("Error on wiremock node %s: %s", url, e)
+            return None
+
+    with ThreadPoolExecutor(max_workers=len(clients)) as executor:
+        return dict(zip(clients, executor.map(call, clients)))
+
+
+def _save_state(
+    w: Any,
+) -> Optional[Tuple[List[MappingRef], Dict[str, Any]]]:
+    """Returns references to the mappings, kept encoded, and the global
+    settings of a node"""
+    settings = w.settings()
+    mappings = w.fetch_mappings()
+    if settings is None or mappings is None:
+        return None
+    # encoded copies: the activity may change the cached mappings in place
+    return [MappingRef.of(mapping) for mapping in mappings], settings
+
+
+def _rollback(clients: Dict[str, Any], states: Dict[str, Any]):
+    """puts the saved mappings and settings back on all the nodes"""
+    by_driver = {id(w): states[url] for url, w in clients.items()}
+
+    def restore(w: Any) -> bool:
+        refs, settings = by_driver[id(w)]
+        mappings = [ref.payload for ref in refs]
+        return w.replace_mappings(mappings) and (
+            w.update_settings(settings) == 1
+        )
+
+    restored = _parallel(clients, restore)
+    failed = [url for url, ok in restored.items() if not ok]
+    if failed:
+        logger.error("Rollback failed on nodes %s", failed)
+    else:
+        logger.info("Rolled back nodes %s", list(clients))
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+
+JSON encoding of the admin API payloads. orjson is used when installed,
+the standard library json module otherwise:
+
+    pip install chaostoolkit-wiremock[fast]
+
+Bodies are encoded straight to bytes, and responses are decoded from
+their raw content, skipping the text decoding of the http clients.
+
+"""
+
+import json
+from typing import Any, Union
+
+try:
+    import orjson
+
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+__all__ = ["HAS_ORJSON", "dumps", "dumps_canonical", "loads"]
+
+
+def dumps(obj: Any) -> bytes:
+    """encodes obj as compact utf-8 json"""
+    if HAS_ORJSON:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def dumps_canonical(obj: Any) -> bytes:
+    """encodes obj as compact utf-8 json with sorted keys, so that equal
+    objects are encoded the same way"""
+    if HAS_ORJSON:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+    return json.dumps(
+        obj, sort_keys=True, separators=(",", ":"), ensure_ascii=False
+    ).encode("utf-8")
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    """decodes a json document"""
+    if HAS_ORJSON:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""
+
+Chaos Toolkit control stopping the journal maintenance loops and releasing
+the shared wiremock drivers once the experiment is over:
+
+    "controls": [
+        {
+            "name": "wiremock",
+            "provider": {"type": "python", "module": "chaoswm.control"}
+        }
+    ]
+
+"""
+
+from typing import Any
+
+from chaoslib.types import Configuration, Experiment, Journal, Secrets
+
+from .client import close_clients
+from .journal import stop_all_maintenance
+
+__all__ = ["after_experiment_control"]
+
+
+def after_experiment_control(
+    context: Experiment,
+    state: Journal,
+    configuration: Configuration = None,
+    secrets: Secrets = None,
+    **kwargs: Any,
+):
+    """closes all the wiremock drivers used by the experiment"""
+    stop_all_maintenance()
+    close_clients()
@@ -0,0 +1,505 @@
+# -*- coding: utf-8 -*-
+"""
+
+Statistics over the request journal of wiremock: percentiles of the
+`timing` fields of the served events, status code and fault histograms,
+per stub mapping or per url.
+
+`JournalTailer` follows the journal of a driver across polls: it keeps a
+`since` cursor so that each poll only downloads the requests logged after
+the previous one, and folds them into bounded rolling aggregates.
+
+`JournalMaintenance` is a background loop keeping the journal of a server
+under a maximum size or age, so that long runs do not fill the memory of
+wiremock.
+
+The aggregation runs on NumPy arrays when NumPy is installed, and falls
+back to sorted lists otherwise:
+
+    pip install chaostoolkit-wiremock[stats]
+
+"""
+
+import bisect
+import math
+import threading
+import time
+import warnings
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
+
+from logzero import logger
+
+from .stats import LATENCY_BUCKETS, bucket_label
+
+try:
+    import numpy as np
+
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+__all__ = [
+    "HAS_NUMPY",
+    "TIMING_FIELDS",
+    "PERCENTILES",
+    "GROUP_BY",
+    "event_key",
+    "event_status",
+    "event_fault",
+    "latency_stats",
+    "event_date",
+    "iso_date",
+    "is_error",
+    "JournalCursor",
+    "RollingStats",
+    "JournalTailer",
+    "events_to_trim",
+    "JournalMaintenance",
+    "start_maintenance",
+    "stop_maintenance",
+    "stop_all_maintenance",
+]
+
+TIMING_FIELDS = ("totalTime", "serveTime", "addedDelay")
+
+PERCENTILES = (50, 90, 99)
+
+GROUP_BY = ["stub", "url"]
+
+UNMATCHED = "unmatched"
+
+# requests removed by each pass of the maintenance loops at most
+DEFAULT_MAX_DELETES = 1000
+
+
+def event_key(event: Dict[str, Any], group_by: str = "stub") -> str:
+    """the group of a journal event: the id of the stub mapping that
+    served it, or the requested url"""
+    if group_by == "url":
+        return event.get("request", {}).get("url", "")
+    stub = event.get("stubMapping") or {}
+    return stub.get("id") or UNMATCHED
+
+
+def event_status(event: Dict[str, Any]) -> int:
+    """the status code served for a journal event"""
+    response = event.get("response") or event.get("responseDefinition") or {}
+    return response.get("status", 0)
+
+
+def event_fault(event: Dict[str, Any]) -> Optional[str]:
+    """the fault served for a journal event, if any"""
+    return (event.get("responseDefinition") or {}).get("fault")
+
+
+def event_date(event: Dict[str, Any]) -> int:
+    """the date a journal event was logged, in milliseconds since epoch"""
+    return event.get("request", {}).get("loggedDate", 0)
+
+
+def iso_date(date: float) -> str:
+    """a date in milliseconds since epoch, in the ISO 8601 format of the
+    `since` parameter of the journal"""
+    moment = datetime.fromtimestamp(date / 1000, timezone.utc)
+    return moment.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+def is_error(event: Dict[str, Any]) -> bool:
+    """True for the events answered with a fault or a 5xx status code"""
+    return bool(event_fault(event)) or event_status(event) >= 500
+
+
+def latency_stats(
+    events: Iterable[Dict[str, Any]], group_by: str = "stub"
+) -> Dict[str, Any]:
+    """aggregates journal events by stub mapping or url.
+    Returns for each group the events count, the p50/p90/p99/max of each
+    timing field (in milliseconds, None when the field is missing) and the
+    status code and fault histograms"""
+    codes = []
+    groups: Dict[str, int] = {}
+    timings = []
+    statuses = []
+    faults = []
+    for event in events:
+        key = event_key(event, group_by)
+        codes.append(groups.setdefault(key, len(groups)))
+        timing = event.get("timing") or {}
+        timings.append([timing.get(field) for field in TIMING_FIELDS])
+        statuses.append(event_status(event))
+        faults.append(event_fault(event))
+
+    if HAS_NUMPY:
+        stats = _aggregate_numpy(codes, len(groups), timings, statuses)
+    else:
+        stats = _aggregate_lists(codes, len(groups), timings, statuses)
+
+    # faults are rare: counted on the events that have one
+    fault_counts = [Counter() for _ in groups]
+    for code, fault in zip(codes, faults):
+        if fault:
+            fault_counts[code][fault] += 1
+
+    return {
+        "total": len(codes),
+        "groups": {
+            key: dict(stats[code], faults=dict(fault_counts[code]))
+            for key, code in groups.items()
+        },
+    }
+
+
+class JournalCursor:
+    """position in the journal: the date of the last event seen and the
+    ids of the events seen at that date"""
+
+    def __init__(self):
+        self.date: Optional[int] = None
+        self.ids: Set[str] = set()
+
+    def since(self) -> Optional[str]:
+        """the `since` parameter of the next journal request. Wiremock only
+        returns the events logged strictly after it: the cursor goes back
+        one millisecond, the events logged in the same millisecond as the
+        last one seen are dropped by advance"""
+        if self.date is None:
+            return None
+        return iso_date(self.date - 1)
+
+    def advance(self, events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """moves the cursor past events, as returned by wiremock (most
+        recent first). Returns the events not seen yet, oldest first"""
+        new = []
+        for event in sorted(events, key=event_date):
+            date = event_date(event)
+            if self.date is not None and (
+                date < self.date
+                or (date == self.date and event.get("id") in self.ids)
+            ):
+                continue
+            if date != self.date:
+                self.date = date
+                self.ids = set()
+            self.ids.add(event.get("id"))
+            new.append(event)
+        return new
+
+
+class RollingStats:
+    """aggregates of the events seen by a tailer, in constant memory:
+    counts, errors, status codes and a histogram of the total time in the
+    logarithmic buckets of `chaoswm.stats`"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.errors = 0
+        self.unmatched = 0
+        self.status: Counter = Counter()
+        self.max_time = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def add(self, event: Dict[str, Any]):
+        self.count += 1
+        self.errors += int(is_error(event))
+        self.unmatched += int(event_key(event) == UNMATCHED)
+        self.status[event_status(event)] += 1
+        total = (event.get("timing") or {}).get("totalTime")
+        if total is not None:
+            self.max_time = max(self.max_time, total)
+            seconds = total / 1000
+            self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def quantile(self, p: float) -> Optional[float]:
+        """upper bound, in milliseconds, of the bucket holding the p-th
+        percentile of the total time. None before any timed event"""
+        timed = sum(self.buckets)
+        if not timed:
+            return None
+        rank = math.ceil(timed * p / 100) or 1
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                break
+        if i == len(LATENCY_BUCKETS):
+            return self.max_time
+        return min(LATENCY_BUCKETS[i] * 1000, self.max_time)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "error_ratio": self.errors / self.count if self.count else 0.0,
+            "unmatched": self.unmatched,
+            "status": {str(k): v for k, v in sorted(self.status.items())},
+            "totalTime": {
+                **{f"p{p}": self.quantile(p) for p in PERCENTILES},
+                "max": self.max_time if self.count else None,
+            },
+            "latency_histogram": {
+                bucket_label(i): count
+                for i, count in enumerate(self.buckets)
+                if count
+            },
+        }
+
+
+class JournalTailer:
+    """follows the request journal of a driver. Each poll requests the
+    events logged since the previous one only, so its cost grows with the
+    new traffic, not with the size of the journal.
+    :param from_start: also take the events logged before the first poll.
+    Otherwise the first poll only places the cursor on the last event
+    """
+
+    def __init__(self, w: Any, from_start: bool = False):
+        self.w = w
+        self.from_start = from_start
+        self.cursor = JournalCursor()
+        self.stats = RollingStats()
+        self._started = from_start
+        self._lock = threading.Lock()
+
+    def tail(self) -> Iterator[Dict[str, Any]]:
+        """yields the events logged since the previous call, oldest first,
+        and adds them to the rolling stats.
+        Yields nothing when the journal could not be retrieved"""
+        with self._lock:
+            if not self._started:
+                latest = self.w.journal(limit=1)
+                if latest is None:
+                    return
+                self.cursor.advance(latest)
+                self._started = True
+                return
+
+            events = self.w.journal(since=self.cursor.since())
+            if events is None:
+                return
+            new = self.cursor.advance(events)
+            for event in new:
+                self.stats.add(event)
+
+        yield from new
+
+    def poll(self) -> int:
+        """consumes the new events, returns their number"""
+        return sum(1 for _ in self.tail())
+
+    def reset(self):
+        """starts the rolling stats over, the cursor is kept"""
+        with self._lock:
+            self.stats.reset()
+
+
+def events_to_trim(
+    events: List[Dict[str, Any]],
+    max_age: float = None,
+    max_size: int = None,
+    now: float = None,
+) -> List[str]:
+    """the ids of the events to remove from a journal (most recent first)
+    to keep at most max_size events, none of them older than max_age
+    seconds"""
+    if max_size is None:
+        max_size = len(events)
+    ids = [event["id"] for event in events[max_size:]]
+    if max_age is not None:
+        now = time.time() if now is None else now
+        oldest = (now - max_age) * 1000
+        ids[:0] = [
+            event["id"]
+            for event in events[:max_size]
+            if event_date(event) < oldest
+        ]
+    return ids
+
+
+class JournalMaintenance:
+    """background thread trimming the journal of a driver every interval
+    seconds (see `trim_journal` of the drivers: the journal is only
+    downloaded when some of its requests have to go and others to stay).
+    Each pass removes, and downloads beyond the requests kept, at most
+    max_deletes requests"""
+
+    def __init__(
+        self,
+        w: Any,
+        max_size: int = None,
+        max_age: float = None,
+        interval: float = 30.0,
+        max_deletes: int = DEFAULT_MAX_DELETES,
+    ):
+        self.w = w
+        self.max_size = max_size
+        self.max_age = max_age
+        self.max_deletes = max_deletes
+        self.interval = interval
+        self.removed = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="wiremock-journal-maintenance", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> int:
+        """stops the loop, returns the number of requests it removed"""
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        return self.removed
+
+    def run_once(self) -> int:
+        """trims the journal if needed, returns the number of requests
+        removed"""
+        removed = max(
+            self.w.trim_journal(self.max_age, self.max_size, self.max_deletes),
+            0,
+        )
+        self.removed += removed
+        return removed
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error("[journal_maintenance]: %s", e)
+
+
+# running maintenance loops, by server
+_maintenance: Dict[str, JournalMaintenance] = {}
+_maintenance_lock = threading.Lock()
+
+
+def start_maintenance(
+    w: Any,
+    max_size: int = None,
+    max_age: float = None,
+    interval: float = 30.0,
+    max_deletes: int = DEFAULT_MAX_DELETES,
+) -> JournalMaintenance:
+    """starts the maintenance loop of a driver, replacing the one already
+    running for the same server"""
+    loop = JournalMaintenance(w, max_size, max_age, interval, max_deletes)
+    with _maintenance_lock:
+        previous = _maintenance.pop(w.base_url, None)
+        _maintenance[w.base_url] = loop
+    if previous is not None:
+        previous.stop()
+    loop.start()
+    return loop
+
+
+def stop_maintenance(w: Any) -> Optional[int]:
+    """stops the maintenance loop of a driver
+    returns the number of requests it removed, None if none was running"""
+    with _maintenance_lock:
+        loop = _maintenance.pop(w.base_url, None)
+    if loop is None:
+        return None
+    return loop.stop()
+
+
+def stop_all_maintenance():
+    """stops all the maintenance loops"""
+    with _maintenance_lock:
+        loops = list(_maintenance.values())
+        _maintenance.clear()
+    for loop in loops:
+        loop.stop()
+
+
+###############################################################################
+# Private functions
+###############################################################################
+def _timing_stats(values: List[Optional[float]]) -> Dict[str, Any]:
+    """percentiles and max of the values, which are None when missing"""
+    names = [f"p{p}" for p in PERCENTILES] + ["max"]
+    if not values or values[-1] is None:
+        return dict.fromkeys(names)
+    return dict(zip(names, [float(v) for v in values]))
+
+
+def _aggregate_numpy(
+    codes: List[int],
+    count: int,
+    timings: List[List[Optional[float]]],
+    statuses: List[int],
+) -> List[Dict[str, Any]]:
+    codes = np.asarray(codes, dtype=np.int64)
+    order = np.argsort(codes, kind="stable")
+    bounds = np.concatenate(
+        ([0], np.cumsum(np.bincount(codes, minlength=count)))
+    )
+    values = np.array(timings, dtype=float).reshape(-1, len(TIMING_FIELDS))
+    values = values[order]
+    statuses = np.asarray(statuses, dtype=np.int64)[order]
+
+    stats = []
+    for code in range(count):
+        start, end = bounds[code], bounds[code + 1]
+        group = values[start:end]
+        with warnings.catch_warnings():
+            # all-NaN columns, for the timing fields wiremock did not send
+            warnings.simplefilter("ignore", RuntimeWarning)
+            percentiles = np.nanpercentile(group, PERCENTILES, axis=0)
+            maxima = np.nanmax(group, axis=0)
+        table = np.vstack([percentiles, maxima])
+
+        served, counts = np.unique(statuses[start:end], return_counts=True)
+        group_stats = {"count": int(end - start)}
+        for i, field in enumerate(TIMING_FIELDS):
+            column = [None if math.isnan(v) else v for v in table[:, i]]
+            group_stats[field] = _timing_stats(column)
+        group_stats["status"] = {
+            str(status): int(n) for status, n in zip(served, counts)
+        }
+        stats.append(group_stats)
+    return stats
+
+
+def _percentile(values: List[float], p: float) -> float:
+    """linear interpolation between the closest ranks, as NumPy does"""
+    rank = (len(values) - 1) * p / 100
+    low = math.floor(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def _aggregate_lists(
+    codes: List[int],
+    count: int,
+    timings: List[List[Optional[float]]],
+    statuses: List[int],
+) -> List[Dict[str, Any]]:
+    columns = [[[] for _ in TIMING_FIELDS] for _ in range(count)]
+    status_counts = [Counter() for _ in range(count)]
+    for code, timing, status in zip(codes, timings, statuses):
+        for column, value in zip(columns[code], timing):
+            if value is not None:
+                column.append(value)
+        status_counts[code][status] += 1
+
+    stats = []
+    for code in range(count):
+        group_stats = {"count": sum(status_counts[code].values())}
+        for field, column in zip(TIMING_FIELDS, columns[code]):
+            values = []
+            if column:
+                column.sort()
+                values = [_percentile(column, p) for p in PERCENTILES]
+                values.append(column[-1])
+            group_stats[field] = _timing_stats(values)
+        group_stats["status"] = {
+            str(status): n for status, n in sorted(status_counts[code].items())
+        }
+        stats.append(group_stats)
+    return stats
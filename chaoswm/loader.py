@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+"""
+
+Streaming loader of stub mappings from a directory tree. Files are found
+with `os.scandir`, optionally in the subdirectories too, skipping the
+`__files` body directories and the directories already walked through a
+symbolic link.
+Each json file may hold:
+
+- a single stub mapping,
+- a wiremock bundle `{"mappings": [...]}`,
+- a bare array of mappings.
+
+Bundles and arrays are parsed incrementally, one mapping at a time, so a
+file of hundreds of MB never sits in memory as a whole.
+
+The same incremental parser reads the mappings list downloaded from the
+admin API with `iter_projected_mappings`, keeping only the fields the
+filters need.
+
+"""
+
+import json
+import os
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    TextIO,
+    Tuple,
+)
+
+from logzero import logger
+
+__all__ = [
+    "BODY_FILES_DIR",
+    "iter_mapping_files",
+    "iter_file_mappings",
+    "iter_dir_mappings",
+    "iter_projected_mappings",
+    "MAPPING_FIELDS",
+    "RESPONSE_FIELDS",
+    "batched",
+    "report_progress",
+]
+
+# wiremock keeps the response bodies there, they are not mappings
+BODY_FILES_DIR = "__files"
+
+READ_SIZE = 64 * 1024
+
+# fields of the mappings kept by iter_projected_mappings
+MAPPING_FIELDS = (
+    "id",
+    "uuid",
+    "name",
+    "priority",
+    "persistent",
+    "request",
+    "metadata",
+    "scenarioName",
+    "requiredScenarioState",
+    "newScenarioState",
+)
+
+# fields of the mapping responses kept by iter_projected_mappings: the ones
+# the actions change, not the bodies and headers
+RESPONSE_FIELDS = (
+    "status",
+    "fault",
+    "fixedDelayMilliseconds",
+    "delayDistribution",
+    "chunkedDribbleDelay",
+)
+
+_WHITESPACE = " \t\n\r"
+
+
+def iter_mapping_files(
+    root: str,
+    recursive: bool = False,
+    errors: Optional[Dict[str, str]] = None,
+) -> Iterator[str]:
+    """yields the paths of the json files in root, and in its subdirectories
+    when recursive, in name order. Each directory is walked once, even when
+    symbolic links lead to it again. Directories that cannot be read are
+    skipped: their error is stored in errors by path"""
+    if errors is None:
+        errors = {}
+    visited = set()
+
+    def walk(path: str) -> Iterator[str]:
+        try:
+            stat = os.stat(path)
+            if (stat.st_dev, stat.st_ino) in visited:
+                return
+            visited.add((stat.st_dev, stat.st_ino))
+            with os.scandir(path) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError as e:
+            errors[path] = str(e)
+            return
+
+        for entry in entries:
+            if entry.is_dir():
+                if recursive and entry.name != BODY_FILES_DIR:
+                    yield from walk(entry.path)
+            elif entry.name.endswith(".json") and entry.is_file():
+                yield entry.path
+
+    return walk(root)
+
+
+class _JsonStream:
+    """incremental reader of the json values of a text file"""
+
+    def __init__(self, file: TextIO):
+        self.file = file
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self, size: int = None) -> bool:
+        """appends up to size characters to the buffer, dropping the
+        consumed ones. Returns False at the end of the file"""
+        if self.eof:
+            return False
+        data = self.file.read(size or READ_SIZE)
+        if not data:
+            self.eof = True
+            return False
+        consumed = self.pos
+        self.buffer = self.buffer[consumed:] + data
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """returns the next non blank character, without consuming it"""
+        while True:
+            while (
+                self.pos < len(self.buffer)
+                and self.buffer[self.pos] in _WHITESPACE
+            ):
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, chars: str) -> str:
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(
+                f"expected one of {chars!r}, found {char or 'end of file'!r}"
+            )
+        self.pos += 1
+        return char
+
+    def value(self) -> Any:
+        """decodes the next json value, reading more of the file until it
+        is complete. The read size doubles at each attempt so that large
+        values are not parsed over and over"""
+        self.peek()
+        size = READ_SIZE
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # a number may go on in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            if not self._fill(size):
+                continue
+            size *= 2
+
+    def array(
+        self, item: Callable[["_JsonStream"], Any] = None
+    ) -> Iterator[Any]:
+        """yields the items of the array starting at the current position,
+        read by item when set"""
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield item(self) if item else self.value()
+            if self.expect(",]") == "]":
+                return
+
+    def object(self) -> Iterator[str]:
+        """yields the keys of the object starting at the current position.
+        The value of each key must be read before the next one"""
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            if self.expect(",}") == "}":
+                return
+
+
+def iter_file_mappings(path: str) -> Iterator[Dict[str, Any]]:
+    """yields the mappings of a file, parsing bundles incrementally.
+    Raises ValueError when the file is not valid json"""
+    with open(path, encoding="utf-8") as file:
+        stream = _JsonStream(file)
+        first = stream.peek()
+        if first == "[":
+            yield from stream.array()
+            return
+
+        # an object: either a bundle or a single mapping
+        single = {}
+        bundle = False
+        for key in stream.object():
+            if key == "mappings" and stream.peek() == "[":
+                bundle = True
+                yield from stream.array()
+            else:
+                single[key] = stream.value()
+
+        if stream.peek():
+            raise ValueError("extra data after the json document")
+        if not bundle:
+            yield single
+
+
+def _projected_mapping(stream: _JsonStream) -> Dict[str, Any]:
+    """reads a mapping, keeping only MAPPING_FIELDS and RESPONSE_FIELDS.
+    The other values are decoded one at a time and dropped right away"""
+    mapping = {}
+    for key in stream.object():
+        if key == "response" and stream.peek() == "{":
+            response = {}
+            for field in stream.object():
+                value = stream.value()
+                if field in RESPONSE_FIELDS:
+                    response[field] = value
+            mapping["response"] = response
+        else:
+            value = stream.value()
+            if key in MAPPING_FIELDS:
+                mapping[key] = value
+    return mapping
+
+
+def iter_projected_mappings(file: TextIO) -> Iterator[Dict[str, Any]]:
+    """yields the mappings of a `{"mappings": [...]}` document, such as the
+    mappings list of the admin API, as they are parsed, with only the
+    fields needed to filter them (MAPPING_FIELDS and RESPONSE_FIELDS).
+    Raises ValueError when the document is not valid json"""
+    stream = _JsonStream(file)
+    for key in stream.object():
+        if key == "mappings" and stream.peek() == "[":
+            yield from stream.array(_projected_mapping)
+        else:
+            stream.value()
+
+
+def iter_dir_mappings(
+    root: str,
+    recursive: bool = False,
+    errors: Optional[Dict[str, str]] = None,
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """yields (path, mapping) for all the mappings found in root, and in its
+    subdirectories when recursive. Directories and files that cannot be
+    read or parsed, and items that are not stub mappings, are skipped:
+    their error is stored in errors by path"""
+    if errors is None:
+        errors = {}
+    for path in iter_mapping_files(root, recursive, errors):
+        invalid = 0
+        try:
+            for mapping in iter_file_mappings(path):
+                if not isinstance(mapping, dict) or "request" not in mapping:
+                    invalid += 1
+                    continue
+                yield path, mapping
+        except (OSError, ValueError) as e:
+            errors[path] = str(e)
+            continue
+        if invalid:
+            errors[path] = f"{invalid} item(s) are not stub mappings"
+
+
+def batched(items: Iterator[Any], size: int) -> Iterator[List[Any]]:
+    """groups items in lists of at most size items"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def report_progress(
+    progress: Optional[Callable[[Dict[str, Any]], None]],
+    count: int,
+    errors: Dict[str, str],
+    path: str,
+):
+    """passes the progress of a directory load to progress,
+    or logs it when there is no callback"""
+    if progress is None:
+        logger.info(
+            "[populate_from_dir]: %d mappings added, %d failed files (%s)",
+            count,
+            len(errors),
+            path,
+        )
+        return
+    progress({"mappings": count, "failed_files": len(errors), "path": path})
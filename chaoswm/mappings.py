@@ -0,0 +1,820 @@
+# -*- coding: utf-8 -*-
+"""
+
+Pure functions to match and change stub mappings, shared by the blocking
+and the asyncio drivers. None of them talks to the wiremock server.
+
+"""
+
+import copy
+import hashlib
+import json
+import re
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+)
+
+from logzero import logger
+
+from .codec import dumps_canonical
+
+__all__ = [
+    "AVAILABLE_FAULTS",
+    "DELAY_KEYS",
+    "strict_filter",
+    "recursive_filter",
+    "CompiledFilter",
+    "MultiFilter",
+    "Selection",
+    "check_status_code",
+    "check_chunked_dribble_delay",
+    "set_status_code_and_body",
+    "set_fixed_delay",
+    "remove_delays",
+    "content_hash",
+    "apply_change",
+    "with_id",
+    "METADATA_KEY",
+    "overlay_id",
+    "overlay_target",
+    "make_overlay",
+    "overlays_pattern",
+    "stamp",
+    "unstamp_modified",
+    "tagged_pattern",
+    "mark_for_deletion",
+    "deletion_pattern",
+    "MappingsSnapshot",
+    "request_key",
+]
+
+AVAILABLE_FAULTS = [
+    "EMPTY_RESPONSE",
+    "MALFORMED_RESPONSE_CHUNK",
+    "RANDOM_DATA_THEN_CLOSE",
+    "CONNECTION_RESET_BY_PEER",
+]
+
+DELAY_KEYS = [
+    "fixedDelayMilliseconds",
+    "delayDistribution",
+    "chunkedDribbleDelay",
+]
+
+URL_KEYS = ("url", "urlPath", "urlPattern", "urlPathPattern")
+
+_MISSING = object()
+
+
+def strict_filter(node: Mapping, _filter: Mapping) -> bool:
+    """(legacy) match mappings metadata with builtin equality comparison
+    Returns True if mapping matches the filter, False otherwise."""
+    intersec = node.keys() & _filter.keys()
+    if len(intersec) != len(_filter.keys()):
+        return False
+    for key in _filter.keys():
+        filter_value = _filter[key]
+        comp = node.get(key)
+        if filter_value != comp:
+            return False
+    return True
+
+
+def recursive_filter(node: Mapping, _filter: Mapping) -> bool:
+    """match mappings metadata by recursively comparing node by node
+    with the stub mapping.
+    Returns True if mapping matches the filter, False otherwise."""
+    intersec = node.keys() & _filter.keys()
+    if len(intersec) != len(_filter.keys()):
+        return False
+    for key in _filter.keys():
+        filter_value = _filter[key]
+        comp = node.get(key)
+        if isinstance(filter_value, Mapping):
+            if not recursive_filter(comp, filter_value):
+                return False
+        elif isinstance(filter_value, List):
+            if comp not in filter_value:
+                return False
+        elif filter_value != comp:
+            return False
+
+    return True
+
+
+class CompiledFilter:
+    """a mappings filter turned once into nested checks.
+    Strict filters compare the request section of a mapping with builtin
+    equality, non-strict ones compare the whole mapping recursively, a list
+    value matching any of its members (see strict_filter and
+    recursive_filter)."""
+
+    __slots__ = ("spec", "strict", "match", "anchor")
+
+    def __init__(self, spec: Mapping, strict: bool = True):
+        self.spec = spec
+        self.strict = strict
+        if strict:
+            self.match = _compile_strict(spec)
+            self.anchor = _find_anchor(spec, ("request",), strict=True)
+        else:
+            self.match = _compile_recursive(spec)
+            self.anchor = _find_anchor(spec, (), strict=False)
+
+
+class MultiFilter:
+    """matches a list of filters against mappings in a single pass.
+    Filters with an equality check on a hashable value are indexed by
+    that value, so each mapping is only checked against the filters it
+    can possibly match."""
+
+    def __init__(self, filters: List[Mapping], strict: bool = True):
+        self.filters = [CompiledFilter(f, strict) for f in filters]
+        self._anchored: Dict[Tuple[str, ...], Dict[Any, List[int]]] = {}
+        self._unanchored: List[int] = []
+        for index, compiled in enumerate(self.filters):
+            if compiled.anchor is None:
+                self._unanchored.append(index)
+                continue
+            path, value = compiled.anchor
+            by_value = self._anchored.setdefault(path, {})
+            by_value.setdefault(value, []).append(index)
+
+    def tag(self, mapping: Mapping[str, Any]) -> List[int]:
+        """Returns the indexes of all the filters matching the mapping"""
+        candidates = list(self._unanchored)
+        for path, by_value in self._anchored.items():
+            try:
+                candidates.extend(by_value.get(_resolve(mapping, path), ()))
+            except TypeError:
+                # unhashable value, it cannot be equal to the anchor
+                continue
+        return [
+            index
+            for index in sorted(candidates)
+            if self.filters[index].match(mapping)
+        ]
+
+    def selection(self, limit: int = 0) -> "Selection":
+        """an empty selection, to be filled one mapping at a time"""
+        return Selection(self, limit)
+
+    def select(
+        self, mappings: Iterable[Mapping[str, Any]], limit: int = 0
+    ) -> List[List[Mapping[str, Any]]]:
+        """Returns, for each filter, the list of matching mappings.
+        A filter stops collecting after limit matches (0 means no limit)"""
+        selection = self.selection(limit)
+        for mapping in mappings:
+            if selection.add(mapping):
+                break
+        return selection.selected
+
+
+class Selection:
+    """the mappings matching each filter of a MultiFilter, collected one
+    mapping at a time. A filter stops collecting after limit matches
+    (0 means no limit)"""
+
+    def __init__(self, multi: MultiFilter, limit: int = 0):
+        self.multi = multi
+        self.limit = limit
+        self.selected: List[List[Mapping[str, Any]]] = [
+            [] for _ in multi.filters
+        ]
+        self._saturated = 0
+
+    def add(self, mapping: Mapping[str, Any]) -> bool:
+        """adds the mapping to the matches of the filters it matches
+        Returns True once every filter has limit matches"""
+        limit = self.limit
+        for index in self.multi.tag(mapping):
+            matches = self.selected[index]
+            if 0 < limit <= len(matches):
+                continue
+            matches.append(mapping)
+            if len(matches) == limit:
+                self._saturated += 1
+        return limit > 0 and self._saturated == len(self.selected)
+
+
+def _compile_strict(_filter: Mapping) -> Callable[[Mapping], bool]:
+    items = list(_filter.items())
+
+    def match(mapping: Mapping) -> bool:
+        node = mapping.get("request")
+        if not isinstance(node, Mapping):
+            return False
+        for key, value in items:
+            if node.get(key, _MISSING) != value:
+                return False
+        return True
+
+    return match
+
+
+def _compile_recursive(_filter: Mapping) -> Callable[[Any], bool]:
+    checks = []
+    for key, value in _filter.items():
+        if isinstance(value, Mapping):
+            checks.append(_nested_check(key, _compile_recursive(value)))
+        elif isinstance(value, List):
+            checks.append(_membership_check(key, value))
+        else:
+            checks.append(_equality_check(key, value))
+
+    def match(node: Any) -> bool:
+        if not isinstance(node, Mapping):
+            return False
+        for check in checks:
+            if not check(node):
+                return False
+        return True
+
+    return match
+
+
+def _nested_check(
+    key: str, match: Callable[[Any], bool]
+) -> Callable[[Mapping], bool]:
+    return lambda node: match(node.get(key, _MISSING))
+
+
+def _equality_check(key: str, value: Any) -> Callable[[Mapping], bool]:
+    return lambda node: node.get(key, _MISSING) == value
+
+
+def _membership_check(key: str, values: List) -> Callable[[Mapping], bool]:
+    try:
+        members = frozenset(values)
+    except TypeError:
+        members = None
+
+    def check(node: Mapping) -> bool:
+        comp = node.get(key, _MISSING)
+        if members is not None:
+            try:
+                return comp in members
+            except TypeError:
+                pass
+        return comp in values
+
+    return check
+
+
+def _find_anchor(
+    _filter: Mapping, prefix: Tuple[str, ...], strict: bool
+) -> Optional[Tuple[Tuple[str, ...], Any]]:
+    """finds an equality check on a hashable value, usable as index key"""
+    for key, value in _filter.items():
+        if not strict and isinstance(value, Mapping):
+            anchor = _find_anchor(value, prefix + (key,), strict)
+            if anchor is not None:
+                return anchor
+            continue
+        if isinstance(value, (List, Mapping)):
+            continue
+        try:
+            hash(value)
+        except TypeError:
+            continue
+        return prefix + (key,), value
+    return None
+
+
+def _resolve(mapping: Mapping, path: Tuple[str, ...]) -> Any:
+    node = mapping
+    for key in path:
+        if not isinstance(node, Mapping):
+            return _MISSING
+        node = node.get(key, _MISSING)
+    return node
+
+
+def check_status_code(status_code: Any) -> bool:
+    """Returns True if status_code is a valid http status code"""
+    try:
+        status_code_number = int(status_code)
+        if status_code_number < 100 or status_code_number > 599:
+            logger.error(
+                "ERROR: incorrect http status code [%s]", str(status_code)
+            )
+            return False
+    except ValueError:
+        logger.error("ERROR: incorrect http status code [%s]", status_code)
+        return False
+    return True
+
+
+def check_chunked_dribble_delay(chunked_dribble_delay: Mapping) -> bool:
+    """Returns True if the chunked dribble delay has all required
+    attributes"""
+    if not isinstance(chunked_dribble_delay, dict):
+        logger.error(
+            "[chunked_dribble_delay]: parameter has to be a dictionary"
+        )
+    if "numberOfChunks" not in chunked_dribble_delay:
+        logger.error(
+            "[chunked_dribble_delay]: attribute numberOfChunks not "
+            "found in parameter"
+        )
+        return False
+    if "totalDuration" not in chunked_dribble_delay:
+        logger.error(
+            "[chunked_dribble_delay]: attribute totalDuration not found "
+            "in parameter"
+        )
+        return False
+    return True
+
+
+def set_status_code_and_body(
+    mapping: Mapping[str, Any],
+    status_code: str,
+    body: str = None,
+    body_file_name: str = None,
+):
+    """changes the response status code and body of a stub mapping"""
+    mapping["response"]["status"] = status_code
+    if body_file_name:
+        mapping["response"]["bodyFileName"] = body_file_name
+        mapping["response"].pop("body", None)
+    elif body:
+        mapping["response"].pop("bodyFileName", None)
+        mapping["response"]["body"] = body
+
+
+def set_fixed_delay(mapping: Mapping[str, Any], fixed_delay_milliseconds: int):
+    """replaces the delays of a stub mapping response with a fixed one"""
+    mapping["response"]["fixedDelayMilliseconds"] = fixed_delay_milliseconds
+    mapping["response"].pop("delayDistribution", None)
+
+
+def remove_delays(mapping: Mapping[str, Any]):
+    """deletes all delays attached to a stub mapping response"""
+    for key in DELAY_KEYS:
+        if key in mapping["response"]:
+            del mapping["response"][key]
+
+
+def content_hash(mapping: Mapping[str, Any]) -> str:
+    """hash of the canonical json encoding of a stub mapping"""
+    return hashlib.blake2b(
+        dumps_canonical(mapping), digest_size=16
+    ).hexdigest()
+
+
+def apply_change(
+    mappings: Iterable[Mapping[str, Any]],
+    change: Callable[[Mapping[str, Any]], Any],
+) -> Tuple[List[Mapping[str, Any]], List[Any]]:
+    """applies change in place to every mapping, comparing their content
+    hashes before and after.
+    Returns the mappings actually changed, that have to be written to
+    wiremock, and the ids of the mappings left as they were"""
+    changed = []
+    unchanged = []
+    for mapping in mappings:
+        before = content_hash(mapping)
+        change(mapping)
+        if content_hash(mapping) == before:
+            unchanged.append(mapping["id"])
+        else:
+            changed.append(mapping)
+    return changed, unchanged
+
+
+def with_id(mapping: Mapping[str, Any]) -> Mapping[str, Any]:
+    """returns the mapping, or a copy of it with a random id when it has
+    none, as wiremock does not return the ids of imported mappings"""
+    if mapping.get("id"):
+        return mapping
+    return dict(mapping, id=str(uuid.uuid4()))
+
+
+# metadata key of the information chaoswm keeps on the mappings
+METADATA_KEY = "chaoswm"
+
+# priority of the mappings without one, in wiremock
+DEFAULT_PRIORITY = 5
+
+# kept on overlays, so that they follow the state of scenario mappings
+SCENARIO_KEYS = ("scenarioName", "requiredScenarioState", "newScenarioState")
+
+_OVERLAY_NAMESPACE = uuid.UUID("4c0e7d1a-3b51-4f0a-9a44-8a2c1f6f1e5d")
+
+
+def overlay_id(stub_id: str) -> str:
+    """the id of the overlay of a mapping, the same for every injection"""
+    return str(uuid.uuid5(_OVERLAY_NAMESPACE, stub_id))
+
+
+def overlay_target(mapping: Mapping[str, Any]) -> Optional[str]:
+    """the id of the mapping an overlay shadows, None for other mappings"""
+    metadata = mapping.get("metadata") or {}
+    return (metadata.get(METADATA_KEY) or {}).get("overlay")
+
+
+def make_overlay(
+    mapping: Mapping[str, Any], previous: Mapping[str, Any] = None
+) -> Dict[str, Any]:
+    """returns a new overlay of a mapping: a copy of its request matcher
+    and response with a higher priority, so that wiremock serves it
+    instead. Starts from a copy of the previous overlay of the mapping
+    when there is one, so that changes add up"""
+    if previous is not None or overlay_target(mapping):
+        return copy.deepcopy(previous or mapping)
+
+    # wiremock serves the lowest priority number first
+    priority = mapping.get("priority") or DEFAULT_PRIORITY
+    if priority <= 1:
+        logger.warning(
+            "Mapping %s already has the highest priority: its overlay only "
+            "wins as the most recently added of the two",
+            mapping["id"],
+        )
+    overlay = {
+        "id": overlay_id(mapping["id"]),
+        "priority": max(1, priority - 1),
+        "request": copy.deepcopy(mapping["request"]),
+        "response": copy.deepcopy(mapping.get("response", {})),
+        "metadata": {METADATA_KEY: {"overlay": mapping["id"]}},
+    }
+    for key in SCENARIO_KEYS:
+        if key in mapping:
+            overlay[key] = mapping[key]
+    return overlay
+
+
+def overlays_pattern(targets: List[str] = None) -> Dict[str, Any]:
+    """metadata pattern of the overlays of the target mappings, or of all
+    the overlays"""
+    expression = f"$.{METADATA_KEY}.overlay"
+    if targets is None:
+        return {"matchesJsonPath": expression}
+    ids = "|".join(re.escape(target) for target in targets)
+    return {
+        "matchesJsonPath": {"expression": expression, "matches": f"^({ids})$"}
+    }
+
+
+def stamp(
+    mapping: Mapping[str, Any],
+    tag: str = None,
+    action: str = None,
+    modified: bool = False,
+) -> Mapping[str, Any]:
+    """records in the metadata of a mapping that chaoswm wrote it, with the
+    tag of the run and the action. The mappings chaoswm only changed are
+    recorded apart, under `modified`, so that they are restored rather than
+    deleted. Nothing is recorded without a tag. Returns the mapping"""
+    if tag is None:
+        return mapping
+    metadata = dict(mapping.get("metadata") or {})
+    info = dict(metadata.get(METADATA_KEY) or {})
+    target = dict(info.get("modified") or {}) if modified else info
+    target["tag"] = tag
+    if action is not None:
+        target["action"] = action
+    if modified:
+        info["modified"] = target
+    metadata[METADATA_KEY] = info
+    mapping["metadata"] = metadata
+    return mapping
+
+
+def unstamp_modified(mapping: Mapping[str, Any]):
+    """forgets that chaoswm changed a mapping, once it is put back"""
+    metadata = mapping.get("metadata") or {}
+    info = metadata.get(METADATA_KEY) or {}
+    if "modified" not in info:
+        return
+    info = {key: value for key, value in info.items() if key != "modified"}
+    metadata = {key: value for key, value in metadata.items()}
+    if info:
+        metadata[METADATA_KEY] = info
+    else:
+        del metadata[METADATA_KEY]
+    if metadata:
+        mapping["metadata"] = metadata
+    else:
+        del mapping["metadata"]
+
+
+def tagged_pattern(
+    tag: str = None, action: str = None, modified: bool = False
+) -> Dict[str, Any]:
+    """metadata pattern of the mappings created by chaoswm, or of the ones
+    it modified, optionally only the ones with a tag and written by an
+    action"""
+    conditions = []
+    for key, value in (("tag", tag), ("action", action)):
+        if value is not None:
+            quoted = str(value).replace("\\", "\\\\").replace("'", "\\'")
+            conditions.append(f"@.{key} == '{quoted}'")
+    expression = f"$.{METADATA_KEY}"
+    if modified:
+        expression += ".modified"
+    elif not conditions:
+        # every created mapping has an action, modified ones only below
+        conditions.append("@.action")
+    if conditions:
+        expression += f"[?({' && '.join(conditions)})]"
+    return {"matchesJsonPath": expression}
+
+
+def mark_for_deletion(
+    mapping: Mapping[str, Any], token: str
+) -> Dict[str, Any]:
+    """a copy of a mapping marked in its metadata with the token of a bulk
+    deletion"""
+    metadata = dict(mapping.get("metadata") or {})
+    metadata[METADATA_KEY] = dict(
+        metadata.get(METADATA_KEY) or {}, delete=token
+    )
+    return dict(mapping, metadata=metadata)
+
+
+def deletion_pattern(token: str) -> Dict[str, Any]:
+    """metadata pattern of the mappings marked for a bulk deletion"""
+    return {"matchesJsonPath": f"$.{METADATA_KEY}[?(@.delete == '{token}')]"}
+
+
+# the snapshot blocks open in the current thread or task, by snapshot
+_SNAPSHOT_BLOCKS: ContextVar[Dict[int, "_SnapshotCopy"]] = ContextVar(
+    "snapshot_blocks", default={}
+)
+
+
+class _SnapshotCopy:
+    """a downloaded mappings list and its request index.
+    Writes go to mappings kept by id, in list order, built on the first
+    write, and the list is only put back together when read, so that each
+    write costs the same whatever the number of mappings"""
+
+    def __init__(self):
+        self.depth = 0
+        self.generation = -1
+        self.fetched_at = 0.0
+        self._list: Optional[List[Any]] = None
+        self._by_id: Optional[Dict[str, Mapping]] = None
+        self._order: Optional[Dict[str, int]] = None
+        self._keys: Optional[Dict[str, Hashable]] = None
+        self._by_request: Optional[Dict[Hashable, Dict[str, Mapping]]] = None
+        self._next = 0
+
+    @property
+    def loaded(self) -> bool:
+        return self._list is not None or self._by_id is not None
+
+    @property
+    def mappings(self) -> Optional[List[Any]]:
+        if self._list is None and self._by_id is not None:
+            self._list = list(self._by_id.values())
+        return self._list
+
+    def load(self, mappings: List[Any]):
+        self.drop()
+        self._list = mappings
+
+    def drop(self):
+        self._list = None
+        self._by_id = None
+        self._order = None
+        self._keys = None
+        self._by_request = None
+
+    def find_by_request(self, request: Mapping[str, Any]) -> Optional[Mapping]:
+        self._index()
+        bucket = self._by_request.get(request_key(request))
+        return next(iter(bucket.values())) if bucket else None
+
+    def replace(self, mapping: Mapping[str, Any]):
+        self._index()
+        stub_id = mapping["id"]
+        if stub_id not in self._by_id:
+            self.add(mapping)
+            return
+        self._list = None
+        # assigning an existing key keeps its place in the list order
+        self._by_id[stub_id] = mapping
+        key = request_key(mapping.get("request"))
+        if key == self._keys[stub_id]:
+            self._by_request[key][stub_id] = mapping
+            return
+        self._unindex(stub_id)
+        self._reindex(mapping, key)
+
+    def add(self, mapping: Mapping[str, Any]):
+        self._index()
+        stub_id = mapping["id"]
+        if stub_id in self._by_id:
+            self.replace(mapping)
+            return
+        self._list = None
+        self._by_id[stub_id] = mapping
+        self._order[stub_id] = self._next
+        self._next += 1
+        self._reindex(mapping, request_key(mapping.get("request")))
+
+    def remove(self, stub_id: str):
+        self._index()
+        if self._by_id.pop(stub_id, None) is None:
+            return
+        self._list = None
+        self._unindex(stub_id)
+        del self._order[stub_id]
+
+    def _index(self):
+        if self._by_request is not None:
+            return
+        self._by_id = {}
+        self._order = {}
+        self._keys = {}
+        self._by_request = {}
+        for position, mapping in enumerate(self._list):
+            self._by_id[mapping["id"]] = mapping
+            self._order[mapping["id"]] = position
+            key = request_key(mapping.get("request"))
+            self._keys[mapping["id"]] = key
+            self._by_request.setdefault(key, {})[mapping["id"]] = mapping
+        self._next = len(self._list)
+
+    def _unindex(self, stub_id: str):
+        key = self._keys.pop(stub_id, None)
+        bucket = self._by_request.get(key, {})
+        bucket.pop(stub_id, None)
+        if not bucket:
+            self._by_request.pop(key, None)
+
+    def _reindex(self, mapping: Mapping[str, Any], key: Hashable):
+        stub_id = mapping["id"]
+        self._keys[stub_id] = key
+        bucket = self._by_request.setdefault(key, {})
+        bucket[stub_id] = mapping
+        # the first mapping in list order wins an exact match: only a
+        # mapping moved to the bucket of another request can land out of it
+        order = self._order[stub_id]
+        if any(self._order[other] > order for other in bucket):
+            ordered = sorted(bucket.items(), key=lambda i: self._order[i[0]])
+            bucket.clear()
+            bucket.update(ordered)
+
+
+class MappingsSnapshot:
+    """local copy of the mappings list of a wiremock server.
+    With a ttl, one cached is shared by all the threads and kept for ttl
+    seconds after the download. Otherwise each thread or task has its own
+    copy, kept while it has a snapshot block open on the driver: the
+    concurrent calls run on behalf of a block share its cached.
+    Drivers apply their own single mapping writes to the copy and
+    invalidate it on bulk writes. Any write makes the copies of the other
+    blocks stale.
+    Exact request lookups go through an index keyed on request_key, built
+    once per download."""
+
+    def __init__(self, ttl: float = None):
+        self.ttl = ttl
+        self.lock = threading.RLock()
+        self.generation = 0
+        self._shared = _SnapshotCopy()
+
+    def _block(self) -> Optional[_SnapshotCopy]:
+        return _SNAPSHOT_BLOCKS.get().get(id(self))
+
+    @property
+    def depth(self) -> int:
+        """the number of snapshot blocks open in the current thread or task"""
+        block = self._block()
+        return block.depth if block else 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl is not None or self.depth > 0
+
+    def _copy(self) -> Optional[_SnapshotCopy]:
+        """the copy used by the current thread or task, if caching"""
+        if self.ttl is not None:
+            return self._shared
+        return self._block()
+
+    def _valid(self) -> Optional[_SnapshotCopy]:
+        """the copy of the current thread or task, if it holds a valid
+        mappings list"""
+        cached = self._copy()
+        if cached is None or not cached.loaded:
+            return None
+        if cached.generation != self.generation or (
+            self.ttl is not None
+            and time.monotonic() - cached.fetched_at > self.ttl
+        ):
+            cached.drop()
+            return None
+        return cached
+
+    def get(self) -> Optional[List[Any]]:
+        """Returns the cached mappings or None if there is no valid copy"""
+        with self.lock:
+            cached = self._valid()
+            return None if cached is None else cached.mappings
+
+    def store(self, mappings: List[Any]):
+        """keeps a freshly downloaded mappings list, if caching is enabled"""
+        with self.lock:
+            cached = self._copy()
+            if cached is not None:
+                cached.load(mappings)
+                cached.generation = self.generation
+                cached.fetched_at = time.monotonic()
+
+    def invalidate(self):
+        with self.lock:
+            self.generation += 1
+            cached = self._copy()
+            if cached is not None:
+                cached.drop()
+
+    def open(self):
+        with self.lock:
+            blocks = _SNAPSHOT_BLOCKS.get()
+            block = blocks.get(id(self))
+            if block is None:
+                block = _SnapshotCopy()
+                _SNAPSHOT_BLOCKS.set({**blocks, id(self): block})
+            block.depth += 1
+
+    def close(self):
+        with self.lock:
+            blocks = _SNAPSHOT_BLOCKS.get()
+            block = blocks.get(id(self))
+            if block is None:
+                return
+            block.depth -= 1
+            if block.depth == 0:
+                block.drop()
+                _SNAPSHOT_BLOCKS.set(
+                    {key: b for key, b in blocks.items() if key != id(self)}
+                )
+
+    def find_by_request(
+        self, request: Mapping[str, Any]
+    ) -> Tuple[bool, Optional[Mapping]]:
+        """exact match lookup of a request section in the cached mappings.
+        Returns whether a cached is cached and the first matching mapping"""
+        with self.lock:
+            cached = self._valid()
+            if cached is None:
+                return False, None
+            return True, cached.find_by_request(request)
+
+    def replace(self, mapping: Mapping[str, Any]):
+        """applies an update of a mapping to the cached copy"""
+        self._apply(lambda cached: cached.replace(mapping))
+
+    def add(self, mapping: Mapping[str, Any]):
+        """applies the creation of a mapping to the cached copy"""
+        self._apply(lambda cached: cached.add(mapping))
+
+    def remove(self, stub_id: str):
+        """applies the deletion of a mapping to the cached copy"""
+        self._apply(lambda cached: cached.remove(stub_id))
+
+    def _apply(self, write: Callable[[_SnapshotCopy], None]):
+        """applies a single mapping write to the copy of the current thread
+        or task, the copies of the others are stale"""
+        with self.lock:
+            cached = self._valid()
+            self.generation += 1
+            if cached is not None:
+                write(cached)
+                cached.generation = self.generation
+
+
+def request_key(request: Mapping[str, Any]) -> Hashable:
+    """canonical, hashable form of the request section of a mapping:
+    two request sections are equal when their keys are equal"""
+    if not isinstance(request, Mapping):
+        return (None, (), json.dumps(request, default=str))
+    url = tuple((key, request[key]) for key in URL_KEYS if key in request)
+    rest = {
+        key: value
+        for key, value in request.items()
+        if key != "method" and key not in URL_KEYS
+    }
+    return (
+        request.get("method"),
+        url,
+        json.dumps(rest, sort_keys=True, default=str),
+    )
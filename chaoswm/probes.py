@@ -1,12 +1,26 @@
 # -*- coding: utf-8 -*-
 from chaoslib.types import Configuration
 from logzero import logger
-from typing import Any, List
+from typing import Any, Dict, List, Mapping
 
-from .driver import ConnectionError, Wiremock
-from .utils import check_configuration, get_wm_params
+from .cluster import on_nodes
+from .driver import ConnectionError
+from .journal import GROUP_BY, latency_stats
+from .stats import admin_stats as _admin_stats
+from .utils import check_configuration
 
-__all__ = ["mappings", "server_running"]
+__all__ = [
+    "mappings",
+    "tagged_mappings",
+    "server_running",
+    "admin_stats",
+    "count_requests",
+    "count_requests_batch",
+    "find_requests",
+    "latency_percentiles",
+    "journal_stats",
+    "journal_error_ratio",
+]
 
 
 def server_running(configuration: Configuration = None) -> int:
@@ -14,10 +28,8 @@ def server_running(configuration: Configuration = None) -> int:
         logger.error("Configuration error")
         return None
 
-    params = get_wm_params(configuration)
     try:
-        Wiremock(url=params["url"], timeout=params["timeout"])
-        return 1
+        return on_nodes(configuration, lambda w: 1, mutating=False)
     except ConnectionError:
         logger.error("Wiremock server not running")
         return 0
@@ -27,9 +39,156 @@ def mappings(configuration: Configuration = None) -> List[Any]:
     if not check_configuration(configuration):
         return []
     try:
-        params = get_wm_params(configuration)
-        w = Wiremock(url=params["url"], timeout=params["timeout"])
-        return w.mappings()
+        return on_nodes(configuration, lambda w: w.mappings(), mutating=False)
     except ConnectionError:
         logger.error("Error connecting to Wiremock server")
         return None
+
+
+def tagged_mappings(
+    tag: str = None,
+    action: str = None,
+    modified: bool = False,
+    configuration: Configuration = None,
+) -> List[Any]:
+    """Returns the mappings chaoswm created with a tag (by default the `tag`
+    key of the configuration) and, if set, by an action such as `populate`.
+    With modified true, returns the mappings it changed instead, such as
+    with `update_fault`. Wiremock does the selection: a single request
+    whatever the number of mappings"""
+    if not check_configuration(configuration):
+        return []
+
+    return on_nodes(
+        configuration,
+        lambda w: w.tagged_mappings(tag, action, modified),
+        mutating=False,
+    )
+
+
+def admin_stats(
+    reset: bool = False, configuration: Configuration = None
+) -> Dict[str, Any]:
+    """Returns the admin API calls made by the drivers of this process so
+    far, per endpoint: calls, errors, bytes sent and received, time spent
+    and latency histogram. When reset is true the counters start over"""
+    stats = _admin_stats.get()
+    if reset:
+        _admin_stats.reset()
+    return stats
+
+
+def count_requests(
+    pattern: Mapping[str, Any], configuration: Configuration = None
+) -> int:
+    """Counts the requests received by wiremock matching a request pattern,
+    such as `{"method": "GET", "urlPath": "/epg"}`. The server does the
+    counting, the journal is not downloaded"""
+    if not check_configuration(configuration):
+        return -1
+
+    return on_nodes(
+        configuration, lambda w: w.count_requests(pattern), mutating=False
+    )
+
+
+def count_requests_batch(
+    patterns: List[Mapping[str, Any]], configuration: Configuration = None
+) -> List[int]:
+    """Counts the requests matching each request pattern, with concurrent
+    count requests. Returns the counts in patterns order, -1 for the
+    patterns that could not be counted"""
+    if not check_configuration(configuration):
+        return []
+
+    return on_nodes(
+        configuration,
+        lambda w: w.count_requests_many(patterns),
+        lambda w, counts: -1 not in counts,
+        mutating=False,
+    )
+
+
+def find_requests(
+    pattern: Mapping[str, Any], configuration: Configuration = None
+) -> List[Any]:
+    """Returns the requests received by wiremock matching a request
+    pattern"""
+    if not check_configuration(configuration):
+        return []
+
+    return on_nodes(
+        configuration, lambda w: w.find_requests(pattern), mutating=False
+    )
+
+
+def latency_percentiles(
+    group_by: str = "stub",
+    limit: int = None,
+    configuration: Configuration = None,
+) -> Dict[str, Any]:
+    """Computes, per stub mapping (`group_by` stub) or per url (`group_by`
+    url), the p50/p90/p99/max of the totalTime, serveTime and addedDelay
+    timings of the requests served by wiremock, with the status code and
+    fault histograms.
+    :param limit: only the most recent requests of the journal
+    """
+    if not check_configuration(configuration):
+        return {}
+
+    if group_by not in GROUP_BY:
+        logger.error("Unknown group_by %s", group_by)
+        return {}
+
+    def activity(w: Any) -> Dict[str, Any]:
+        events = w.journal(limit=limit)
+        if events is None:
+            return None
+        return latency_stats(events, group_by)
+
+    return on_nodes(configuration, activity, mutating=False)
+
+
+def journal_stats(
+    name: str = "default",
+    reset: bool = False,
+    from_start: bool = False,
+    configuration: Configuration = None,
+) -> Dict[str, Any]:
+    """Tails the request journal: downloads only the requests logged since
+    the previous call with the same name and returns the rolling stats of
+    all the requests seen so far: count, errors and error ratio, status
+    codes and total time percentiles (from a logarithmic histogram).
+    :param name: name of the tailer, to follow the journal independently
+    :param reset: start the rolling stats over after this call
+    :param from_start: on the first call, also take the requests logged
+    before it
+    """
+    if not check_configuration(configuration):
+        return {}
+
+    def activity(w: Any) -> Dict[str, Any]:
+        tailer = w.journal_tailer(name, from_start=from_start)
+        new = tailer.poll()
+        stats = dict(tailer.stats.as_dict(), new=new)
+        if reset:
+            tailer.reset()
+        return stats
+
+    return on_nodes(configuration, activity, mutating=False)
+
+
+def journal_error_ratio(
+    name: str = "default", configuration: Configuration = None
+) -> float:
+    """Tails the request journal like `journal_stats` and returns the ratio
+    of the requests answered with a fault or a 5xx status code"""
+    if not check_configuration(configuration):
+        return -1
+
+    def activity(w: Any) -> float:
+        tailer = w.journal_tailer(name)
+        tailer.poll()
+        return tailer.stats.as_dict()["error_ratio"]
+
+    return on_nodes(configuration, activity, mutating=False)
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+
+In-process registry of the admin API calls made by the drivers. Every
+call is recorded under its endpoint (method and path, with the stub ids
+replaced by `{id}`), with its count, errors, bytes sent and received and
+a latency histogram of logarithmic buckets.
+
+"""
+
+import bisect
+import re
+import threading
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlsplit
+
+__all__ = [
+    "LATENCY_BUCKETS",
+    "bucket_label",
+    "AdminStats",
+    "admin_stats",
+    "endpoint_of",
+    "record_call",
+    "body_size",
+]
+
+# upper bounds, in seconds, of the latency buckets: 1ms to ~16s
+LATENCY_BUCKETS = tuple(0.001 * 2**i for i in range(15))
+
+_ID_SEGMENT = re.compile(
+    r"^([0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-"
+    r"[0-9a-fA-F]{4}-[0-9a-fA-F]{12}|\d+)$"
+)
+
+
+def endpoint_of(method: str, url: str) -> str:
+    """returns the endpoint key of an admin call, such as
+    `PUT /__admin/mappings/{id}`"""
+    path = urlsplit(url).path
+    segments = [
+        "{id}" if _ID_SEGMENT.match(segment) else segment
+        for segment in path.split("/")
+    ]
+    return f"{method.upper()} {'/'.join(segments)}"
+
+
+def body_size(body: Any) -> int:
+    """size in bytes of a request or response body"""
+    if body is None:
+        return 0
+    if isinstance(body, str):
+        return len(body.encode("utf-8"))
+    try:
+        return len(body)
+    except TypeError:
+        # streamed bodies (generators, files) are not measured
+        return 0
+
+
+class _EndpointStats:
+    """counters of a single endpoint"""
+
+    __slots__ = ("calls", "errors", "sent", "received", "total", "buckets")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.sent = 0
+        self.received = 0
+        self.total = 0.0
+        # one extra bucket for the calls slower than the last bound
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "bytes_sent": self.sent,
+            "bytes_received": self.received,
+            "total_seconds": self.total,
+            "mean_seconds": self.total / self.calls if self.calls else 0.0,
+            "latency_histogram": {
+                bucket_label(i): count
+                for i, count in enumerate(self.buckets)
+                if count
+            },
+        }
+
+
+def bucket_label(index: int) -> str:
+    """name of a latency bucket, after its upper bound"""
+    if index < len(LATENCY_BUCKETS):
+        return f"le_{LATENCY_BUCKETS[index] * 1000:g}ms"
+    return "inf"
+
+
+class AdminStats:
+    """thread-safe registry of admin calls statistics, per endpoint"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints: Dict[str, _EndpointStats] = {}
+
+    def record(
+        self,
+        method: str,
+        url: str,
+        elapsed: float,
+        sent: int = 0,
+        received: int = 0,
+        error: bool = False,
+    ):
+        """records one admin call"""
+        endpoint = endpoint_of(method, url)
+        bucket = bisect.bisect_left(LATENCY_BUCKETS, elapsed)
+        with self._lock:
+            stats = self._endpoints.get(endpoint)
+            if stats is None:
+                stats = self._endpoints[endpoint] = _EndpointStats()
+            stats.calls += 1
+            stats.errors += int(error)
+            stats.sent += sent
+            stats.received += received
+            stats.total += elapsed
+            stats.buckets[bucket] += 1
+
+    def get(self, endpoint: Optional[str] = None) -> Dict[str, Any]:
+        """returns the statistics of all the endpoints, with their totals,
+        or of a single endpoint"""
+        with self._lock:
+            if endpoint is not None:
+                stats = self._endpoints.get(endpoint)
+                return stats.as_dict() if stats else {}
+            endpoints = {
+                key: value.as_dict() for key, value in self._endpoints.items()
+            }
+
+        totals = {
+            key: sum(e[key] for e in endpoints.values())
+            for key in (
+                "calls",
+                "errors",
+                "bytes_sent",
+                "bytes_received",
+                "total_seconds",
+            )
+        }
+        return {"totals": totals, "endpoints": endpoints}
+
+    def endpoints(self) -> List[str]:
+        with self._lock:
+            return sorted(self._endpoints)
+
+    def reset(self):
+        """forgets all the recorded calls"""
+        with self._lock:
+            self._endpoints.clear()
+
+
+admin_stats = AdminStats()
+
+
+def record_call(
+    method: str,
+    url: str,
+    elapsed: float,
+    sent: int = 0,
+    received: int = 0,
+    error: bool = False,
+):
+    """records one admin call in the process-wide registry"""
+    admin_stats.record(method, url, elapsed, sent, received, error)
@@ -1,11 +1,27 @@
 # -*- coding: utf-8 -*-
 import socket
 from contextlib import closing
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
 
 from logzero import logger
 
-__all__ = ["can_connect_to", "get_wm_params", "check_configuration"]
+__all__ = [
+    "can_connect_to",
+    "get_wm_params",
+    "get_wm_nodes_params",
+    "check_configuration",
+]
+
+DEFAULT_POOL_SIZE = 10
+
+DEFAULT_IMPORT_CHUNK_SIZE = 500
+
+DEFAULT_MAX_WORKERS = 10
+
+DEFAULT_PAGE_SIZE = 500
+
+# keys locating a single node, replaced by the ones of each node
+NODE_KEYS = ("host", "port", "url")
 
 
 def can_connect_to(host: str, port: int) -> bool:
@@ -23,6 +39,18 @@ def get_wm_params(configuration: Dict[str, Any]) -> Optional[Dict[str, Any]]:
     port = wm_conf.get("port", None)
     context_path = wm_conf.get("contextPath", "")
     timeout = wm_conf.get("timeout", 1)
+    pool_size = wm_conf.get("pool_size", DEFAULT_POOL_SIZE)
+    keep_alive = wm_conf.get("keep_alive", True)
+    import_chunk_size = wm_conf.get(
+        "import_chunk_size", DEFAULT_IMPORT_CHUNK_SIZE
+    )
+    duplicate_policy = wm_conf.get("duplicate_policy", "OVERWRITE")
+    max_workers = wm_conf.get("max_workers", DEFAULT_MAX_WORKERS)
+    snapshot_ttl = wm_conf.get("snapshot_ttl", None)
+    injection = wm_conf.get("injection", "rewrite")
+    tag = wm_conf.get("tag", None)
+    page_size = wm_conf.get("page_size", DEFAULT_PAGE_SIZE)
+    streaming = wm_conf.get("streaming", False)
 
     url = ""
 
@@ -35,7 +63,48 @@ def get_wm_params(configuration: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         logger.error("No configuration params to set WM server url")
         return None
 
-    return {"url": url, "timeout": timeout}
+    return {
+        "url": url,
+        "timeout": timeout,
+        "pool_size": pool_size,
+        "keep_alive": keep_alive,
+        "import_chunk_size": import_chunk_size,
+        "duplicate_policy": duplicate_policy,
+        "max_workers": max_workers,
+        "snapshot_ttl": snapshot_ttl,
+        "injection": injection,
+        "tag": tag,
+        "page_size": page_size,
+        "streaming": streaming,
+    }
+
+
+def get_wm_nodes_params(
+    configuration: Dict[str, Any],
+) -> Optional[List[Dict[str, Any]]]:
+    """Calculate the wiremock parameters of every node of a cluster.
+    Each entry of the `nodes` key is either a url or a dictionary of
+    settings overriding the common ones. Without `nodes`, the
+    configuration describes a single node"""
+    wm_conf = configuration.get("wiremock", {})
+    if "nodes" not in wm_conf:
+        params = get_wm_params(configuration)
+        return [params] if params else None
+
+    common = {
+        key: value
+        for key, value in wm_conf.items()
+        if key != "nodes" and key not in NODE_KEYS
+    }
+    nodes = []
+    for node in wm_conf["nodes"]:
+        if isinstance(node, str):
+            node = {"url": node}
+        params = get_wm_params({"wiremock": dict(common, **node)})
+        if not params:
+            return None
+        nodes.append(params)
+    return nodes
 
 
 def check_configuration(configuration: Dict[str, Any] = None) -> bool:
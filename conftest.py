@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+"""
+
+Puts the repository root on sys.path for the test run, so that the tests of
+the benchmarks package, left out of the distribution, import it whatever
+the directory pytest is started from.
+
+"""
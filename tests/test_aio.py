@@ -0,0 +1,105 @@
+import asyncio
+import json
+import unittest
+
+from chaoswm.aio import HAS_HTTPX, AsyncWiremock, AsyncWiremockRunner
+
+if HAS_HTTPX:
+    import httpx
+
+WM_URL = "http://wiremock.local:8080"
+
+MAPPINGS = [
+    {
+        "id": str(i),
+        "request": {"method": "GET", "url": f"/thing/{i}"},
+        "response": {"status": 200},
+    }
+    for i in range(10)
+]
+
+
+def mock_client(requests_log, max_in_flight):
+    in_flight = []
+
+    async def handler(request):
+        requests_log.append(request)
+        in_flight.append(request)
+        max_in_flight[0] = max(max_in_flight[0], len(in_flight))
+        await asyncio.sleep(0.01)
+        in_flight.remove(request)
+        if request.method == "GET":
+            return httpx.Response(200, json={"mappings": MAPPINGS})
+        if request.method == "PUT":
+            return httpx.Response(200, content=request.content)
+        return httpx.Response(200)
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+@unittest.skipUnless(HAS_HTTPX, "httpx not installed")
+class TestAsyncWiremock(unittest.TestCase):
+    def test_update_fault_with_concurrency_limit(self):
+        requests_log, max_in_flight = [], [0]
+
+        async def run():
+            w = AsyncWiremock(url=WM_URL, max_workers=3)
+            w.client = mock_client(requests_log, max_in_flight)
+            async with w:
+                mappings = await w.filter_mappings(
+                    {"request": {"method": ["GET"]}}, strict=False
+                )
+                return await w.update_fault(mappings, "EMPTY_RESPONSE")
+
+        ids = asyncio.run(run())
+        self.assertEqual(ids, [m["id"] for m in MAPPINGS])
+        self.assertEqual(len(requests_log), 11)
+        self.assertEqual(max_in_flight[0], 3)
+        self.assertEqual(
+            json.loads(requests_log[-1].content)["response"]["fault"],
+            "EMPTY_RESPONSE",
+        )
+
+    def test_runner_blocking_calls(self):
+        requests_log, max_in_flight = [], [0]
+        with AsyncWiremockRunner(url=WM_URL) as w:
+            w.driver.client = mock_client(requests_log, max_in_flight)
+            self.assertEqual(len(w.mappings()), 10)
+            self.assertEqual(w.reset(), 1)
+            self.assertEqual(w.max_workers, 10)
+        self.assertEqual([r.method for r in requests_log], ["GET", "POST"])
+
+    def test_filter_mapping_pages(self):
+        offsets = []
+
+        async def handler(request):
+            offset = int(request.url.params["offset"])
+            limit = int(request.url.params["limit"])
+            offsets.append(offset)
+            return httpx.Response(
+                200,
+                json={
+                    "mappings": MAPPINGS[offset : offset + limit],
+                    "meta": {"total": len(MAPPINGS)},
+                },
+            )
+
+        async def run():
+            w = AsyncWiremock(url=WM_URL, page_size=4)
+            w.client = httpx.AsyncClient(
+                transport=httpx.MockTransport(handler)
+            )
+            async with w:
+                return await w.filter_mapping(
+                    {"method": "GET", "url": "/thing/5"}
+                )
+
+        self.assertEqual(asyncio.run(run()), MAPPINGS[5])
+        self.assertEqual(offsets, [0, 4])
+
+    def test_streaming_ignored(self):
+        with self.assertLogs("logzero_default", "WARNING") as logs:
+            w = AsyncWiremock(url=WM_URL, streaming=True)
+        self.assertFalse(w.streaming)
+        self.assertIn("streaming", logs.output[0])
+        asyncio.run(w.close())
@@ -0,0 +1,27 @@
+import unittest
+
+from benchmarks.__main__ import run_size
+from benchmarks.admin_server import StandInAdminServer
+from chaoswm.driver import Wiremock
+
+
+class TestStandInAdminServer(unittest.TestCase):
+    def test_driver_roundtrip(self):
+        with StandInAdminServer() as server, Wiremock(url=server.url) as w:
+            ids = w.populate(
+                [{"request": {"method": "GET", "url": "/a"}}], bulk=True
+            )
+            self.assertEqual([m["id"] for m in w.mappings()], ids)
+            self.assertEqual(len(w.filter_mappings({"url": "/a"})), 1)
+            with w.snapshot():
+                w.mappings()
+                self.assertEqual(w.delete_all_mappings(), ids)
+            self.assertEqual(w.mappings(), [])
+
+    def test_run_size(self):
+        results = run_size(20, 0.0, 20, trace_memory=True)
+        self.assertEqual(results["populate_bulk"]["admin_calls"], 1)
+        self.assertEqual(results["populate"]["admin_calls"], 20)
+        for result in results.values():
+            self.assertEqual(result["admin_errors"], 0)
+            self.assertGreater(result["peak_memory_bytes"], 0)
@@ -1,13 +1,18 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import logging
+import os
+import tempfile
 import unittest
 from http.client import HTTPConnection
 
+import requests_mock
+
 from chaoswm.actions import (
     add_mappings,
     chunked_dribble_delay,
     delete_mappings,
+    delete_tagged_mappings,
     down,
     fixed_delay,
     global_fixed_delay,
@@ -15,9 +20,18 @@ from chaoswm.actions import (
     populate_from_dir,
     random_delay,
     reset,
+    restore_mappings,
+    snapshot_mappings,
     up,
+    update_mappings_fault,
+)
+from chaoswm.probes import (
+    count_requests,
+    count_requests_batch,
+    find_requests,
+    mappings,
+    tagged_mappings,
 )
-from chaoswm.probes import mappings
 from chaoswm.utils import can_connect_to, get_wm_params
 
 HTTPConnection.debuglevel = 1
@@ -27,6 +41,9 @@ requests_log = logging.getLogger("urllib3")
 requests_log.setLevel(logging.DEBUG)
 requests_log.propagate = True
 
+WM_URL = "http://wiremock.local:8080"
+WM_CONFIG = {"wiremock": {"url": WM_URL}}
+
 
 @unittest.skipIf(
     can_connect_to("localhost", 8080) is False,
@@ -396,3 +413,162 @@ class TestActions(unittest.TestCase):
 
         m = mappings({"wiremock": {"host": "localhost", "port": 8080}})
         self.assertTrue("chunkedDribbleDelay" not in m[0]["response"])
+
+
+class TestActionsMocked(unittest.TestCase):
+    mappings = [
+        {
+            "id": str(i),
+            "request": {"method": "GET", "url": f"/thing/{i}"},
+            "response": {"status": 200},
+        }
+        for i in range(5)
+    ]
+
+    def test_filters_share_one_mappings_download(self):
+        with requests_mock.Mocker() as m:
+            m.get(
+                f"{WM_URL}/__admin/mappings", json={"mappings": self.mappings}
+            )
+            for mapping in self.mappings:
+                m.put(
+                    f"{WM_URL}/__admin/mappings/{mapping['id']}",
+                    json=mapping,
+                )
+            with self.assertLogs("logzero_default", "INFO") as logs:
+                ids = update_mappings_fault(
+                    filter=[
+                        {"method": "GET", "url": "/thing/1"},
+                        {"method": "GET", "url": "/thing/3"},
+                        {"method": "GET", "url": "/thing/1"},
+                    ],
+                    fault="EMPTY_RESPONSE",
+                    configuration=WM_CONFIG,
+                )
+            self.assertEqual(ids, ["1", "3"])
+            self.assertEqual((ids.written, ids.skipped), (["1", "3"], []))
+            self.assertIn(
+                "[update_mappings_fault]: 2 mappings written", logs.output[-1]
+            )
+            methods = [r.method for r in m.request_history]
+            self.assertEqual(methods, ["GET", "PUT", "PUT"])
+
+    def test_snapshot_and_restore_mappings(self):
+        with requests_mock.Mocker() as m:
+            m.get(
+                f"{WM_URL}/__admin/mappings", json={"mappings": self.mappings}
+            )
+            m.post(f"{WM_URL}/__admin/mappings/import")
+            ids = snapshot_mappings(
+                filter=[{"method": "GET", "url": "/thing/1"}],
+                name="before",
+                configuration=WM_CONFIG,
+            )
+            self.assertEqual(ids, ["1"])
+
+            restored = restore_mappings("before", configuration=WM_CONFIG)
+            self.assertEqual(restored, ["1"])
+            body = m.request_history[-1].json()
+            self.assertEqual(body["mappings"], [self.mappings[1]])
+            self.assertEqual(
+                body["importOptions"]["duplicatePolicy"], "OVERWRITE"
+            )
+            self.assertIsNone(
+                restore_mappings("unknown", configuration=WM_CONFIG)
+            )
+
+    def test_snapshot_mappings_to_file(self):
+        with tempfile.TemporaryDirectory() as tmp, requests_mock.Mocker() as m:
+            path = os.path.join(tmp, "mappings.json")
+            m.get(
+                f"{WM_URL}/__admin/mappings", json={"mappings": self.mappings}
+            )
+            m.post(f"{WM_URL}/__admin/mappings/import")
+            ids = snapshot_mappings(path=path, configuration=WM_CONFIG)
+            self.assertEqual(len(ids), 5)
+
+            restored = restore_mappings(path=path, configuration=WM_CONFIG)
+            self.assertEqual(restored, ids)
+            imports = [
+                r for r in m.request_history if r.path.endswith("/import")
+            ]
+            self.assertEqual(len(imports), 1)
+            self.assertEqual(imports[0].json()["mappings"], self.mappings)
+
+    def test_tagged_mappings(self):
+        config = {"wiremock": {"url": WM_URL, "tag": "exp-1"}}
+        with requests_mock.Mocker() as m:
+            m.post(f"{WM_URL}/__admin/mappings/import")
+            m.post(
+                f"{WM_URL}/__admin/mappings/find-by-metadata",
+                json={"mappings": self.mappings[:1]},
+            )
+            m.post(f"{WM_URL}/__admin/mappings/remove-by-metadata")
+            add_mappings(self.mappings[:1], configuration=config)
+            imported = m.last_request.json()["mappings"][0]
+            self.assertEqual(
+                imported["metadata"],
+                {"chaoswm": {"tag": "exp-1", "action": "populate"}},
+            )
+            # the mappings passed are left as they were
+            self.assertNotIn("metadata", self.mappings[0])
+
+            self.assertEqual(
+                tagged_mappings(configuration=config), self.mappings[:1]
+            )
+            self.assertEqual(
+                m.last_request.json(),
+                {"matchesJsonPath": "$.chaoswm[?(@.tag == 'exp-1')]"},
+            )
+            self.assertTrue(
+                delete_tagged_mappings(action="populate", configuration=config)
+            )
+            self.assertEqual(
+                m.last_request.json(),
+                {
+                    "matchesJsonPath": "$.chaoswm[?(@.tag == 'exp-1' "
+                    "&& @.action == 'populate')]"
+                },
+            )
+
+            tagged_mappings(modified=True, configuration=config)
+            self.assertEqual(
+                m.last_request.json(),
+                {"matchesJsonPath": "$.chaoswm.modified[?(@.tag == 'exp-1')]"},
+            )
+
+            # without a tag, the pattern would match every stamped mapping
+            calls = m.call_count
+            self.assertFalse(
+                delete_tagged_mappings(
+                    action="populate", configuration=WM_CONFIG
+                )
+            )
+            self.assertEqual(m.call_count, calls)
+
+
+class TestProbesMocked(unittest.TestCase):
+    def test_count_requests(self):
+        pattern = {"method": "GET", "urlPath": "/epg"}
+        with requests_mock.Mocker() as m:
+            m.post(f"{WM_URL}/__admin/requests/count", json={"count": 42})
+            self.assertEqual(count_requests(pattern, WM_CONFIG), 42)
+            self.assertEqual(m.last_request.json(), pattern)
+
+    def test_count_requests_batch(self):
+        def count(request, context):
+            return {"count": len(request.json()["url"])}
+
+        patterns = [{"url": "/a"}, {"url": "/abc"}, {"url": "/ab"}]
+        with requests_mock.Mocker() as m:
+            m.post(f"{WM_URL}/__admin/requests/count", json=count)
+            self.assertEqual(
+                count_requests_batch(patterns, WM_CONFIG), [2, 4, 3]
+            )
+            self.assertEqual(m.call_count, 3)
+
+    def test_find_requests(self):
+        found = [{"id": "r1", "request": {"url": "/a"}}]
+        with requests_mock.Mocker() as m:
+            m.post(f"{WM_URL}/__admin/requests/find", json={"requests": found})
+            self.assertEqual(find_requests({"url": "/a"}, WM_CONFIG), found)
@@ -0,0 +1,35 @@
+import unittest
+
+import requests_mock
+
+from chaoswm.client import close_clients, wiremock_client
+from chaoswm.control import after_experiment_control
+
+WM_URL = "http://wiremock.local:8080"
+
+
+class TestClientRegistry(unittest.TestCase):
+    def tearDown(self):
+        close_clients()
+
+    def test_same_settings_share_a_driver(self):
+        config = {"wiremock": {"url": WM_URL, "timeout": 5}}
+        w = wiremock_client(config)
+        self.assertIs(wiremock_client(dict(config)), w)
+        self.assertIsNot(
+            wiremock_client({"wiremock": {"url": WM_URL, "timeout": 2}}), w
+        )
+
+    def test_driver_reused_across_activities(self):
+        config = {"wiremock": {"url": WM_URL}}
+        with requests_mock.Mocker() as m:
+            m.post(f"{WM_URL}/__admin/reset")
+            wiremock_client(config).reset()
+            wiremock_client(config).reset()
+            self.assertEqual(m.call_count, 2)
+
+    def test_teardown_control(self):
+        config = {"wiremock": {"url": WM_URL}}
+        w = wiremock_client(config)
+        after_experiment_control({}, {}, configuration=config)
+        self.assertIsNot(wiremock_client(config), w)
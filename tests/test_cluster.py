@@ -0,0 +1,100 @@
+import unittest
+
+import requests_mock
+
+from chaoswm.actions import global_fixed_delay, update_mappings_fault
+from chaoswm.client import close_clients
+from chaoswm.probes import count_requests
+from chaoswm.utils import get_wm_nodes_params
+
+NODES = ["http://wm1.local:8080", "http://wm2.local:8080"]
+
+MAPPINGS = [
+    {
+        "id": "1",
+        "request": {"method": "GET", "url": "/thing"},
+        "response": {"status": 200},
+    }
+]
+
+
+class TestCluster(unittest.TestCase):
+    def tearDown(self):
+        close_clients()
+
+    def test_nodes_params(self):
+        params = get_wm_nodes_params(
+            {
+                "wiremock": {
+                    "url": "http://ignored",
+                    "timeout": 5,
+                    "nodes": [
+                        NODES[0],
+                        {"host": "wm2.local", "port": 8080, "timeout": 2},
+                    ],
+                }
+            }
+        )
+        self.assertEqual([p["url"] for p in params], NODES)
+        self.assertEqual([p["timeout"] for p in params], [5, 2])
+
+    def test_fan_out(self):
+        config = {"wiremock": {"nodes": NODES}}
+        with requests_mock.Mocker() as m:
+            for node in NODES:
+                m.post(f"{node}/__admin/settings")
+            self.assertEqual(
+                global_fixed_delay(100, configuration=config),
+                {NODES[0]: 1, NODES[1]: 1},
+            )
+            self.assertEqual(m.call_count, 2)
+
+    def test_rollback_on_failure(self):
+        config = {"wiremock": {"nodes": NODES, "consistency": "all"}}
+        with requests_mock.Mocker() as m:
+            for i, node in enumerate(NODES):
+                m.get(f"{node}/__admin/settings", json={"settings": {}})
+                m.post(f"{node}/__admin/settings")
+                m.get(f"{node}/__admin/mappings", json={"mappings": MAPPINGS})
+                m.put(
+                    f"{node}/__admin/mappings/1",
+                    status_code=500 if i == 1 else 200,
+                    json=MAPPINGS[0],
+                )
+                m.post(f"{node}/__admin/mappings/import")
+
+            results = update_mappings_fault(
+                filter=[{"method": "GET", "url": "/thing"}],
+                fault="EMPTY_RESPONSE",
+                configuration=config,
+            )
+            self.assertEqual(results, {NODES[0]: ["1"], NODES[1]: []})
+
+            imports = [
+                r for r in m.request_history if r.path.endswith("/import")
+            ]
+            self.assertEqual(
+                sorted(r.netloc for r in imports),
+                ["wm1.local:8080", "wm2.local:8080"],
+            )
+            for request in imports:
+                body = request.json()
+                self.assertEqual(body["mappings"], MAPPINGS)
+                self.assertTrue(body["importOptions"]["deleteAllNotInImport"])
+
+    def test_probes_do_not_roll_back(self):
+        config = {"wiremock": {"nodes": NODES, "consistency": "all"}}
+        with requests_mock.Mocker() as m:
+            for i, node in enumerate(NODES):
+                m.post(
+                    f"{node}/__admin/requests/count",
+                    status_code=500 if i == 1 else 200,
+                    json={"count": 3},
+                )
+
+            results = count_requests({"url": "/thing"}, configuration=config)
+            self.assertEqual(results, {NODES[0]: 3, NODES[1]: -1})
+            self.assertEqual(
+                [r.path for r in m.request_history],
+                ["/__admin/requests/count"] * 2,
+            )
@@ -0,0 +1,32 @@
+import unittest
+from unittest import mock
+
+import requests_mock
+
+from chaoswm import codec
+from chaoswm.driver import Wiremock
+
+WM_URL = "http://wiremock.local:8080"
+
+PAYLOAD = {"mappings": [{"id": "1", "request": {"url": "/é"}}]}
+
+
+class TestCodec(unittest.TestCase):
+    def test_roundtrip(self):
+        for has_orjson in {False, codec.HAS_ORJSON}:
+            with mock.patch.object(codec, "HAS_ORJSON", has_orjson):
+                data = codec.dumps(PAYLOAD)
+                self.assertIsInstance(data, bytes)
+                self.assertEqual(codec.loads(data), PAYLOAD)
+                self.assertEqual(codec.loads(data.decode()), PAYLOAD)
+
+    def test_driver_sends_bytes(self):
+        with requests_mock.Mocker() as m:
+            m.get(f"{WM_URL}/__admin/mappings", json=PAYLOAD)
+            m.post(f"{WM_URL}/__admin/settings")
+            w = Wiremock(url=WM_URL)
+            self.assertEqual(w.mappings(), PAYLOAD["mappings"])
+            w.global_fixed_delay(10)
+            body = m.request_history[-1].body
+            self.assertIsInstance(body, bytes)
+            self.assertEqual(codec.loads(body), {"fixedDelay": 10})
@@ -1,8 +1,14 @@
 import unittest
 from typing import List
-from chaoswm.driver import Wiremock
+
+import requests_mock
+
+from chaoswm.driver import MappingRef, Wiremock
+from chaoswm.mappings import overlay_id
 from chaoswm.utils import can_connect_to
 
+WM_URL = "http://wiremock.local:8080"
+
 
 @unittest.skipUnless(
     can_connect_to("localhost", 8080), "Wiremock server not found"
@@ -390,3 +396,437 @@ class TestWiremock(unittest.TestCase):
     def test_reset(self):
         w = Wiremock(host="localhost", port=8080)
         self.assertEqual(w.reset(), 1)
+
+
+class TestWiremockSession(unittest.TestCase):
+    def test_admin_calls_go_through_pooled_session(self):
+        with requests_mock.Mocker() as m:
+            m.get(f"{WM_URL}/__admin/mappings", json={"mappings": []})
+            m.post(f"{WM_URL}/__admin/reset")
+            with Wiremock(url=WM_URL, pool_size=4) as w:
+                adapter = w.session.get_adapter(WM_URL)
+                self.assertEqual(adapter._pool_maxsize, 4)
+                self.assertEqual(w.mappings(), [])
+                self.assertEqual(w.reset(), 1)
+            self.assertEqual(m.call_count, 2)
+            for request in m.request_history:
+                self.assertEqual(
+                    request.headers["Content-Type"], "application/json"
+                )
+
+    def test_keep_alive_disabled(self):
+        with requests_mock.Mocker() as m:
+            m.post(f"{WM_URL}/__admin/reset")
+            with Wiremock(url=WM_URL, keep_alive=False) as w:
+                w.reset()
+            self.assertEqual(m.last_request.headers["Connection"], "close")
+
+
+class TestWiremockImport(unittest.TestCase):
+    def test_import_mappings_in_chunks(self):
+        mappings = [
+            {
+                "request": {"method": "GET", "url": f"/thing/{i}"},
+                "response": {"status": 200},
+            }
+            for i in range(5)
+        ]
+        mappings[2]["id"] = "given-id"
+        with requests_mock.Mocker() as m:
+            m.post(f"{WM_URL}/__admin/mappings/import")
+            with Wiremock(url=WM_URL, import_chunk_size=2) as w:
+                ids = w.populate(mappings, bulk=True)
+
+            self.assertEqual(m.call_count, 3)
+            sent = [
+                mapping
+                for request in m.request_history
+                for mapping in request.json()["mappings"]
+            ]
+            self.assertEqual(ids, [mapping["id"] for mapping in sent])
+            self.assertEqual(ids[2], "given-id")
+            self.assertEqual(
+                m.last_request.json()["importOptions"]["duplicatePolicy"],
+                "OVERWRITE",
+            )
+        self.assertNotIn("id", mappings[0])
+
+    def test_import_mappings_error(self):
+        with requests_mock.Mocker() as m:
+            m.post(f"{WM_URL}/__admin/mappings/import", status_code=422)
+            with Wiremock(url=WM_URL) as w:
+                self.assertIsNone(w.import_mappings([{"request": {}}]))
+                self.assertIsNone(
+                    w.import_mappings([], duplicate_policy="REPLACE")
+                )
+
+
+class TestWiremockDelete(unittest.TestCase):
+    mappings = [
+        {"id": "a", "request": {"method": "GET", "url": "/a"}},
+        {"id": "b", "request": {"method": "GET", "url": "/b"}},
+        {"id": "c", "request": {"method": "POST", "url": "/c"}},
+    ]
+
+    def test_delete_all_mappings_single_delete(self):
+        with requests_mock.Mocker() as m:
+            m.get(
+                f"{WM_URL}/__admin/mappings", json={"mappings": self.mappings}
+            )
+            m.delete(f"{WM_URL}/__admin/mappings")
+            with Wiremock(url=WM_URL) as w:
+                self.assertEqual(w.delete_all_mappings(), [])
+                self.assertEqual(m.call_count, 1)
+                self.assertEqual(m.last_request.method, "DELETE")
+
+                # the ids are known when the mappings are cached
+                with w.snapshot():
+                    w.mappings()
+                    self.assertEqual(w.delete_all_mappings(), ["a", "b", "c"])
+            self.assertEqual(m.call_count, 3)
+
+    def test_delete_mappings_by_id(self):
+        with requests_mock.Mocker() as m:
+            m.post(f"{WM_URL}/__admin/mappings/import")
+            m.post(f"{WM_URL}/__admin/mappings/remove-by-metadata")
+            m.delete(f"{WM_URL}/__admin/mappings")
+            with Wiremock(url=WM_URL, import_chunk_size=1) as w:
+                deleted = w.delete_mappings(
+                    ["a", "c", "a", "x"], self.mappings
+                )
+                self.assertEqual(deleted, ["a", "c"])
+                self.assertEqual(
+                    [r.path for r in m.request_history],
+                    ["/__admin/mappings/import"] * 2
+                    + ["/__admin/mappings/remove-by-metadata"],
+                )
+                marked = [
+                    r.json()["mappings"][0] for r in m.request_history[:2]
+                ]
+                self.assertEqual([i["id"] for i in marked], ["a", "c"])
+                token = marked[0]["metadata"]["chaoswm"]["delete"]
+                self.assertEqual(
+                    marked[1]["metadata"]["chaoswm"]["delete"], token
+                )
+                self.assertEqual(
+                    m.last_request.json(),
+                    {
+                        "matchesJsonPath": "$.chaoswm[?(@.delete == "
+                        f"'{token}')]"
+                    },
+                )
+                # the mappings passed are left as they were
+                self.assertNotIn("metadata", self.mappings[0])
+
+                # every mapping matched: the others' new ones stay
+                m.reset_mock()
+                w.delete_mappings(["a", "b", "c"], self.mappings)
+                self.assertNotIn(
+                    "DELETE", [r.method for r in m.request_history]
+                )
+
+    def test_delete_mappings_import_error(self):
+        with requests_mock.Mocker() as m:
+            m.post(f"{WM_URL}/__admin/mappings/import", status_code=500)
+            with Wiremock(url=WM_URL) as w:
+                self.assertIsNone(w.delete_mappings(["a"], self.mappings))
+            self.assertEqual(m.call_count, 1)
+
+
+class TestWiremockUpdateMappings(unittest.TestCase):
+    def test_update_fault_concurrently(self):
+        mappings = [
+            {"id": str(i), "request": {"url": f"/{i}"}, "response": {}}
+            for i in range(20)
+        ]
+        with requests_mock.Mocker() as m:
+            for i in range(20):
+                m.put(
+                    f"{WM_URL}/__admin/mappings/{i}",
+                    status_code=500 if i in (3, 7) else 200,
+                    json={"id": str(i)},
+                )
+            with Wiremock(url=WM_URL, max_workers=4) as w:
+                ids = w.update_fault(mappings, "EMPTY_RESPONSE")
+                self.assertEqual(
+                    ids, [str(i) for i in range(20) if i not in (3, 7)]
+                )
+                self.assertEqual(sorted(ids.errors), ["3", "7"])
+            self.assertEqual(m.call_count, 20)
+            self.assertEqual(
+                m.last_request.json()["response"]["fault"], "EMPTY_RESPONSE"
+            )
+
+    def test_unchanged_mappings_not_written(self):
+        mappings = [
+            {
+                "id": str(i),
+                "request": {"url": f"/{i}"},
+                "response": {"fixedDelayMilliseconds": 100 * i},
+            }
+            for i in range(3)
+        ]
+        with requests_mock.Mocker() as m:
+            for i in range(3):
+                m.put(f"{WM_URL}/__admin/mappings/{i}", json={"id": str(i)})
+            with Wiremock(url=WM_URL) as w:
+                ids = w.fixed_delay(mappings, 100)
+                self.assertEqual(ids, ["0", "1", "2"])
+                self.assertEqual(ids.written, ["0", "2"])
+                self.assertEqual(ids.skipped, ["1"])
+
+                again = w.fixed_delay(mappings, 100)
+                self.assertEqual(again, ids)
+                self.assertEqual(again.written, [])
+            self.assertEqual(m.call_count, 2)
+
+
+class TestWiremockOverlays(unittest.TestCase):
+    mappings = [
+        {
+            "id": "a",
+            "request": {"method": "GET", "url": "/a"},
+            "response": {"status": 200},
+        }
+    ]
+
+    def test_overlays_leave_mappings_untouched(self):
+        with requests_mock.Mocker() as m:
+            m.get(
+                f"{WM_URL}/__admin/mappings", json={"mappings": self.mappings}
+            )
+            m.post(f"{WM_URL}/__admin/mappings/import")
+            m.post(f"{WM_URL}/__admin/mappings/remove-by-metadata")
+            with Wiremock(url=WM_URL, injection="overlay", tag="t") as w:
+                self.assertEqual(
+                    w.update_fault(self.mappings, "EMPTY_RESPONSE"), ["a"]
+                )
+                with w.snapshot():
+                    overlay = w.random_delay(
+                        {"method": "GET", "url": "/a"},
+                        {"type": "uniform", "lower": 1, "upper": 2},
+                    )
+                    self.assertEqual(overlay["id"], overlay_id("a"))
+                self.assertEqual(self.mappings[0]["response"], {"status": 200})
+
+                imported = [
+                    r.json()["mappings"][0]
+                    for r in m.request_history
+                    if r.path.endswith("/import")
+                ]
+                self.assertEqual(len(imported), 2)
+                # the second injection adds up with the first one
+                self.assertEqual(imported[1]["priority"], 4)
+                self.assertEqual(
+                    imported[1]["metadata"],
+                    {
+                        "chaoswm": {
+                            "overlay": "a",
+                            "tag": "t",
+                            "action": "random_delay",
+                        }
+                    },
+                )
+                self.assertEqual(
+                    imported[1]["response"]["fault"], "EMPTY_RESPONSE"
+                )
+                self.assertIn("delayDistribution", imported[1]["response"])
+                self.assertFalse(
+                    any(r.method == "PUT" for r in m.request_history)
+                )
+
+                self.assertEqual(w.up([{"method": "GET", "url": "/a"}]), ["a"])
+                self.assertEqual(
+                    m.last_request.json(),
+                    {
+                        "matchesJsonPath": {
+                            "expression": "$.chaoswm.overlay",
+                            "matches": "^(a)$",
+                        }
+                    },
+                )
+                self.assertEqual(w.remove_overlays(), [])
+
+
+class TestWiremockPaging(unittest.TestCase):
+    mappings = [
+        {"id": str(i), "request": {"method": "GET", "url": f"/{i % 4}"}}
+        for i in range(10)
+    ]
+
+    def page(self, request, context):
+        offset = int(request.qs["offset"][0])
+        limit = int(request.qs["limit"][0])
+        return {
+            "mappings": self.mappings[offset : offset + limit],
+            "meta": {"total": len(self.mappings)},
+        }
+
+    def test_iter_mappings(self):
+        with requests_mock.Mocker() as m:
+            m.get(f"{WM_URL}/__admin/mappings", json=self.page)
+            with Wiremock(url=WM_URL, page_size=3) as w:
+                self.assertEqual(list(w.iter_mappings()), self.mappings)
+                self.assertEqual(m.call_count, 4)
+
+    def test_filter_stops_at_limit(self):
+        with requests_mock.Mocker() as m:
+            m.get(f"{WM_URL}/__admin/mappings", json=self.page)
+            with Wiremock(url=WM_URL, page_size=3) as w:
+                found = w.filter_mapping({"method": "GET", "url": "/1"})
+                self.assertEqual(found["id"], "1")
+                self.assertEqual(m.call_count, 1)
+
+                found = w.filter_mappings(
+                    {"method": "GET", "url": "/1"}, limit=2
+                )
+                self.assertEqual([f["id"] for f in found], ["1", "5"])
+                self.assertEqual(m.call_count, 3)
+                self.assertEqual(m.last_request.qs["offset"], ["3"])
+
+
+class TestMappingRef(unittest.TestCase):
+    mapping = {
+        "id": "a",
+        "priority": 3,
+        "request": {"method": "GET", "url": "/a"},
+        "response": {"status": 200, "body": "x" * 100},
+    }
+
+    def test_encoded_payload(self):
+        ref = MappingRef.of(self.mapping)
+        self.assertFalse(hasattr(ref, "__dict__"))
+        self.assertEqual(ref.priority, 3)
+        payload = ref.payload
+        self.assertEqual(payload, self.mapping)
+        payload["response"]["status"] = 500
+        self.assertEqual(ref.payload, self.mapping)
+        self.assertEqual(ref, MappingRef.of(dict(self.mapping)))
+        self.assertNotEqual(ref, MappingRef.of(dict(self.mapping, priority=1)))
+        self.assertEqual(
+            ref, MappingRef(mapping_id="a", key=None, content_hash=ref.hash)
+        )
+
+    def test_lazy_payload(self):
+        with requests_mock.Mocker() as m:
+            m.get(
+                f"{WM_URL}/__admin/mappings",
+                json={"mappings": [self.mapping], "meta": {"total": 1}},
+            )
+            m.get(f"{WM_URL}/__admin/mappings/a", json=self.mapping)
+            with Wiremock(url=WM_URL) as w:
+                refs = w.mapping_refs()
+                self.assertEqual([ref.id for ref in refs], ["a"])
+                self.assertEqual(m.call_count, 1)
+                self.assertEqual(refs[0].payload, self.mapping)
+                self.assertEqual(refs[0].payload, self.mapping)
+                self.assertEqual(m.call_count, 2)
+
+
+class TestWiremockSnapshot(unittest.TestCase):
+    mappings = [{"id": "a", "request": {"method": "GET", "url": "/a"}}]
+
+    def test_snapshot_block(self):
+        with requests_mock.Mocker() as m:
+            m.get(
+                f"{WM_URL}/__admin/mappings", json={"mappings": self.mappings}
+            )
+            m.delete(f"{WM_URL}/__admin/mappings/a")
+            m.delete(f"{WM_URL}/__admin/mappings")
+            with Wiremock(url=WM_URL) as w:
+                with w.snapshot():
+                    w.filter_mappings({"url": "/a"})
+                    w.filter_mappings({"url": "/b"})
+                    self.assertEqual(m.call_count, 1)
+                    # single mapping writes are applied to the snapshot
+                    w.delete_mapping("a")
+                    self.assertEqual(w.mappings(), [])
+                    self.assertEqual(m.call_count, 2)
+                    # bulk writes invalidate it
+                    w.clear_mappings()
+                    w.mappings()
+                    self.assertEqual(m.call_count, 4)
+                w.mappings()
+                w.mappings()
+            self.assertEqual(m.call_count, 6)
+
+    def test_request_index(self):
+        mappings = [
+            {
+                "id": str(i),
+                "request": {"method": "GET", "url": f"/{i}"},
+                "response": {"status": 200, "fixedDelayMilliseconds": 10},
+            }
+            for i in range(50)
+        ]
+        with requests_mock.Mocker() as m:
+            m.get(f"{WM_URL}/__admin/mappings", json={"mappings": mappings})
+            m.put(
+                requests_mock.ANY,
+                json=lambda request, context: request.json(),
+            )
+            with Wiremock(url=WM_URL) as w:
+                ids = w.up(
+                    [
+                        {"method": "GET", "url": "/3"},
+                        {"url": "/7", "method": "GET"},
+                        {"method": "GET", "url": "/404"},
+                    ]
+                )
+            self.assertEqual(ids, ["3", "7"])
+            self.assertEqual(
+                [r.method for r in m.request_history], ["GET", "PUT", "PUT"]
+            )
+            self.assertNotIn(
+                "fixedDelayMilliseconds", m.last_request.json()["response"]
+            )
+
+    def test_up_forgets_the_change(self):
+        mappings = [
+            {
+                "id": "1",
+                "request": {"method": "GET", "url": "/1"},
+                "response": {"status": 200},
+            }
+        ]
+        with requests_mock.Mocker() as m:
+            m.get(f"{WM_URL}/__admin/mappings", json={"mappings": mappings})
+            m.put(
+                requests_mock.ANY,
+                json=lambda request, context: request.json(),
+            )
+            with Wiremock(url=WM_URL, tag="exp-1") as w:
+                w.fixed_delay(mappings, 100)
+                self.assertEqual(
+                    m.last_request.json()["metadata"],
+                    {
+                        "chaoswm": {
+                            "modified": {
+                                "tag": "exp-1",
+                                "action": "fixed_delay",
+                            }
+                        }
+                    },
+                )
+                w.up([{"method": "GET", "url": "/1"}])
+            self.assertEqual(
+                m.last_request.json(),
+                {
+                    "id": "1",
+                    "request": {"method": "GET", "url": "/1"},
+                    "response": {"status": 200},
+                },
+            )
+
+    def test_snapshot_ttl(self):
+        with requests_mock.Mocker() as m:
+            m.get(
+                f"{WM_URL}/__admin/mappings", json={"mappings": self.mappings}
+            )
+            with Wiremock(url=WM_URL, snapshot_ttl=60) as w:
+                w.mappings()
+                w.mappings()
+                self.assertEqual(m.call_count, 1)
+                w.invalidate_snapshot()
+                w.mappings()
+            self.assertEqual(m.call_count, 2)
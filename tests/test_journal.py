@@ -0,0 +1,316 @@
+import unittest
+from unittest import mock
+
+import requests_mock
+
+from chaoswm import journal
+from chaoswm.actions import (
+    remove_journal_requests,
+    start_journal_maintenance,
+    stop_journal_maintenance,
+    trim_journal,
+)
+from chaoswm.client import close_clients, wiremock_client
+from chaoswm.probes import (
+    journal_error_ratio,
+    journal_stats,
+    latency_percentiles,
+)
+
+WM_URL = "http://wiremock.local:8080"
+STUB_ID = "1ad0ffd6-8f4c-4ee3-a6e5-0b0f7a26b7a5"
+
+
+def event(total, url="/epg", stub=STUB_ID, status=200, fault=None):
+    response_definition = {"status": status}
+    if fault:
+        response_definition["fault"] = fault
+    return {
+        "request": {"url": url, "method": "GET"},
+        "response": {"status": status},
+        "responseDefinition": response_definition,
+        "stubMapping": {"id": stub} if stub else None,
+        "timing": {"totalTime": total, "serveTime": total - 1},
+    }
+
+
+EVENTS = [event(t) for t in range(1, 101)] + [
+    event(5, url="/missing", stub=None, status=404),
+    event(7, url="/epg?x=1", status=500, fault="EMPTY_RESPONSE"),
+]
+
+
+class TestLatencyStats(unittest.TestCase):
+    def check_stats(self, stats):
+        self.assertEqual(stats["total"], 102)
+        self.assertEqual(set(stats["groups"]), {STUB_ID, journal.UNMATCHED})
+        group = stats["groups"][STUB_ID]
+        self.assertEqual(group["count"], 101)
+        self.assertEqual(group["status"], {"200": 100, "500": 1})
+        self.assertEqual(group["faults"], {"EMPTY_RESPONSE": 1})
+        self.assertEqual(group["totalTime"]["max"], 100.0)
+        self.assertAlmostEqual(group["totalTime"]["p50"], 50.0)
+        self.assertAlmostEqual(group["totalTime"]["p90"], 90.0)
+        self.assertAlmostEqual(group["serveTime"]["p99"], 98.0)
+        self.assertEqual(
+            group["addedDelay"],
+            {"p50": None, "p90": None, "p99": None, "max": None},
+        )
+        self.assertEqual(
+            stats["groups"][journal.UNMATCHED]["status"], {"404": 1}
+        )
+
+    @unittest.skipUnless(journal.HAS_NUMPY, "numpy not installed")
+    def test_numpy(self):
+        self.check_stats(journal.latency_stats(EVENTS))
+
+    def test_lists(self):
+        with mock.patch.object(journal, "HAS_NUMPY", False):
+            self.check_stats(journal.latency_stats(EVENTS))
+
+    @unittest.skipUnless(journal.HAS_NUMPY, "numpy not installed")
+    def test_same_results(self):
+        numpy_stats = journal.latency_stats(EVENTS, "url")
+        with mock.patch.object(journal, "HAS_NUMPY", False):
+            list_stats = journal.latency_stats(EVENTS, "url")
+        self.assertEqual(list_stats.keys(), numpy_stats.keys())
+        for key, group in numpy_stats["groups"].items():
+            other = list_stats["groups"][key]
+            self.assertEqual(other["status"], group["status"])
+            for field in journal.TIMING_FIELDS:
+                for name, value in group[field].items():
+                    if value is None:
+                        self.assertIsNone(other[field][name])
+                    else:
+                        self.assertAlmostEqual(other[field][name], value)
+
+    def test_by_url(self):
+        stats = journal.latency_stats(EVENTS, "url")
+        self.assertEqual(
+            set(stats["groups"]), {"/epg", "/missing", "/epg?x=1"}
+        )
+
+    def test_empty(self):
+        self.assertEqual(journal.latency_stats([]), {"total": 0, "groups": {}})
+
+
+class TestLatencyProbe(unittest.TestCase):
+    def tearDown(self):
+        close_clients()
+
+    def test_latency_percentiles(self):
+        config = {"wiremock": {"url": WM_URL}}
+        with requests_mock.Mocker() as m:
+            m.get(f"{WM_URL}/__admin/requests", json={"requests": EVENTS})
+            stats = latency_percentiles(limit=500, configuration=config)
+            self.assertEqual(m.last_request.qs, {"limit": ["500"]})
+        self.assertEqual(stats["total"], 102)
+        self.assertEqual(stats["groups"][STUB_ID]["count"], 101)
+
+    def test_journal_error(self):
+        config = {"wiremock": {"url": WM_URL}}
+        with requests_mock.Mocker() as m:
+            m.get(f"{WM_URL}/__admin/requests", status_code=500)
+            self.assertIsNone(latency_percentiles(configuration=config))
+
+    def test_unknown_group_by(self):
+        config = {"wiremock": {"url": WM_URL}}
+        self.assertEqual(
+            latency_percentiles(group_by="method", configuration=config), {}
+        )
+
+
+def logged(event_id, date, status=200, total=10):
+    return {
+        "id": event_id,
+        "request": {"url": "/epg", "loggedDate": date},
+        "response": {"status": status},
+        "timing": {"totalTime": total},
+    }
+
+
+class TestJournalTailer(unittest.TestCase):
+    def tearDown(self):
+        close_clients()
+
+    def test_cursor(self):
+        cursor = journal.JournalCursor()
+        self.assertIsNone(cursor.since())
+        new = cursor.advance([logged("b", 1500000000002), logged("a", 1)])
+        self.assertEqual([e["id"] for e in new], ["a", "b"])
+        self.assertEqual(cursor.since(), "2017-07-14T02:40:00.001Z")
+        # wiremock sends the events of the last millisecond again
+        new = cursor.advance(
+            [logged("c", 1500000000002), logged("b", 1500000000002)]
+        )
+        self.assertEqual([e["id"] for e in new], ["c"])
+
+    def test_rolling_stats(self):
+        stats = journal.RollingStats()
+        for i in range(99):
+            stats.add(logged(str(i), i, total=3))
+        stats.add(logged("slow", 100, status=503, total=700))
+        res = stats.as_dict()
+        self.assertEqual(res["count"], 100)
+        self.assertEqual(res["error_ratio"], 0.01)
+        self.assertEqual(res["status"], {"200": 99, "503": 1})
+        self.assertEqual(res["totalTime"]["p50"], 4.0)
+        self.assertEqual(res["totalTime"]["max"], 700)
+        self.assertEqual(
+            res["latency_histogram"], {"le_4ms": 99, "le_1024ms": 1}
+        )
+
+    def test_journal_stats(self):
+        config = {"wiremock": {"url": WM_URL}}
+        url = f"{WM_URL}/__admin/requests"
+        with requests_mock.Mocker() as m:
+            m.get(
+                url,
+                [
+                    {"json": {"requests": [logged("a", 1000)]}},
+                    {
+                        "json": {
+                            "requests": [
+                                logged("c", 3000, status=500),
+                                logged("b", 2000),
+                            ]
+                        }
+                    },
+                    {"json": {"requests": []}},
+                ],
+            )
+            # the first call only places the cursor on the last request
+            self.assertEqual(journal_stats(configuration=config)["new"], 0)
+            self.assertEqual(m.last_request.qs, {"limit": ["1"]})
+
+            stats = journal_stats(configuration=config)
+            self.assertEqual(
+                m.last_request.qs, {"since": ["1970-01-01t00:00:00.999z"]}
+            )
+            self.assertEqual(stats["new"], 2)
+            self.assertEqual(stats["count"], 2)
+            self.assertEqual(stats["error_ratio"], 0.5)
+
+            self.assertEqual(journal_error_ratio(configuration=config), 0.5)
+            self.assertEqual(
+                m.last_request.qs, {"since": ["1970-01-01t00:00:02.999z"]}
+            )
+
+
+class TestJournalTrimming(unittest.TestCase):
+    config = {"wiremock": {"url": WM_URL}}
+    url = f"{WM_URL}/__admin/requests"
+
+    def tearDown(self):
+        journal.stop_all_maintenance()
+        close_clients()
+
+    def test_events_to_trim(self):
+        events = [logged(str(i), 1000 * (10 - i)) for i in range(10)]
+        self.assertEqual(
+            journal.events_to_trim(events, max_size=7), ["7", "8", "9"]
+        )
+        self.assertEqual(
+            journal.events_to_trim(events, max_age=4.5, max_size=8, now=10),
+            ["5", "6", "7", "8", "9"],
+        )
+
+    def test_trim_journal(self):
+        events = [logged(str(i), 1000 * (10 - i)) for i in range(4)]
+
+        def requests(request, context):
+            # all the events were logged in 1970, before any since date
+            listed = [] if "since" in request.qs else events
+            if "limit" in request.qs:
+                listed = listed[: int(request.qs["limit"][0])]
+            return {"requests": listed, "meta": {"total": len(events)}}
+
+        with requests_mock.Mocker() as m:
+            m.get(self.url, json=requests)
+            m.delete(requests_mock.ANY)
+            self.assertEqual(
+                trim_journal(max_size=2, configuration=self.config), 2
+            )
+            self.assertEqual(
+                sorted(r.path for r in m.request_history[2:]),
+                ["/__admin/requests/2", "/__admin/requests/3"],
+            )
+
+            m.reset_mock()
+            self.assertEqual(
+                trim_journal(max_age=1, configuration=self.config), 4
+            )
+            # all the requests are old: a single delete, no download
+            self.assertEqual(
+                [(r.method, r.path) for r in m.request_history[1:]],
+                [
+                    ("GET", "/__admin/requests"),
+                    ("DELETE", "/__admin/requests"),
+                ],
+            )
+            self.assertEqual(m.request_history[1].qs["limit"], ["4"])
+
+            m.reset_mock()
+            self.assertEqual(
+                trim_journal(max_size=10, configuration=self.config), 0
+            )
+            self.assertEqual(m.call_count, 1)
+
+            # a bounded pass downloads the requests kept and max_deletes
+            m.reset_mock()
+            self.assertEqual(
+                trim_journal(
+                    max_size=1, max_deletes=2, configuration=self.config
+                ),
+                2,
+            )
+            self.assertEqual(m.request_history[1].qs["limit"], ["3"])
+            self.assertEqual(
+                sorted(r.path for r in m.request_history[2:]),
+                ["/__admin/requests/1", "/__admin/requests/2"],
+            )
+
+    def test_remove_journal_requests(self):
+        with requests_mock.Mocker() as m:
+            m.post(
+                f"{self.url}/remove",
+                json={"serveEvents": [logged("a", 1), logged("b", 2)]},
+            )
+            self.assertEqual(
+                remove_journal_requests(
+                    {"method": "GET", "urlPath": "/epg"},
+                    configuration=self.config,
+                ),
+                2,
+            )
+            self.assertEqual(
+                m.last_request.json(), {"method": "GET", "urlPath": "/epg"}
+            )
+
+    def test_maintenance(self):
+        events = [logged(str(i), 1000 * (10 - i)) for i in range(4)]
+        with requests_mock.Mocker() as m:
+            m.get(
+                self.url,
+                [
+                    {"json": {"requests": events[:1], "meta": {"total": 4}}},
+                    {"json": {"requests": events}},
+                    {"json": {"requests": events[:1], "meta": {"total": 3}}},
+                ],
+            )
+            m.delete(requests_mock.ANY)
+            self.assertTrue(
+                start_journal_maintenance(
+                    max_size=3, interval=60, configuration=self.config
+                )
+            )
+            w = wiremock_client(self.config)
+            loop = journal._maintenance[w.base_url]
+            self.assertEqual(loop.run_once(), 1)
+            self.assertEqual(loop.run_once(), 0)
+            self.assertEqual(
+                stop_journal_maintenance(configuration=self.config), 1
+            )
+            self.assertEqual(
+                stop_journal_maintenance(configuration=self.config), -1
+            )
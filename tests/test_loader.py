@@ -0,0 +1,178 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import requests_mock
+
+from chaoswm import loader
+from chaoswm.driver import Wiremock
+from chaoswm.loader import iter_dir_mappings, iter_file_mappings
+
+WM_URL = "http://wiremock.local:8080"
+
+
+def stub(i):
+    return {
+        "request": {"method": "GET", "url": f"/stub/{i}"},
+        "response": {"status": 200, "body": "x" * 100},
+    }
+
+
+class TestLoader(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        self.write("a.json", stub(0))
+        self.write(
+            "b/bundle.json",
+            {"meta": {"total": 3}, "mappings": [stub(1), stub(2), stub(3)]},
+        )
+        self.write("b/c/array.json", [stub(4), stub(5)])
+        self.write("b/c/notes.txt", "not json")
+        self.write("__files/body.json", {"some": "body"})
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, name, content):
+        path = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as file:
+            if isinstance(content, str):
+                file.write(content)
+            else:
+                json.dump(content, file, indent=2)
+        return path
+
+    def urls(self, **kwargs):
+        return [
+            mapping["request"]["url"]
+            for _, mapping in iter_dir_mappings(self.root, **kwargs)
+        ]
+
+    def test_recursive_walk(self):
+        self.assertEqual(
+            self.urls(recursive=True), [f"/stub/{i}" for i in range(6)]
+        )
+        self.assertEqual(self.urls(), ["/stub/0"])
+
+    @unittest.skipUnless(hasattr(os, "symlink"), "no symbolic links")
+    def test_symlink_loop(self):
+        os.symlink(self.root, os.path.join(self.root, "b", "loop"))
+        os.symlink(
+            os.path.join(self.root, "missing"),
+            os.path.join(self.root, "dangling"),
+        )
+        self.assertEqual(
+            self.urls(recursive=True), [f"/stub/{i}" for i in range(6)]
+        )
+
+    def test_unreadable_dir(self):
+        errors = {}
+        missing = os.path.join(self.root, "missing")
+        self.assertEqual(list(iter_dir_mappings(missing, errors=errors)), [])
+        self.assertEqual(list(errors), [missing])
+
+    def test_incremental_parsing(self):
+        path = self.write(
+            "big.json", {"mappings": [stub(i) for i in range(50)]}
+        )
+        with mock.patch.object(loader, "READ_SIZE", 7):
+            mappings = list(iter_file_mappings(path))
+        self.assertEqual(mappings, [stub(i) for i in range(50)])
+
+    def test_failures(self):
+        self.write("broken.json", '{"mappings": [{"request": {}}, {')
+        self.write("other.json", '[{"request": {}}, 3]')
+        errors = {}
+        list(iter_dir_mappings(self.root, errors=errors))
+        self.assertEqual(
+            sorted(errors),
+            [
+                os.path.join(self.root, "broken.json"),
+                os.path.join(self.root, "other.json"),
+            ],
+        )
+
+    def test_populate_from_dir_batches(self):
+        progress = []
+        with requests_mock.Mocker() as m:
+            m.post(f"{WM_URL}/__admin/mappings/import")
+            w = Wiremock(url=WM_URL, import_chunk_size=4)
+            self.write("broken.json", "{")
+            ids = w.populate_from_dir(
+                self.root,
+                bulk=True,
+                recursive=True,
+                progress=progress.append,
+            )
+            self.assertEqual(m.call_count, 2)
+            imported = [
+                len(call.json()["mappings"]) for call in m.request_history
+            ]
+
+        self.assertEqual(imported, [4, 2])
+        self.assertEqual(len(ids), 6)
+        self.assertEqual([p["mappings"] for p in progress], [4, 6])
+        self.assertEqual(
+            list(ids.errors), [os.path.join(self.root, "broken.json")]
+        )
+
+
+class TestProjectedMappings(unittest.TestCase):
+    mappings = [
+        dict(stub(i), id=str(i), metadata={"owner": "epg"}) for i in range(6)
+    ]
+
+    def test_projection(self):
+        document = json.dumps(
+            {"mappings": self.mappings, "meta": {"total": 6}}
+        )
+        with mock.patch.object(loader, "READ_SIZE", 64):
+            projected = list(
+                loader.iter_projected_mappings(io.StringIO(document))
+            )
+        self.assertEqual(len(projected), 6)
+        self.assertEqual(
+            projected[2],
+            {
+                "id": "2",
+                "request": {"method": "GET", "url": "/stub/2"},
+                "response": {"status": 200},
+                "metadata": {"owner": "epg"},
+            },
+        )
+
+    def test_streaming_filter(self):
+        with requests_mock.Mocker() as m:
+            m.get(
+                f"{WM_URL}/__admin/mappings",
+                json={"mappings": self.mappings},
+            )
+            for mapping in self.mappings:
+                m.get(
+                    f"{WM_URL}/__admin/mappings/{mapping['id']}", json=mapping
+                )
+            with Wiremock(url=WM_URL, streaming=True) as w:
+                found = w.filter_mappings({"method": "GET", "url": "/stub/4"})
+                self.assertEqual(found, [self.mappings[4]])
+                found = w.filter_mappings_multi(
+                    [{"url": "/stub/1"}, {"url": "/stub/3"}]
+                )
+                self.assertEqual(
+                    found, [[self.mappings[1]], [self.mappings[3]]]
+                )
+            # one list download per search, then the matches only
+            self.assertEqual(
+                sorted(r.path for r in m.request_history),
+                [
+                    "/__admin/mappings",
+                    "/__admin/mappings",
+                    "/__admin/mappings/1",
+                    "/__admin/mappings/3",
+                    "/__admin/mappings/4",
+                ],
+            )
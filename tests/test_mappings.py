@@ -0,0 +1,240 @@
+import threading
+import time
+import unittest
+
+from chaoswm.mappings import (
+    CompiledFilter,
+    MappingsSnapshot,
+    MultiFilter,
+    make_overlay,
+    recursive_filter,
+    stamp,
+    strict_filter,
+    tagged_pattern,
+    unstamp_modified,
+)
+
+MAPPINGS = [
+    {
+        "id": "1",
+        "request": {"method": "GET", "url": "/epg"},
+        "response": {"status": 200},
+    },
+    {
+        "id": "2",
+        "request": {
+            "method": "POST",
+            "url": "/create/some/thing",
+            "headers": {"Accept": {"contains": "xml"}},
+        },
+        "response": {"status": 201},
+    },
+    {
+        "id": "3",
+        "request": {"method": "GET", "urlPath": "/epg/title"},
+        "response": {"status": 404, "fault": "EMPTY_RESPONSE"},
+    },
+]
+
+STRICT_FILTERS = [
+    {"method": "GET", "url": "/epg"},
+    {"url": "/create/some/thing", "method": "POST"},
+    {"method": "GET"},
+    {"headers": {"Accept": {"contains": "xml"}}},
+    {"method": ["GET", "POST"]},
+    {"url": "/nowhere"},
+]
+
+NON_STRICT_FILTERS = [
+    {"request": {"url": "/epg"}},
+    {"request": {"method": ["GET", "DELETE"]}},
+    {"response": {"status": [201, 404]}},
+    {"request": {"headers": {"Accept": {"contains": "xml"}}}},
+    {"request": {"method": "GET"}, "response": {"fault": "EMPTY_RESPONSE"}},
+    {"response": {"status": [{"unhashable": True}, 200]}},
+    {"metadata": {"tag": "missing"}},
+]
+
+
+class TestCompiledFilters(unittest.TestCase):
+    def test_strict_filters_match_legacy_filter(self):
+        for f in STRICT_FILTERS:
+            compiled = CompiledFilter(f, strict=True)
+            for mapping in MAPPINGS:
+                self.assertEqual(
+                    compiled.match(mapping),
+                    strict_filter(mapping["request"], f),
+                    (f, mapping["id"]),
+                )
+
+    def test_non_strict_filters_match_legacy_filter(self):
+        for f in NON_STRICT_FILTERS:
+            compiled = CompiledFilter(f, strict=False)
+            for mapping in MAPPINGS:
+                try:
+                    expected = recursive_filter(mapping, f)
+                except AttributeError:
+                    # legacy filter fails on nodes missing from the mapping
+                    expected = False
+                self.assertEqual(
+                    compiled.match(mapping), expected, (f, mapping["id"])
+                )
+
+    def test_multi_filter_single_pass(self):
+        multi = MultiFilter(NON_STRICT_FILTERS, strict=False)
+        self.assertEqual(multi.tag(MAPPINGS[2]), [1, 2, 4])
+        selected = multi.select(MAPPINGS)
+        self.assertEqual(
+            [[m["id"] for m in matches] for matches in selected],
+            [["1"], ["1", "3"], ["2", "3"], ["2"], ["3"], ["1"], []],
+        )
+        selected = MultiFilter(STRICT_FILTERS).select(MAPPINGS, limit=1)
+        self.assertEqual(
+            [[m["id"] for m in matches] for matches in selected],
+            [["1"], ["2"], ["1"], ["2"], [], []],
+        )
+
+
+class TestMappingsSnapshot(unittest.TestCase):
+    def test_request_index_follows_local_writes(self):
+        snapshot = MappingsSnapshot()
+        snapshot.open()
+        snapshot.store([dict(m) for m in MAPPINGS])
+
+        request = {"url": "/epg", "method": "GET"}
+        self.assertEqual(snapshot.find_by_request(request)[1]["id"], "1")
+
+        snapshot.replace(
+            {"id": "1", "request": {"method": "GET", "url": "/moved"}}
+        )
+        self.assertEqual(snapshot.find_by_request(request), (True, None))
+
+        snapshot.add({"id": "4", "request": request})
+        snapshot.remove("2")
+        self.assertEqual(snapshot.find_by_request(request)[1]["id"], "4")
+        self.assertEqual([m["id"] for m in snapshot.get()], ["1", "3", "4"])
+
+        snapshot.close()
+        self.assertEqual(snapshot.find_by_request(request), (False, None))
+
+    def test_bulk_remove_is_linear(self):
+        def remove_half(count):
+            snapshot = MappingsSnapshot()
+            snapshot.open()
+            snapshot.store(
+                [
+                    {"id": str(i), "request": {"url": f"/{i % 10}"}}
+                    for i in range(count)
+                ]
+            )
+            start = time.perf_counter()
+            for i in range(0, count, 2):
+                snapshot.remove(str(i))
+            elapsed = time.perf_counter() - start
+            self.assertEqual(len(snapshot.get()), count // 2)
+            snapshot.close()
+            return elapsed
+
+        small, large = remove_half(2000), remove_half(16000)
+        # 8 times the mappings: a quadratic removal takes ~64 times longer
+        self.assertLess(large, max(small, 0.01) * 24)
+
+    def test_blocks_are_per_thread(self):
+        snapshot = MappingsSnapshot()
+        snapshot.open()
+        snapshot.store([dict(m) for m in MAPPINGS])
+        seen = []
+
+        def other_thread():
+            seen.append(snapshot.get())
+            snapshot.open()
+            snapshot.store([])
+            snapshot.close()
+            snapshot.add({"id": "4", "request": {}})
+
+        thread = threading.Thread(target=other_thread)
+        thread.start()
+        thread.join()
+
+        self.assertEqual(seen, [None])
+        self.assertEqual(snapshot.depth, 1)
+        # the write of the other thread made this copy stale
+        self.assertIsNone(snapshot.get())
+        snapshot.close()
+
+
+class TestOverlays(unittest.TestCase):
+    def test_overlay_priority(self):
+        mapping = {"id": "a", "request": {"url": "/a"}, "priority": None}
+        self.assertEqual(make_overlay(mapping)["priority"], 4)
+
+        mapping["priority"] = 3
+        self.assertEqual(make_overlay(mapping)["priority"], 2)
+
+        mapping["priority"] = 1
+        with self.assertLogs("logzero_default", "WARNING"):
+            self.assertEqual(make_overlay(mapping)["priority"], 1)
+
+
+class TestStamp(unittest.TestCase):
+    def test_modified_mappings_recorded_apart(self):
+        created = stamp({"id": "a"}, "exp-1", "populate")
+        self.assertEqual(
+            created["metadata"],
+            {"chaoswm": {"tag": "exp-1", "action": "populate"}},
+        )
+        stamp(created, "exp-1", "update_fault", modified=True)
+        self.assertEqual(
+            created["metadata"]["chaoswm"],
+            {
+                "tag": "exp-1",
+                "action": "populate",
+                "modified": {"tag": "exp-1", "action": "update_fault"},
+            },
+        )
+
+        modified = stamp({"id": "b"}, "exp-1", "fixed_delay", modified=True)
+        self.assertEqual(
+            modified["metadata"],
+            {
+                "chaoswm": {
+                    "modified": {"tag": "exp-1", "action": "fixed_delay"}
+                }
+            },
+        )
+
+    def test_no_tag_no_stamp(self):
+        self.assertEqual(stamp({"id": "a"}, None, "populate"), {"id": "a"})
+
+    def test_unstamp_modified(self):
+        mapping = stamp({"id": "a"}, "exp-1", "up", modified=True)
+        unstamp_modified(mapping)
+        self.assertEqual(mapping, {"id": "a"})
+
+        mapping = stamp({"id": "a"}, "exp-1", "populate")
+        stamp(mapping, "exp-1", "up", modified=True)
+        unstamp_modified(mapping)
+        self.assertEqual(
+            mapping["metadata"],
+            {"chaoswm": {"tag": "exp-1", "action": "populate"}},
+        )
+
+    def test_tagged_pattern(self):
+        self.assertEqual(
+            tagged_pattern(), {"matchesJsonPath": "$.chaoswm[?(@.action)]"}
+        )
+        self.assertEqual(
+            tagged_pattern("exp-1"),
+            {"matchesJsonPath": "$.chaoswm[?(@.tag == 'exp-1')]"},
+        )
+        self.assertEqual(
+            tagged_pattern(modified=True),
+            {"matchesJsonPath": "$.chaoswm.modified"},
+        )
+        self.assertEqual(
+            tagged_pattern("exp-1", "up", modified=True),
+            {
+                "matchesJsonPath": "$.chaoswm.modified[?(@.tag == 'exp-1' "
+                "&& @.action == 'up')]"
+            },
+        )
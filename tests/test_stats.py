@@ -0,0 +1,67 @@
+import unittest
+
+import requests_mock
+
+from chaoswm.driver import Wiremock
+from chaoswm.probes import admin_stats
+from chaoswm.stats import AdminStats, endpoint_of
+
+WM_URL = "http://wiremock.local:8080"
+STUB_ID = "1ad0ffd6-8f4c-4ee3-a6e5-0b0f7a26b7a5"
+
+
+class TestAdminStats(unittest.TestCase):
+    def setUp(self):
+        admin_stats(reset=True)
+
+    def test_endpoint_of(self):
+        self.assertEqual(
+            endpoint_of("put", f"{WM_URL}/__admin/mappings/{STUB_ID}"),
+            "PUT /__admin/mappings/{id}",
+        )
+        self.assertEqual(
+            endpoint_of("GET", f"{WM_URL}/__admin/mappings"),
+            "GET /__admin/mappings",
+        )
+
+    def test_histogram(self):
+        stats = AdminStats()
+        stats.record("GET", f"{WM_URL}/__admin/mappings", 0.0005)
+        stats.record("GET", f"{WM_URL}/__admin/mappings", 100.0, error=True)
+        res = stats.get("GET /__admin/mappings")
+        self.assertEqual(res["calls"], 2)
+        self.assertEqual(res["errors"], 1)
+        self.assertEqual(res["latency_histogram"], {"le_1ms": 1, "inf": 1})
+
+    def test_driver_calls_recorded(self):
+        with requests_mock.Mocker() as m:
+            m.get(
+                f"{WM_URL}/__admin/mappings",
+                json={"mappings": [{"id": STUB_ID}]},
+            )
+            m.put(f"{WM_URL}/__admin/mappings/{STUB_ID}", json={})
+            m.post(f"{WM_URL}/__admin/mappings", status_code=500)
+            with Wiremock(url=WM_URL) as w:
+                w.mappings()
+                w.update_mapping(STUB_ID, {"id": STUB_ID})
+                w.add_mapping({"request": {}})
+
+        stats = admin_stats(reset=True)
+        endpoints = stats["endpoints"]
+        self.assertEqual(
+            sorted(endpoints),
+            [
+                "GET /__admin/mappings",
+                "POST /__admin/mappings",
+                "PUT /__admin/mappings/{id}",
+            ],
+        )
+        self.assertEqual(stats["totals"]["calls"], 3)
+        self.assertEqual(stats["totals"]["errors"], 1)
+        self.assertGreater(
+            endpoints["GET /__admin/mappings"]["bytes_received"], 0
+        )
+        self.assertGreater(
+            endpoints["PUT /__admin/mappings/{id}"]["bytes_sent"], 0
+        )
+        self.assertEqual(admin_stats()["totals"]["calls"], 0)